@@ -0,0 +1,99 @@
+"""
+Log parser throughput benchmark.
+
+    python benchmarks/log_parser.py [--lines N] [--min-rate LINES_PER_SEC] [--workers N]
+
+Parses a generated log of each format on a single core and prints lines
+per second. Access logs are measured twice: with a handful of request
+paths, and with a different path on nearly every line (the dictionary
+encoding that pays off for the first does not for the second). Exits
+non-zero if the Apache fast path falls below --min-rate (1M lines/sec by
+default) on the first. With --workers, each format is also parsed from
+a file split across that many worker processes.
+
+Before timing anything it checks that the fast path agrees with the regex
+path on access log lines that are easy to get wrong (a "-" request from a
+408, a request without protocol, a non-numeric size).
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+from portfolio_engine.logs import LOG_FORMATS, benchmark_parser, generate_sample_log, parse_log  # noqa: E402
+
+EDGE_CASES = '\n'.join([
+    '10.0.0.1 - - [10/Oct/2023:13:55:36 +0000] "-" 408 -',
+    '10.0.0.2 - - [10/Oct/2023:13:55:37 +0000] "GET /a HTTP/1.1" 200 12x',
+    '10.0.0.3 - - [10/Oct/2023:13:55:38 +0000] "GET /b" 200 5',
+    '10.0.0.4 - - [10/Oct/2023:13:55:39 +0000] "GET /c HTTP/1.1" 200 7',
+])
+
+
+def check_edge_cases():
+    """Whether the fast and regex paths parse EDGE_CASES the same"""
+    fast = parse_log(EDGE_CASES, 'apache', fast=True)
+    regex = parse_log(EDGE_CASES, 'apache', fast=False)
+    try:
+        pd.testing.assert_frame_equal(fast.frame.astype(object), regex.frame.astype(object))
+    except AssertionError as e:
+        print(f"FAIL: fast and regex paths disagree on edge cases:\n{e}")
+        return False
+    if (fast.lines, len(fast.bad_lines)) != (regex.lines, len(regex.bad_lines)):
+        print(f"FAIL: {fast.lines} lines/{len(fast.bad_lines)} bad on the fast path, "
+              f"{regex.lines}/{len(regex.bad_lines)} on the regex path")
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--min-rate', type=float, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=0)
+    args = parser.parse_args()
+
+    if not check_edge_cases():
+        return 1
+
+    try:
+        import pyarrow as pa
+        # One core: the claim is per core, not per machine
+        pa.set_cpu_count(1)
+        pa.set_io_thread_count(1)
+    except ImportError:
+        print("pyarrow is not installed; only the regex path can be measured")
+
+    results = {}
+    for log_format, label in LOG_FORMATS.items():
+        result = benchmark_parser(log_format, args.lines, args.repeat)
+        results[log_format] = result
+        path = 'fast path' if result['fast_path'] else 'regex path'
+        print(f"{label:<16} {result['lines']:>10,} lines  {result['seconds']:7.3f}s  "
+              f"{result['lines_per_second']:>12,.0f} lines/s  ({path})")
+        if args.workers > 1:
+            parallel = benchmark_parser(log_format, args.lines, args.repeat, workers=args.workers)
+            print(f"{'':<16} {args.workers:>4} workers  {parallel['seconds']:7.3f}s  "
+                  f"{parallel['lines_per_second']:>12,.0f} lines/s  "
+                  f"({parallel['lines_per_second'] / result['lines_per_second']:.1f}x)")
+        if log_format == 'apache':
+            unique = benchmark_parser(log_format, args.lines, args.repeat,
+                                      data=generate_sample_log(log_format, args.lines, unique_paths=True))
+            print(f"{'  unique paths':<16} {unique['lines']:>10,} lines  {unique['seconds']:7.3f}s  "
+                  f"{unique['lines_per_second']:>12,.0f} lines/s")
+
+    apache_rate = results['apache']['lines_per_second']
+    if apache_rate < args.min_rate:
+        print(f"FAIL: apache parsing at {apache_rate:,.0f} lines/s is below {args.min_rate:,.0f}")
+        return 1
+    print(f"OK: apache parsing at {apache_rate:,.0f} lines/s per core")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Metrics ingestion load test for the infrastructure dashboard.
+
+    python benchmarks/metrics_ingest.py [--hosts N] [--rate POINTS_PER_SEC] [--seconds N] [--min-rate PER_MIN]
+
+Writes synthetic CPU, memory, disk I/O, traffic and latency samples for
+--hosts simulated hosts into a MetricStore, through the same append path
+as the dashboard's MetricsFeed, at --rate points per second (0 for as fast
+as possible). Prints the sustained ingest rate, batch latency percentiles
+(from when each batch was due, so queueing behind slow writes counts)
+and memory per series. Exits non-zero if the sustained rate falls below
+--min-rate points per minute (the dashboard's 10K/minute by default).
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from portfolio_engine.live import generate_metrics_load  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hosts', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=0, help="target points per second, 0 for unthrottled")
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--batch', type=float, default=0.1, help="seconds between writes")
+    parser.add_argument('--min-rate', type=float, default=10_000)
+    args = parser.parse_args()
+
+    result = generate_metrics_load(hosts=args.hosts, rate=args.rate or None, seconds=args.seconds,
+                                   batch_seconds=args.batch)
+    target = f"{args.rate * 60:,.0f}/min target" if args.rate else "unthrottled"
+    print(f"{result['hosts']:,} hosts, {result['series']:,} series, {target}")
+    print(f"  sustained  {result['points_per_second']:>14,.0f} points/s  "
+          f"{result['points_per_minute']:>16,.0f} points/min  ({result['points']:,} in {result['seconds']:.1f}s)")
+    print(f"  writes     {result['write_points_per_second']:>14,.0f} points/s while writing")
+    print(f"  latency    p50 {result['p50_ms']:.2f} ms  p99 {result['p99_ms']:.2f} ms  "
+          f"max {result['max_ms']:.2f} ms  ({result['batches']:,} batches)")
+    print(f"  memory     {result['used_bytes_per_series']:,.0f} B/series used, "
+          f"{result['bytes_per_series'] / 1024:,.1f} KB allocated ({result['raw_bytes_per_series'] / 1024:,.1f} KB raw)")
+
+    if result['points_per_minute'] < args.min_rate:
+        print(f"FAIL: sustained {result['points_per_minute']:,.0f} points/min is below {args.min_rate:,.0f}")
+        return 1
+    print(f"OK: sustained {result['points_per_minute']:,.0f} points/min")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+Before/after index benchmark for the SQL demo examples.
+
+    python benchmarks/sql_indexes.py [--example NAME] [--scales N,N,...] [--repeat N]
+
+Times an example from portfolio_engine.sql against generated databases of
+each scale (orders; customers are a tenth), with and without the
+candidate indexes, and prints median/p95 latency and the plan changes.
+Databases are generated on first use and kept in SQL_DEMO_DIR.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from portfolio_engine.sql import BENCHMARK_SCALES, INDEXES, SQL_EXAMPLES, benchmark_indexes, plan_diff  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--example', default='Performance Optimization', choices=list(SQL_EXAMPLES))
+    parser.add_argument('--scales', default=','.join(str(n) for n in BENCHMARK_SCALES))
+    parser.add_argument('--indexes', default=','.join(INDEXES))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--budget', type=float, default=10.0, help="seconds of timing per setting")
+    args = parser.parse_args()
+
+    scales = [int(float(n)) for n in args.scales.split(',')]
+    results = benchmark_indexes(SQL_EXAMPLES[args.example], scales, args.indexes.split(','), args.repeat,
+                                args.budget, progress=lambda step: print(f"  {step}", file=sys.stderr))
+    print(f"{args.example}")
+    for row in results.itertuples():
+        print(f"{row.orders:>12,} orders  {row.indexes:<8} median {row.median_ms:10.2f} ms  "
+              f"p95 {row.p95_ms:10.2f} ms  ({row.runs} runs, {row.speedup:.2f}x)")
+    for orders, runs in results.groupby('orders'):
+        plans = runs.set_index('indexes')['plan']
+        print(f"\nPlan change at {orders:,} orders:")
+        print(plan_diff(plans['without'], plans['with']) or "  none")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
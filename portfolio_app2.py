@@ -14,8 +14,36 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import json
+import multiprocessing
+import os
+import tempfile
+import threading
 import time
 import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from portfolio_engine.etl import (
+    LoadManifest, RunCheckpoint, SQLiteSink, append_sample_delivery, run_pipeline, write_sample_batch
+)
+from portfolio_engine.ingest import stream_csv_profile, profile_dataframe
+from portfolio_engine.live import LogFeed, MetricsFeed, generate_metrics_load
+from portfolio_engine.rollups import Rollup
+from portfolio_engine.search import MessageIndex, index_path
+from portfolio_engine.sql import (
+    BENCHMARK_SCALES, CHUNKED_CLEANING, INDEXES, SQL_EXAMPLES, DemoDatabase, benchmark_indexes, clean_chunked,
+    copy_table, plan_diff
+)
+from portfolio_engine.templates import TemplateMiner
+from portfolio_engine.logs import (
+    BAD_LINE_SAMPLES, LOG_FORMATS, LogFormatError, append_sample_log, benchmark_parser,
+    generate_sample_log, log_compression, log_path_under, log_sources, parse_log, parse_log_file, stream_logs
+)
+from portfolio_engine.storage import (
+    profile_upload_cached, read_upload_cached, spill_dataset
+)
+from portfolio_engine.validation import report_frame
 
 # Page configuration
 st.set_page_config(
@@ -105,6 +133,279 @@ def load_sample_data(data_type):
             'conversion_rate': np.random.normal(0.05, 0.02, 90).clip(0, 1)
         })
 
+def show_profile_metrics(profile, slots):
+    """Render the quick stats of a (possibly still loading) CSV profile"""
+    slots[0].metric("Rows", f"{profile.rows:,}")
+    slots[1].metric("Columns", len(profile.columns))
+    slots[2].metric("Missing", f"{profile.missing_total:,}")
+    # Footprint after dtype optimization, compared with plain pd.read_csv
+    saved = None
+    if profile.memory_reduction > 0:
+        saved = f"-{profile.memory_reduction:.0%} vs {profile.raw_memory_bytes / 1024 / 1024:.1f} MB raw"
+    slots[3].metric("Size", f"{profile.memory_bytes / 1024 / 1024:.1f} MB", saved, delta_color="inverse")
+
+def stream_upload_profile(uploaded_file, slots):
+    """Profile an upload chunk by chunk, refreshing the quick stats as each chunk lands"""
+    progress_bar = st.progress(0.0)
+    profile = None
+    for profile in stream_csv_profile(uploaded_file):
+        show_profile_metrics(profile, slots)
+        progress_bar.progress(profile.progress or 0.0)
+    progress_bar.empty()
+    return profile
+
+def show_upload_profile(uploaded_file, slots):
+    """Stream-profile an upload once; later reruns and sessions reuse the (read-only) profile"""
+    profile, cached = profile_upload_cached(uploaded_file, lambda upload: stream_upload_profile(upload, slots),
+                                            st.session_state.setdefault('upload_digests', {}))
+    if cached:
+        show_profile_metrics(profile, slots)
+    return profile
+
+@st.cache_resource
+def get_etl_executor():
+    """Worker processes shared by every ETL run on this server"""
+    # spawn, not fork: forking the threaded Streamlit server is unsafe
+    return ProcessPoolExecutor(
+        max_workers=min(4, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context('spawn')
+    )
+
+@st.cache_resource
+def get_log_executor():
+    """Worker processes for parallel log parsing, one per core"""
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+
+LIVE_LOG_PATH = Path(tempfile.gettempdir()) / 'portfolio_live_logs' / 'app.log'
+# Server-side log paths typed into the app must stay under this directory
+LOG_ROOT = Path(os.environ.get('LOG_ROOT') or LIVE_LOG_PATH.parent).expanduser().resolve()
+LIVE_LOG_BUCKETS = 180
+REFRESH_OPTIONS = ['Off', '1s', '2s', '5s', '10s']
+
+# st.fragment (Streamlit 1.37+) reruns just one region of the page on a timer
+FRAGMENT = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None)
+
+def refresh_seconds(option):
+    """Seconds between refreshes for a REFRESH_OPTIONS choice, None for off"""
+    return None if option == 'Off' else int(option.rstrip('s'))
+
+def live_region(run_every):
+    """Decorator rerunning only the decorated region every run_every seconds
+
+    Without fragment support the region is a plain function, and
+    refresh_fallback() reruns the whole page instead.
+    """
+    if FRAGMENT is None:
+        return lambda render: render
+    return FRAGMENT(run_every=run_every)
+
+def refresh_fallback(run_every):
+    """Whole-page timed rerun, only for Streamlit versions without fragments"""
+    if FRAGMENT is None and run_every:
+        time.sleep(run_every)
+        st.rerun()
+
+# Points per second for each choice; None writes as fast as possible
+LOAD_TEST_RATES = {'10K': 10_000 / 60, '100K': 100_000 / 60, '1M': 1_000_000 / 60, '10M': 10_000_000 / 60,
+                   'Max': None}
+GRAFANA_RANGES = {'1 hour': '1h', '6 hours': '6h', '24 hours': '1D', '7 days': '7D', '14 days': '14D'}
+
+@st.cache_resource
+def get_metrics_feed():
+    """Synthetic metrics of 50 hosts produced in the background for every viewer, two weeks backfilled"""
+    return MetricsFeed(interval=1.0, hosts=50)
+
+SQL_CUSTOMER_SIZES = [1_000, 5_000, 50_000, 500_000]
+SQL_ORDER_SIZES = [10_000, 50_000, 500_000, 5_000_000]
+
+@st.cache_resource(max_entries=4, show_spinner="Generating customers and orders...")
+def get_sql_database(customers, orders):
+    """Generated customers/orders database, built once per size and server, with the ETL warehouse attached"""
+    return DemoDatabase(customers, orders, attach={'warehouse': WAREHOUSE_PATH})
+
+ETL_STATE_DIR = Path(tempfile.gettempdir()) / 'portfolio_etl_state'
+WAREHOUSE_PATH = ETL_STATE_DIR / 'warehouse.db'
+WAREHOUSE_TABLE = 'sales_data'
+
+# Kept up to date by the ETL loader as it inserts each batch, so reports never scan the sales table
+SALES_ROLLUPS = {
+    'month_region': Rollup('sales_by_month_region', month_column='order_date', dimensions=['region'],
+                           sums=['sales_amount', 'quantity_sold'], distinct='customer_id'),
+    'month': Rollup('sales_by_month', month_column='order_date',
+                    sums=['sales_amount', 'quantity_sold'], distinct='customer_id'),
+    'totals': Rollup('sales_totals', sums=['sales_amount', 'quantity_sold'], distinct='customer_id'),
+}
+
+def open_warehouse_sink():
+    return SQLiteSink(WAREHOUSE_PATH, WAREHOUSE_TABLE, rollups=SALES_ROLLUPS.values())
+
+# Read what the ETL pipeline loaded; their cached results go stale on every load
+WAREHOUSE_REPORT_SQL = """
+-- Sales loaded by the ETL pipeline, by region, from the month x region rollup
+SELECT 
+    region,
+    SUM(rows) as orders,
+    SUM(sales_amount) as total_sales,
+    SUM(sales_amount) / SUM(rows) as avg_sale
+FROM warehouse.sales_by_month_region
+GROUP BY region
+ORDER BY total_sales DESC;
+"""
+
+WAREHOUSE_GROWTH_SQL = """
+-- Month-over-month growth by region, from the month x region rollup
+WITH monthly_sales AS (
+    SELECT month, region, sales_amount as total
+    FROM warehouse.sales_by_month_region
+)
+SELECT 
+    month,
+    region,
+    total,
+    LAG(total) OVER (PARTITION BY region ORDER BY month) as prev_month,
+    ROUND(100.0 * (total - LAG(total) OVER (PARTITION BY region ORDER BY month))
+          / LAG(total) OVER (PARTITION BY region ORDER BY month), 1) as growth_pct
+FROM monthly_sales
+ORDER BY region, month;
+"""
+
+# The same report straight off the loaded rows, for comparison
+WAREHOUSE_SCAN_SQL = f"""
+-- Sales by region, scanning every loaded row
+SELECT 
+    region,
+    COUNT(*) as orders,
+    SUM(sales_amount) as total_sales,
+    SUM(sales_amount) / COUNT(*) as avg_sale
+FROM warehouse.{WAREHOUSE_TABLE}
+GROUP BY region
+ORDER BY total_sales DESC;
+"""
+
+def load_sales_rollups():
+    """The warehouse's sales rollups as DataFrames, or None before the ETL pipeline has loaded anything"""
+    if not WAREHOUSE_PATH.exists():
+        return None
+    conn = sqlite3.connect(f"file:{WAREHOUSE_PATH}?mode=ro", uri=True)
+    try:
+        frames = {key: rollup.read(conn) for key, rollup in SALES_ROLLUPS.items()}
+    finally:
+        conn.close()
+    if any(frame is None or frame.empty for frame in frames.values()):
+        return None
+    return frames
+
+# Validation rules for the sales feed; columns a file lacks are skipped
+SALES_RULES = {
+    'Order Date': {'type': 'date'},
+    'Product': {'regex': r'Product [A-Z]', 'action': 'warn'},
+    'Region': {'in': ['North', 'South', 'East', 'West'], 'action': 'warn'},
+    'Sales Amount': {'type': 'numeric', 'min': 0},
+    'Quantity Sold': {'type': 'integer', 'min': 0},
+    'Customer ID': {'type': 'integer', 'min': 1},
+}
+
+@st.cache_resource
+def get_sample_batch():
+    """Messy multi-file sales batch for the ETL demo, written once per server"""
+    return write_sample_batch(Path(tempfile.gettempdir()) / 'portfolio_etl_sample')
+
+@st.cache_resource
+def get_load_manifest():
+    """Incremental-load manifest shared by every session, with its run lock"""
+    manifest = LoadManifest(ETL_STATE_DIR / 'manifest.json')
+    return manifest, threading.Lock()
+
+@st.cache_resource
+def get_run_checkpoint():
+    """Checkpoint of the current ETL run; guarded by the manifest's lock"""
+    return RunCheckpoint(ETL_STATE_DIR / 'checkpoint.json')
+
+def run_etl_with_progress(sources, incremental=False):
+    """Run the ETL pipeline over sources and render its real timings"""
+    progress_bar = st.progress(0.0)
+    status_text = st.empty()
+    
+    def on_file_done(done, total, file_result):
+        status_text.text(f"Loaded {file_result['name']} ({done}/{total} files)")
+        progress_bar.progress(done / total)
+    
+    manifest, manifest_lock = get_load_manifest()
+    checkpoint = get_run_checkpoint()
+    with manifest_lock:
+        sink = open_warehouse_sink()
+        # A run that was cut short (error, closed tab) over the same files picks up where it stopped
+        resume = checkpoint.pending and any(checkpoint.position(source) for source in sources)
+        if resume:
+            # Either mode resumes the same way: a full run reset the table and manifest when it started
+            st.info("▶️ Resuming an interrupted run from its last checkpoint")
+        else:
+            checkpoint.clear()
+            checkpoint.meta = {'incremental': incremental}
+            if not incremental:
+                # A full run replaces the table instead of appending duplicates
+                sink.reset()
+                manifest.reset()
+        result = run_pipeline(sources, sink=sink, executor=get_etl_executor(), on_file_done=on_file_done,
+                              manifest=manifest, rules=SALES_RULES, checkpoint=checkpoint)
+    progress_bar.progress(1.0)
+    status_text.empty()
+    
+    if result.skipped_files:
+        st.info(f"⏭️ Skipped {len(result.skipped_files)} unchanged files: {', '.join(result.skipped_files)}")
+    if result.resumed_files:
+        st.info(f"▶️ Resumed {len(result.resumed_files)} files from the checkpoint: {', '.join(result.resumed_files)}")
+    if result.failed_files:
+        for file_result in result.failed_files:
+            st.warning(f"⚠️ Skipped {file_result['name']}: {file_result['error']}")
+    if result.quarantined_chunks:
+        st.warning(f"🚧 Quarantined {len(result.quarantined_chunks)} corrupt chunks; the rest of the batch was loaded")
+        st.dataframe(pd.DataFrame(result.quarantined_chunks), use_container_width=True)
+    if result.files:
+        st.success(f"✅ ETL pipeline completed on {len(result.files)} files (worker processes: {result.workers})")
+    else:
+        st.success("✅ Nothing new to load: every file is unchanged since the last run")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("Records Processed", f"{result.rows_read:,}", f"{result.rows_loaded:,} new rows loaded")
+    with col2:
+        st.metric("Processing Time", f"{result.wall_seconds:.2f} seconds")
+    with col3:
+        st.metric("Data Quality Score", f"{result.quality_score:.1%}")
+    with col4:
+        st.metric("Load Throughput", f"{sink.rows_per_second:,.0f} rows/s",
+                  f"{sink.rows_per_second * 3600 / 1e6:,.1f}M rows/hour", delta_color="off")
+    
+    st.caption(f"Loaded into `{WAREHOUSE_TABLE}` in {WAREHOUSE_PATH} "
+               f"({sink.rows:,} rows inserted in {sink.seconds:.2f}s)")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        fig = px.bar(result.stage_timings(), x='stage', y='seconds',
+                    title='Time per Stage (summed across workers)')
+        st.plotly_chart(fig, use_container_width=True)
+    
+    with col2:
+        st.markdown("#### 📂 Per-file Results")
+        st.dataframe(result.file_summary(), use_container_width=True)
+    
+    validation = result.validation_report()
+    if validation:
+        st.markdown("#### ✅ Validation Rules")
+        st.dataframe(report_frame(validation), use_container_width=True)
+        for entry in validation:
+            if entry['violations']:
+                with st.expander(f"{entry['rule']}: {entry['violations']:,} violations ({entry['action']})"):
+                    st.dataframe(entry['sample'], use_container_width=True)
+    
+    return result
+
 def main():
     """Main application"""
     
@@ -359,70 +660,175 @@ def show_grafana_demo():
         """, unsafe_allow_html=True)
     
     # Live metrics demo
-    st.markdown("### 📊 Live Infrastructure Metrics")
-    
-    col1, col2, col3, col4 = st.columns(4)
+    col1, col2 = st.columns([3, 1])
     
     with col1:
-        cpu_usage = np.random.normal(45, 15)
-        st.metric("CPU Usage", f"{cpu_usage:.1f}%", f"{np.random.uniform(-2, 2):.1f}%")
+        st.markdown("### 📊 Live Infrastructure Metrics")
     
     with col2:
-        memory_usage = np.random.normal(60, 20)
-        st.metric("Memory Usage", f"{memory_usage:.1f}%", f"{np.random.uniform(-1, 3):.1f}%")
-    
-    with col3:
-        requests_per_min = np.random.poisson(100)
-        st.metric("Requests/min", f"{requests_per_min:,}", f"{np.random.randint(-20, 50)}")
-    
-    with col4:
-        response_time = np.random.exponential(100)
-        st.metric("Response Time", f"{response_time:.0f}ms", f"{np.random.randint(-30, 20)}ms")
-    
-    # Sample infrastructure chart
-    dates = pd.date_range('2024-01-01', periods=48, freq='H')
-    metrics_data = pd.DataFrame({
-        'timestamp': dates,
-        'cpu_usage': np.random.normal(45, 15, 48).clip(0, 100),
-        'memory_usage': np.random.normal(60, 20, 48).clip(0, 100),
-        'response_time': np.random.exponential(100, 48)
-    })
+        refresh = st.selectbox("Auto-refresh:", REFRESH_OPTIONS, index=REFRESH_OPTIONS.index('5s'),
+                               key='grafana_refresh')
     
-    col1, col2 = st.columns(2)
+    time_range = st.radio("Time range:", list(GRAFANA_RANGES), horizontal=True, key='grafana_range')
     
-    with col1:
-        fig1 = px.line(metrics_data, x='timestamp', y=['cpu_usage', 'memory_usage'],
-                      title='System Performance - Last 48 Hours')
-        st.plotly_chart(fig1, use_container_width=True)
+    feed = get_metrics_feed().touch()
+    run_every = refresh_seconds(refresh)
     
-    with col2:
-        fig2 = px.line(metrics_data, x='timestamp', y='response_time',
-                      title='Response Time Trend')
-        st.plotly_chart(fig2, use_container_width=True)
+    @live_region(run_every)
+    def live_metrics():
+        store = feed.touch().store
+        if store.newest is None:
+            st.info("Collecting metrics (backfilling history)...")
+            return
+        newest = pd.Timestamp(store.newest)
+        
+        # Cards: fleet-wide latest values against the minute before
+        def card(metric, total=False):
+            latest = store.latest(metric)['value']
+            minutes = store.fleet(metric, start=newest - pd.Timedelta(minutes=2), step='1min')
+            per_host = minutes['mean'] * (len(latest) if total else 1)
+            value = latest.sum() if total else latest.mean()
+            return value, (value - per_host.iloc[-2]) if len(per_host) >= 2 else 0.0
+        
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            cpu, delta = card('cpu_usage')
+            st.metric("CPU Usage", f"{cpu:.1f}%", f"{delta:+.1f}%")
+        
+        with col2:
+            memory, delta = card('memory_usage')
+            st.metric("Memory Usage", f"{memory:.1f}%", f"{delta:+.1f}%")
+        
+        with col3:
+            requests, delta = card('requests_per_min', total=True)
+            st.metric("Requests/min", f"{requests:,.0f}", f"{delta:+,.0f}")
+        
+        with col4:
+            response, delta = card('response_time')
+            st.metric("Response Time", f"{response:.0f}ms", f"{delta:+.0f}ms", delta_color="inverse")
+        
+        # Charts read the rollup tier that fits the range, never the raw points
+        start = newest - pd.Timedelta(GRAFANA_RANGES[time_range])
+        query_start = time.perf_counter()
+        cpu = store.fleet('cpu_usage', start=start)
+        memory = store.fleet('memory_usage', start=start)
+        response = store.fleet('response_time', start=start)
+        disk = store.query('disk_io', start=start, agg='max')
+        query_ms = (time.perf_counter() - query_start) * 1000
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            performance = pd.DataFrame({'cpu_usage': cpu['mean'], 'memory_usage': memory['mean']})
+            fig1 = px.line(performance, y=['cpu_usage', 'memory_usage'],
+                          title=f'System Performance - {time_range} (fleet mean)')
+            st.plotly_chart(fig1, use_container_width=True)
+        
+        with col2:
+            fig2 = px.line(response, y=['mean', 'max'],
+                          title='Response Time Trend (ms)')
+            st.plotly_chart(fig2, use_container_width=True)
+        
+        fig3 = px.imshow(disk.T, aspect='auto', color_continuous_scale='Viridis',
+                         labels={'x': 'time', 'y': 'host', 'color': 'MB/s'},
+                         title='Disk I/O by Host (peak per bucket)')
+        st.plotly_chart(fig3, use_container_width=True)
+        
+        stats = store.stats()
+        st.caption(f"{len(store.hosts()):,} hosts, {stats['series']:,} series, {stats['points']:,} points stored; "
+                   f"queried {cpu.size + memory.size + response.size + disk.size:,} cells at "
+                   f"{cpu.attrs['step'] // 60}m resolution in {query_ms:.1f} ms")
+    
+    live_metrics()
+    show_ingest_load_test()
+    refresh_fallback(run_every)
+
+def show_ingest_load_test():
+    """Load test of the metrics ingestion path the dashboard above reads from"""
+    with st.expander("🔥 Ingestion Load Test"):
+        st.markdown("Simulated hosts write CPU, memory, disk I/O, traffic and latency samples through "
+                    "the same store writes as the live feed, into a separate store.")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            hosts = st.select_slider("Hosts:", [50, 200, 1000], value=50, key='load_hosts')
+        with col2:
+            rate = st.selectbox("Rate (points/min):", list(LOAD_TEST_RATES), index=1, key='load_rate')
+        with col3:
+            seconds = st.slider("Duration (s):", 5, 60, 10, key='load_seconds')
+        
+        if st.button("🚀 Run Load Test"):
+            progress_bar = st.progress(0.0)
+            result = generate_metrics_load(hosts=hosts, rate=LOAD_TEST_RATES[rate], seconds=seconds,
+                                           progress=progress_bar.progress)
+            progress_bar.empty()
+            
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Sustained Ingest", f"{result['points_per_minute']:,.0f}/min",
+                          f"{result['points_per_second']:,.0f} points/s", delta_color="off")
+            with col2:
+                st.metric("p99 Batch Latency", f"{result['p99_ms']:.2f} ms",
+                          f"p50 {result['p50_ms']:.2f} ms", delta_color="off")
+            with col3:
+                st.metric("Memory per Series", f"{result['used_bytes_per_series']:,.0f} B",
+                          f"{result['bytes_per_series'] / 1024:,.1f} KB allocated, {result['series']:,} series",
+                          delta_color="off")
+            with col4:
+                st.metric("Write Capacity", f"{result['write_points_per_second'] * 60:,.0f}/min",
+                          "writes alone", delta_color="off")
+            
+            latencies = pd.DataFrame({'batch': np.arange(result['batches']), 'ms': result['latencies_ms']})
+            fig = px.line(latencies, x='batch', y='ms', title='Write Latency per Batch')
+            st.plotly_chart(fig, use_container_width=True)
+            st.caption(f"{result['points']:,} points in {result['batches']:,} batches over {result['seconds']:.1f}s; "
+                       "latency runs from when a batch was due until its write returned")
+            if result['batches'] < 100:
+                st.caption(f"⚠️ Only {result['batches']} batches: p99 is close to the slowest single batch. "
+                           "Run longer or at a higher rate for a steadier percentile.")
 
 def show_powerbi_demo():
     """Power BI Analytics Demo"""
     
     st.markdown("## 📈 Power BI Sales Analytics")
     
-    # Load sales data
-    sales_data = load_sample_data("sales")
+    # Read the ETL warehouse's rollups when there are any: O(months x regions), whatever was loaded
+    rollups = load_sales_rollups()
+    if rollups is None:
+        st.caption("Sample data; run the ETL pipeline to chart the loaded warehouse instead")
+        sales_data = load_sample_data("sales")
+        sales_data['month'] = sales_data['date'].dt.to_period('M').dt.to_timestamp().dt.strftime('%Y-%m-01')
+        monthly = sales_data.groupby('month').agg(rows=('sales_amount', 'size'),
+                                                  sales_amount=('sales_amount', 'sum'),
+                                                  customer_id=('customer_id', 'nunique')).reset_index()
+        region_sales = sales_data.groupby('region')['sales_amount'].sum()
+        totals = {'rows': len(sales_data), 'sales_amount': sales_data['sales_amount'].sum(),
+                  'customer_id': sales_data['customer_id'].nunique()}
+    else:
+        st.caption(f"Warehouse rollups of `{WAREHOUSE_TABLE}`, maintained by the ETL loader")
+        monthly = rollups['month']
+        region_sales = rollups['month_region'].groupby('region')['sales_amount'].sum()
+        totals = rollups['totals'].iloc[0]
+    
+    # Deltas compare the latest month with the one before
+    def month_delta(values):
+        if len(values) < 2 or not values.iloc[-2]:
+            return None
+        return f"{values.iloc[-1] / values.iloc[-2] - 1:+.1%} MoM"
+    
+    average = monthly['sales_amount'] / monthly['rows'].where(monthly['rows'] > 0)
     
     # KPI Cards
     col1, col2, col3, col4 = st.columns(4)
     
-    total_sales = sales_data['sales_amount'].sum()
-    avg_order = sales_data['sales_amount'].mean()
-    total_customers = sales_data['customer_id'].nunique()
-    
     with col1:
-        st.metric("Total Sales", f"${total_sales:,.0f}", "+12.5%")
+        st.metric("Total Sales", f"${totals['sales_amount']:,.0f}", month_delta(monthly['sales_amount']))
     
     with col2:
-        st.metric("Average Order", f"${avg_order:.0f}", "+5.2%")
+        st.metric("Average Order", f"${totals['sales_amount'] / max(totals['rows'], 1):.0f}", month_delta(average))
     
     with col3:
-        st.metric("Unique Customers", f"{total_customers:,}", "+8.7%")
+        st.metric("Unique Customers", f"{int(totals['customer_id']):,}", month_delta(monthly['customer_id']))
     
     with col4:
         conversion_rate = 0.045
@@ -433,14 +839,12 @@ def show_powerbi_demo():
     
     with col1:
         # Monthly sales trend
-        monthly_sales = sales_data.groupby(sales_data['date'].dt.to_period('M'))['sales_amount'].sum()
-        fig1 = px.line(x=monthly_sales.index.astype(str), y=monthly_sales.values,
+        fig1 = px.line(x=monthly['month'], y=monthly['sales_amount'],
                       title='Monthly Sales Trend')
         st.plotly_chart(fig1, use_container_width=True)
     
     with col2:
         # Sales by region
-        region_sales = sales_data.groupby('region')['sales_amount'].sum()
         fig2 = px.pie(values=region_sales.values, names=region_sales.index,
                      title='Sales by Region')
         st.plotly_chart(fig2, use_container_width=True)
@@ -512,12 +916,20 @@ def show_etl_demo():
     data validation and error handling.
     """)
     
+    incremental = st.checkbox("Incremental load (skip files and rows loaded by earlier runs)", value=True)
+    
     # File upload demo
-    uploaded_file = st.file_uploader("Upload CSV for processing", type=['csv'])
+    uploaded_files = st.file_uploader("Upload CSVs for processing", type=['csv'],
+                                      accept_multiple_files=True)
     
-    if uploaded_file is not None:
+    if uploaded_files:
         try:
-            df = pd.read_csv(uploaded_file)
+            uploaded_file = uploaded_files[0]
+            if len(uploaded_files) > 1:
+                names = [f.name for f in uploaded_files]
+                uploaded_file = uploaded_files[names.index(st.selectbox("Inspect file:", names))]
+            
+            df = read_upload_cached(uploaded_file, st.session_state.setdefault('upload_digests', {}))
             
             st.success(f"✅ Successfully loaded {len(df)} rows, {len(df.columns)} columns")
             
@@ -538,43 +950,158 @@ def show_etl_demo():
             
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
+        
+        if st.button("⚡ Run ETL Pipeline"):
+            run_etl_with_progress([(f.name, f.getvalue()) for f in uploaded_files], incremental)
     
     else:
         # Show sample processing with generated data
-        if st.button("🎲 Demo with Sample Data"):
-            sample_data = load_sample_data("sales")
-            
-            st.success("✅ Processing sample sales data...")
-            
-            # Processing steps simulation
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            steps = [
-                "Loading data...",
-                "Validating schema...", 
-                "Cleaning missing values...",
-                "Removing duplicates...",
-                "Applying transformations...",
-                "Loading to database..."
-            ]
-            
-            for i, step in enumerate(steps):
-                status_text.text(step)
-                time.sleep(0.5)
-                progress_bar.progress((i + 1) * 100 // len(steps))
-            
-            st.success("✅ ETL pipeline completed successfully!")
-            
-            # Show results
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                st.metric("Records Processed", f"{len(sample_data):,}")
-            with col2:
-                st.metric("Processing Time", "2.3 seconds")
-            with col3:
-                st.metric("Data Quality Score", "98.5%")
+        sample_files = get_sample_batch()
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            run_demo = st.button("🎲 Demo with Sample Data")
+        with col2:
+            if st.button("📦 Simulate New Delivery"):
+                target = sample_files[np.random.randint(len(sample_files))]
+                rows = append_sample_delivery(target, rows=np.random.randint(200, 2000))
+                st.info(f"Appended {rows:,} new rows to {target.name}")
+        with col3:
+            if st.button("💥 Simulate Corrupt Delivery"):
+                target = sample_files[np.random.randint(len(sample_files))]
+                rows = append_sample_delivery(target, rows=np.random.randint(200, 2000), corrupt=True)
+                st.info(f"Appended {rows:,} rows with a malformed line to {target.name}")
+        with col4:
+            if st.button("🧹 Reset Load State"):
+                manifest, manifest_lock = get_load_manifest()
+                with manifest_lock:
+                    manifest.reset()
+                    get_run_checkpoint().clear()
+                    sink = open_warehouse_sink()
+                    sink.reset()
+                    sink.close()
+                # Rewrite the sample files too, dropping simulated deliveries
+                get_sample_batch.clear()
+                sample_files = get_sample_batch()
+                st.info("Load state cleared; the next run reloads everything")
+        
+        if run_demo:
+            st.success(f"✅ Processing {len(sample_files)} sample sales files...")
+            run_etl_with_progress(sample_files, incremental)
+
+def log_summary(result, preview_rows=1000):
+    """Display summary of one parsed log"""
+    frame = result.frame
+    return {
+        'format': result.format,
+        'lines': result.lines,
+        'parsed': len(frame),
+        'bad_lines': result.bad_lines,
+        'seconds': result.seconds,
+        'fast_path': result.fast_path,
+        'preview': frame.head(preview_rows),
+        'levels': frame['level'].value_counts() if 'level' in frame.columns else pd.Series(dtype='int64'),
+        'files': None,
+    }
+
+@st.cache_resource(max_entries=8)
+def load_message_index(path):
+    """Message index of a spilled log, loaded once per server"""
+    return MessageIndex.load(path).prepare()
+
+def searchable_log_summary(result, preview_rows=1000):
+    """Summary of a parsed log whose rows and message index are kept for search"""
+    summary = log_summary(result, preview_rows)
+    if result.index is None:
+        return summary
+    handle = spill_dataset(result.frame)
+    summary['dataset'] = handle
+    if handle.is_spilled:
+        # The index sits next to the Arrow file and is pruned with it
+        path = index_path(handle.path)
+        if not path.exists():
+            result.index.save(path)
+        summary['index'] = str(path)
+    else:
+        summary['index'] = result.index.prepare()
+    return summary
+
+def search_parsed_log(summary, query, limit=1000):
+    """Rows of the parsed log whose message matches query, and the search time"""
+    index = summary['index']
+    if isinstance(index, str):
+        index = load_message_index(index)
+    start = time.perf_counter()
+    rows = index.search(query)
+    seconds = time.perf_counter() - start
+    handle = summary['dataset']
+    if handle.is_spilled:
+        # Only the matching rows leave the memory map
+        frame = handle.table().take(rows[:limit]).to_pandas()
+    else:
+        frame = handle.to_pandas().iloc[rows[:limit]]
+    return len(rows), seconds, frame
+
+def show_log_templates(templates, counts, top=5):
+    """Mined message templates: first-seen alerts, the table and the top ones over time"""
+    st.markdown("### 🧩 Log Patterns")
+    new = templates[templates['anomaly']]
+    if len(new):
+        st.warning(f"🆕 {len(new):,} pattern(s) first seen after the warm-up: "
+                   + "; ".join(f"`{text}`" for text in new['template'].head(3)))
+    col1, col2 = st.columns([1, 1])
+    
+    with col1:
+        st.dataframe(templates.head(50), use_container_width=True)
+        st.caption(f"{len(templates):,} templates")
+    
+    with col2:
+        labels = templates['template'].head(top)
+        over_time = counts[counts['template'].isin(labels.index)]
+        if over_time['timestamp'].nunique() > 1:
+            over_time = over_time.assign(template=over_time['template'].map(labels))
+            fig = px.line(over_time, x='timestamp', y='count', color='template',
+                          title=f'Top {top} Patterns by Minute')
+            st.plotly_chart(fig, use_container_width=True)
+        elif len(labels):
+            fig = px.bar(x=labels.str.slice(0, 40), y=templates['count'].head(top),
+                         title=f'Top {top} Patterns')
+            st.plotly_chart(fig, use_container_width=True)
+
+def stream_log_summary(sources, preview_rows=1000, templates=None):
+    """Parse rotated/compressed logs as one stream, keeping running totals only"""
+    progress = st.empty()
+    start = time.perf_counter()
+    summary = None
+    files = {}
+    for result in stream_logs(sources, executor=get_log_executor(), templates=templates):
+        block = log_summary(result, preview_rows)
+        if summary is None:
+            summary = dict(block, files=files)
+        else:
+            summary['lines'] += block['lines']
+            summary['parsed'] += block['parsed']
+            summary['bad_lines'] = (summary['bad_lines'] + block['bad_lines'])[:BAD_LINE_SAMPLES]
+            summary['fast_path'] = summary['fast_path'] and block['fast_path']
+            summary['levels'] = summary['levels'].add(block['levels'], fill_value=0).astype('int64')
+            if len(summary['preview']) < preview_rows:
+                summary['preview'] = pd.concat([summary['preview'], block['preview']],
+                                               ignore_index=True).head(preview_rows)
+        entry = files.setdefault(result.source, {'file': result.source, 'lines': 0, 'parsed': 0,
+                                                 'first': pd.NaT, 'last': pd.NaT})
+        entry['lines'] += result.lines
+        entry['parsed'] += len(result.frame)
+        if 'timestamp' in result.frame.columns and len(result.frame):
+            if pd.isna(entry['first']):
+                entry['first'] = result.frame['timestamp'].iloc[0]
+            entry['last'] = result.frame['timestamp'].iloc[-1]
+        progress.text(f"📄 {result.source}: {summary['lines']:,} lines so far...")
+    progress.empty()
+    if summary is None:
+        return None
+    summary['seconds'] = time.perf_counter() - start
+    summary['files'] = pd.DataFrame(list(files.values()))
+    return summary
 
 def show_log_parser_demo():
     """Log Parser Demo"""
@@ -587,36 +1114,132 @@ def show_log_parser_demo():
     """)
     
     # Sample log formats
-    log_formats = {
-        "Apache Common": '127.0.0.1 - - [10/Oct/2024:13:55:36 +0000] "GET /index.html HTTP/1.0" 200 2326',
-        "Application Log": '2024-10-10 13:55:36,123 INFO [main] com.app.Service - Processing request',
-        "JSON Log": '{"timestamp":"2024-10-10T13:55:36Z","level":"ERROR","service":"auth","message":"Login failed"}'
-    }
+    log_formats = {label: key for key, label in LOG_FORMATS.items()}
     
     selected_format = st.selectbox("Select log format:", list(log_formats.keys()))
     
     log_input = st.text_area("Enter log entries:", 
-                            value=log_formats[selected_format], 
-                            height=100)
-    
-    if st.button("🔍 Parse Logs"):
-        st.success("✅ Logs parsed successfully!")
-        
-        # Simulated parsing results
-        parsed_data = pd.DataFrame({
-            'Timestamp': ['2024-10-10 13:55:36', '2024-10-10 13:55:37', '2024-10-10 13:55:38'],
-            'Level': ['INFO', 'WARNING', 'ERROR'],
-            'Source': ['auth', 'api', 'database'],
-            'Message': ['User login successful', 'High response time detected', 'Connection failed']
-        })
+                            value=generate_sample_log(log_formats[selected_format], lines=20), 
+                            height=200)
+    
+    uploaded_log = st.file_uploader("Or upload a log file",
+                                    type=['log', 'txt', 'json', 'jsonl', '1', 'gz', 'bz2', 'xz'])
+    
+    # Large logs are parsed in place on the server: one file split across all
+    # cores, or a rotated/compressed set streamed oldest first
+    server_path = st.text_input(f"Or parse logs on the server under {LOG_ROOT} (file, directory or glob):",
+                                placeholder="access.log*")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        parse_clicked = st.button("🔍 Parse Logs")
+    with col2:
+        benchmark_clicked = st.button("⏱️ Benchmark Parser (1M lines)")
+    
+    if parse_clicked:
+        # Mined batch by batch as the parser produces them
+        templates = TemplateMiner()
+        try:
+            # The format is detected from the first lines
+            if server_path.strip():
+                paths = log_sources(server_path.strip(), root=LOG_ROOT)
+                if len(paths) == 1 and log_compression(paths[0]) is None:
+                    with st.spinner(f"Parsing on {os.cpu_count() or 1} cores..."):
+                        summary = searchable_log_summary(parse_log_file(
+                            paths[0], executor=get_log_executor(), index=True, templates=templates))
+                else:
+                    summary = stream_log_summary(paths, templates=templates)
+                if summary is not None:
+                    # Lines of server files are never echoed back unparsed; only their count is shown
+                    summary['bad_lines'] = []
+            elif uploaded_log is not None and log_compression(('upload', uploaded_log.getvalue())):
+                summary = stream_log_summary([(uploaded_log.name, uploaded_log.getvalue())], templates=templates)
+            else:
+                summary = searchable_log_summary(parse_log(
+                    uploaded_log.getvalue() if uploaded_log is not None else log_input, index=True,
+                    templates=templates))
+        except LogFormatError as e:
+            st.session_state.pop('log_summary', None)
+            st.error(f"Could not parse logs: {e}")
+            return
+        except (OSError, EOFError) as e:
+            st.session_state.pop('log_summary', None)
+            st.error(f"Could not read logs: {e}")
+            return
+        
+        if summary is None:
+            st.session_state.pop('log_summary', None)
+            st.warning("The logs are empty")
+            return
+        summary['templates'] = (templates.summary(), templates.counts_over_time())
+        # Kept so searching doesn't need a reparse
+        st.session_state['log_summary'] = summary
+    
+    summary = st.session_state.get('log_summary')
+    if summary is not None:
+        st.success(f"✅ Parsed {summary['parsed']:,} entries as {LOG_FORMATS[summary['format']]}")
+        
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            st.metric("Lines", f"{summary['lines']:,}")
+        with col2:
+            st.metric("Parsed", f"{summary['parsed']:,}")
+        with col3:
+            st.metric("Unparsed", f"{summary['lines'] - summary['parsed']:,}")
+        with col4:
+            rate = summary['lines'] / summary['seconds'] if summary['seconds'] else 0
+            st.metric("Throughput", f"{rate:,.0f} lines/s",
+                      "pyarrow fast path" if summary['fast_path'] else "regex path", delta_color="off")
+        
+        if summary['bad_lines']:
+            with st.expander(f"⚠️ {summary['lines'] - summary['parsed']:,} lines did not match the format"):
+                st.code('\n'.join(summary['bad_lines']))
         
-        st.dataframe(parsed_data, use_container_width=True)
+        if summary['files'] is not None:
+            st.markdown("**Files, oldest first**")
+            st.dataframe(summary['files'], use_container_width=True)
+        
+        st.dataframe(summary['preview'], use_container_width=True)
         
         # Log level distribution
-        level_counts = parsed_data['Level'].value_counts()
-        fig = px.pie(values=level_counts.values, names=level_counts.index,
-                    title='Log Level Distribution')
-        st.plotly_chart(fig, use_container_width=True)
+        if len(summary['levels']):
+            fig = px.pie(values=summary['levels'].values, names=summary['levels'].index,
+                        title='Log Level Distribution')
+            st.plotly_chart(fig, use_container_width=True)
+        
+        show_log_templates(*summary['templates'])
+        
+        # Full-text search over the messages, answered from the inverted index
+        if summary.get('index') is not None:
+            query = st.text_input("🔎 Search messages:", placeholder='timeout "connection failed" db*',
+                                  help='All clauses must match: words, "exact phrases" and prefix*')
+            if query.strip():
+                matches, seconds, found = search_parsed_log(summary, query)
+                st.metric("Matching entries", f"{matches:,}", f"{seconds * 1000:.1f} ms", delta_color="off")
+                if matches > len(found):
+                    st.caption(f"Showing the first {len(found):,}")
+                st.dataframe(found, use_container_width=True)
+        elif summary['files'] is not None:
+            st.caption("Search is available for single files; rotated and compressed sets are streamed, not kept")
+    
+    if benchmark_clicked:
+        with st.spinner("Parsing 1,000,000 generated Apache log lines..."):
+            sample = generate_sample_log('apache', lines=1_000_000)
+            stats = benchmark_parser('apache', repeat=1, data=sample)
+        target = 1_000_000
+        st.metric("Apache parse throughput", f"{stats['lines_per_second']:,.0f} lines/s",
+                  f"{stats['lines_per_second'] / target:.1f}x the 1M lines/s target")
+        st.caption(f"{stats['lines']:,} lines in {stats['seconds']:.2f}s on one core "
+                   f"({'pyarrow fast path' if stats['fast_path'] else 'regex path'})")
+        cores = os.cpu_count() or 1
+        if cores > 1:
+            with st.spinner(f"Parsing the same lines split across {cores} worker processes..."):
+                parallel = benchmark_parser('apache', repeat=2, data=sample, workers=cores,
+                                            executor=get_log_executor())
+            st.metric(f"Parallel throughput ({cores} cores)", f"{parallel['lines_per_second']:,.0f} lines/s",
+                      f"{parallel['lines_per_second'] / stats['lines_per_second']:.1f}x one core")
 
 def show_sql_demo():
     """SQL Optimization Demo"""
@@ -628,76 +1251,156 @@ def show_sql_demo():
     Database optimization, query tuning, and automated reporting solutions.
     """)
     
-    # Sample SQL queries
-    sql_examples = {
-        "Data Quality Check": """
--- Comprehensive data quality assessment
-SELECT 
-    'customers' as table_name,
-    COUNT(*) as total_records,
-    SUM(CASE WHEN name IS NULL THEN 1 ELSE 0 END) as null_names,
-    SUM(CASE WHEN email NOT LIKE '%@%' THEN 1 ELSE 0 END) as invalid_emails,
-    COUNT(DISTINCT customer_id) as unique_customers
-FROM customers;
-        """,
-        "Performance Optimization": """
--- Optimized sales report with proper indexing
-WITH monthly_sales AS (
-    SELECT 
-        DATE_TRUNC('month', order_date) as month,
-        SUM(amount) as total_sales,
-        COUNT(*) as order_count
-    FROM orders 
-    WHERE order_date >= '2024-01-01'
-    GROUP BY DATE_TRUNC('month', order_date)
-)
-SELECT 
-    month,
-    total_sales,
-    order_count,
-    LAG(total_sales) OVER (ORDER BY month) as prev_month_sales
-FROM monthly_sales
-ORDER BY month;
-        """,
-        "Data Cleaning": """
--- Remove duplicates and standardize data
-DELETE FROM customers 
-WHERE ctid NOT IN (
-    SELECT MIN(ctid)
-    FROM customers 
-    GROUP BY email, name
-);
-
-UPDATE customers 
-SET name = INITCAP(TRIM(name)),
-    email = LOWER(TRIM(email))
-WHERE name != INITCAP(TRIM(name)) 
-   OR email != LOWER(TRIM(email));
-        """
-    }
+    # Sample SQL queries, run by portfolio_engine.sql
+    sql_examples = {**SQL_EXAMPLES, "Warehouse Sales by Region": WAREHOUSE_REPORT_SQL,
+                    "Warehouse Monthly Growth": WAREHOUSE_GROWTH_SQL,
+                    "Warehouse Sales by Region (full scan)": WAREHOUSE_SCAN_SQL}
     
     selected_query = st.selectbox("Select SQL example:", list(sql_examples.keys()))
     
     st.code(sql_examples[selected_query], language='sql')
     
-    if st.button("📊 Show Query Results"):
-        # Simulated query results
-        if selected_query == "Data Quality Check":
-            results = pd.DataFrame({
-                'table_name': ['customers'],
-                'total_records': [5000],
-                'null_names': [25],
-                'invalid_emails': [15],
-                'unique_customers': [4950]
-            })
-        else:
-            results = pd.DataFrame({
-                'month': ['2024-01', '2024-02', '2024-03'],
-                'total_sales': [125000, 138000, 142000],
-                'order_count': [1250, 1380, 1420]
-            })
+    # The examples run for real on an embedded SQLite database
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        customers = st.select_slider("Customers:", SQL_CUSTOMER_SIZES, value=5_000,
+                                     format_func=lambda n: f"{n:,}")
+    with col2:
+        orders = st.select_slider("Orders:", SQL_ORDER_SIZES, value=50_000, format_func=lambda n: f"{n:,}")
+    with col3:
+        use_indexes = st.checkbox("Use indexes", value=True)
+    
+    if st.button("📊 Run Query"):
+        database = get_sql_database(customers, orders)
+        with st.spinner("Running..."):
+            index_seconds = 0.0
+            wanted = list(INDEXES) if use_indexes else []
+            if database.indexes() != wanted:
+                index_seconds = database.set_indexes(wanted)
+            try:
+                # Unchanged tables: answered from the result cache
+                start = time.perf_counter()
+                result, cache_hit = database.query(sql_examples[selected_query])
+                elapsed = time.perf_counter() - start
+            except sqlite3.Error as e:
+                st.error(f"Query failed: {e}"
+                         + (" (run the ETL pipeline first)" if "warehouse." in str(e) else ""))
+                return
+        
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            if cache_hit:
+                st.metric("Execution Time", f"{elapsed * 1000:,.2f} ms",
+                          f"cached, {result.seconds * 1000:,.1f} ms to compute", delta_color="off")
+            else:
+                st.metric("Execution Time", f"{result.seconds * 1000:,.1f} ms")
+        with col2:
+            st.metric("Rows Returned", f"{result.rows:,}")
+        with col3:
+            st.metric("Rows Changed", f"{result.changes:,}")
+        
+        cache = database.cache.stats()
+        st.caption(f"Result cache: {cache['hits']:,} hits, {cache['misses']:,} misses "
+                   f"({cache['hit_rate']:.0%} hit rate), {cache['invalidations']:,} invalidated by writes, "
+                   f"{cache['bypasses']:,} uncacheable, {cache['entries']:,} entries")
+        
+        counts = database.table_counts()
+        st.caption(f"SQLite {sqlite3.sqlite_version} on {counts['customers']:,} customers and "
+                   f"{counts['orders']:,} orders, {'with' if use_indexes else 'without'} indexes"
+                   + (f" (built in {index_seconds:.2f}s)" if index_seconds else "")
+                   + ("; changes were rolled back so the example can be rerun" if result.changes else ""))
+        
+        if result.frame is not None:
+            st.dataframe(result.frame, use_container_width=True)
         
-        st.dataframe(results, use_container_width=True)
+        for number, statement in enumerate(result.statements, 1):
+            with st.expander(f"Query plan, statement {number}: {statement['seconds'] * 1000:,.1f} ms, "
+                             f"{statement['rows']:,} rows returned, {statement['changes']:,} changed"):
+                st.code(statement['plan'], language='text')
+    
+    # Large tables: the same cleaning over key ranges, one short transaction each
+    if selected_query == "Data Cleaning":
+        st.markdown("### 🧹 Chunked Cleaning")
+        
+        chunk_rows = st.select_slider("Rows per transaction:", [1_000, 10_000, 50_000, 100_000], value=10_000,
+                                      format_func=lambda n: f"{n:,}")
+        
+        with st.expander("Statements run per key range"):
+            st.code(';\n'.join(sql.format(table='customers_work').strip() for sql in CHUNKED_CLEANING.values())
+                    + ';', language='sql')
+        
+        if st.button("🧹 Run Chunked Cleaning"):
+            database = get_sql_database(customers, orders)
+            with st.spinner("Copying customers..."):
+                copy_table(database, 'customers', 'customers_work')
+            progress_bar = st.progress(0.0)
+            
+            def on_chunk(phase, done, total, changed):
+                progress_bar.progress(done / total, text=f"{phase}: {done:,} of {total:,} rows, {changed:,} changed")
+            
+            stats = clean_chunked(database, 'customers_work', chunk_rows, progress=on_chunk)
+            progress_bar.empty()
+            
+            if 'dedupe' not in stats:
+                st.info("The customers table is empty")
+            else:
+                col1, col2, col3, col4 = st.columns(4)
+                
+                with col1:
+                    st.metric("Duplicates Removed", f"{stats['dedupe']['changed']:,}")
+                with col2:
+                    st.metric("Rows Standardized", f"{stats['standardize']['changed']:,}")
+                with col3:
+                    st.metric("Dedupe Speed", f"{stats['dedupe']['rows_per_second']:,.0f} rows/s")
+                with col4:
+                    st.metric("Standardize Speed", f"{stats['standardize']['rows_per_second']:,.0f} rows/s")
+                
+                st.caption(f"{stats['dedupe']['chunks'] + stats['standardize']['chunks']:,} transactions of up to "
+                           f"{chunk_rows:,} rows in {stats['dedupe']['seconds'] + stats['standardize']['seconds']:.2f}s"
+                           + (f" after building the (email, name) index in {stats['index_seconds'] * 1000:,.0f} ms"
+                              if stats['index_seconds'] > 0.001 else "")
+                           + "; run on customers_work, a fresh copy of customers")
+    
+    # Before/after index benchmark across data scales
+    st.markdown("### ⏱️ Index Benchmark")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        scales = st.multiselect("Orders (customers are a tenth):", list(BENCHMARK_SCALES),
+                                default=list(BENCHMARK_SCALES[:3]), format_func=lambda n: f"{n:,}")
+    with col2:
+        candidates = st.multiselect("Candidate indexes:", list(INDEXES), default=list(INDEXES))
+    with col3:
+        repeat = st.slider("Runs per setting:", 3, 50, 20)
+    
+    if BENCHMARK_SCALES[-1] in scales:
+        st.caption("The 10M-order database takes a minute or two to generate the first time")
+    
+    if st.button("⏱️ Benchmark Indexes") and scales:
+        status = st.empty()
+        benchmark = benchmark_indexes(
+            sql_examples[selected_query], sorted(scales), candidates, repeat=repeat,
+            open_database=get_sql_database, progress=lambda step: status.text(f"⏳ {step}..."))
+        status.empty()
+        
+        chart_data = benchmark.assign(scale=benchmark['orders'].map(lambda n: f"{n:,} orders"),
+                                      p95_extra=benchmark['p95_ms'] - benchmark['median_ms'])
+        fig = px.bar(chart_data, x='scale', y='median_ms', color='indexes', barmode='group',
+                     error_y='p95_extra', log_y=True,
+                     title=f'{selected_query}: median latency, whiskers to p95 (ms, log scale)')
+        st.plotly_chart(fig, use_container_width=True)
+        
+        st.dataframe(benchmark.drop(columns=['plan']).round(2), use_container_width=True)
+        
+        for orders, runs in benchmark.groupby('orders'):
+            plans = runs.set_index('indexes')['plan']
+            diff = plan_diff(plans['without'], plans['with'])
+            with st.expander(f"Plan change at {orders:,} orders"
+                             + ("" if diff else ": none, the indexes are not used")):
+                st.code(diff or plans['with'], language='diff' if diff else 'text')
 
 def show_webapps_page():
     """Web applications demos"""
@@ -728,42 +1431,42 @@ def show_csv_tool():
     # Demo with sample data if no file uploaded
     if not uploaded_file:
         if st.button("🎲 Try with Sample Data"):
-            st.session_state.demo_data = load_sample_data("sales")
+            # Session state only keeps a handle to the memory-mapped spill
+            st.session_state.demo_data = spill_dataset(load_sample_data("sales"))
     
     # Process data
     if uploaded_file or 'demo_data' in st.session_state:
         try:
             # Load data
-            if 'demo_data' in st.session_state:
-                df = st.session_state.demo_data
-                data_source = "Sample Sales Data"
-            else:
-                df = pd.read_csv(uploaded_file)
+            is_upload = 'demo_data' not in st.session_state
+            if is_upload:
                 data_source = uploaded_file.name
+            else:
+                df = st.session_state.demo_data.to_pandas()
+                data_source = "Sample Sales Data"
             
-            st.success(f"✅ Loaded {data_source}")
+            # Quick stats, filled in progressively while an upload streams in
+            metric_slots = [col.empty() for col in st.columns(4)]
             
-            # Quick stats
-            col1, col2, col3, col4 = st.columns(4)
+            if is_upload:
+                profile = show_upload_profile(uploaded_file, metric_slots)
+                df = profile.sample
+            else:
+                profile = profile_dataframe(df)
+                show_profile_metrics(profile, metric_slots)
             
-            with col1:
-                st.metric("Rows", f"{len(df):,}")
-            with col2:
-                st.metric("Columns", len(df.columns))
-            with col3:
-                st.metric("Missing", f"{df.isnull().sum().sum():,}")
-            with col4:
-                memory_mb = df.memory_usage(deep=True).sum() / 1024 / 1024
-                st.metric("Size", f"{memory_mb:.1f} MB")
+            st.success(f"✅ Loaded {data_source}")
             
             # Data preview
             st.markdown("### 📋 Data Sample")
-            st.dataframe(df.head(10), use_container_width=True)
+            st.dataframe(profile.head, use_container_width=True)
             
             # Automatic visualizations
             st.markdown("### 📊 Auto-Generated Insights")
+            if profile.is_sampled:
+                st.caption(f"Charts use a uniform sample of {len(df):,} of {profile.rows:,} rows")
             
-            numeric_cols = df.select_dtypes(include=[np.number]).columns
+            numeric_cols = profile.numeric_columns
             
             if len(numeric_cols) > 0:
                 col1, col2 = st.columns(2)
@@ -782,7 +1485,7 @@ def show_csv_tool():
                         st.plotly_chart(fig2, use_container_width=True)
                     else:
                         # Show summary stats
-                        summary = df[numeric_cols[0]].describe()
+                        summary = profile.describe()[numeric_cols[0]]
                         st.dataframe(summary, use_container_width=True)
             
             # Download options
@@ -790,7 +1493,8 @@ def show_csv_tool():
             col1, col2 = st.columns(2)
             
             with col1:
-                csv_data = df.to_csv(index=False)
+                # Uploads are offered back as-is; df only holds a sample of them
+                csv_data = uploaded_file.getvalue() if is_upload else df.to_csv(index=False)
                 st.download_button(
                     "📄 Download CSV",
                     data=csv_data,
@@ -807,6 +1511,28 @@ def show_csv_tool():
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
 
+@st.cache_resource(max_entries=8)
+def get_log_feed(path):
+    """Background follower of a log file shared by every viewer; the demo file gets traffic
+
+    Only the demo file and files under LOG_ROOT can be followed
+    (PermissionError otherwise). Feeds that fall out of the cache stop
+    once their idle timeout passes.
+    """
+    write = None
+    if path == str(LIVE_LOG_PATH):
+        LIVE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        write = lambda target: append_sample_log(target, lines=int(np.random.randint(50, 200)))  # noqa: E731
+    else:
+        path = log_path_under(path, LOG_ROOT)
+    return LogFeed(path, write=write, bucket_seconds=60, buckets=LIVE_LOG_BUCKETS)
+
+def rotate_demo_log(path):
+    """Rotate the demo log the way logrotate does: move it aside, start a new one"""
+    if os.path.exists(path):
+        os.replace(path, f"{path}.1")
+    Path(path).touch()
+
 def show_log_visualizer():
     """Log Visualizer Demo"""
     
@@ -817,80 +1543,144 @@ def show_log_visualizer():
     Real-time log analysis with filtering, alerting, and performance monitoring.
     """)
     
+    # Source: a real file, tailed by a shared background feed
+    col1, col2 = st.columns([3, 1])
+    
+    with col1:
+        log_path = st.text_input(f"Follow log file (the demo log or a file under {LOG_ROOT}):",
+                                 value=str(LIVE_LOG_PATH)).strip()
+    
+    with col2:
+        refresh = st.selectbox("Auto-refresh:", REFRESH_OPTIONS, index=REFRESH_OPTIONS.index('5s'),
+                               key='log_visualizer_refresh')
+    
+    is_demo = log_path == str(LIVE_LOG_PATH)
+    try:
+        # Resolve first so every spelling of a file shares one feed
+        log_path = log_path if is_demo else log_path_under(log_path, LOG_ROOT)
+        feed = get_log_feed(log_path).touch()
+    except PermissionError as e:
+        st.error(str(e))
+        return
+    with feed.lock:
+        service_options = sorted(feed.stats.services)
+    
     # Controls
     col1, col2, col3 = st.columns(3)
     
     with col1:
         log_levels = st.multiselect(
             "Filter Log Levels:",
-            ["DEBUG", "INFO", "WARNING", "ERROR"],
-            default=["INFO", "WARNING", "ERROR"]
+            ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+            default=["INFO", "WARNING", "ERROR", "CRITICAL"]
         )
     
     with col2:
         services = st.multiselect(
             "Filter Services:",
-            ["auth", "api", "database", "frontend"],
-            default=["auth", "api", "database", "frontend"]
+            service_options,
+            default=service_options
         )
     
     with col3:
-        auto_refresh = st.checkbox("Auto-refresh (5s)")
-    
-    if auto_refresh:
-        time.sleep(1)  # Reduced for demo
-        st.rerun()
-    
-    # Generate sample log data
-    log_data = pd.DataFrame({
-        'timestamp': pd.date_range('2024-01-01', periods=1000, freq='min'),
-        'level': np.random.choice(log_levels if log_levels else ["INFO"], 1000),
-        'service': np.random.choice(services if services else ["api"], 1000),
-        'response_time': np.random.exponential(100, 1000),
-        'status_code': np.random.choice([200, 404, 500], 1000, p=[0.8, 0.15, 0.05])
-    })
-    
-    # Metrics
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        error_count = len(log_data[log_data['level'] == 'ERROR'])
-        st.metric("Errors", error_count, f"+{np.random.randint(0, 10)}")
-    
-    with col2:
-        avg_response = log_data['response_time'].mean()
-        st.metric("Avg Response", f"{avg_response:.0f}ms", f"+{np.random.randint(-20, 30)}ms")
-    
-    with col3:
-        success_rate = (log_data['status_code'] == 200).mean()
-        st.metric("Success Rate", f"{success_rate:.1%}", "+0.5%")
-    
-    with col4:
-        total_requests = len(log_data)
-        st.metric("Total Requests", f"{total_requests:,}", f"+{np.random.randint(50, 200)}")
-    
-    # Visualizations
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        # Log levels over time
-        hourly_logs = log_data.groupby([log_data['timestamp'].dt.hour, 'level']).size().reset_index(name='count')
-        fig1 = px.bar(hourly_logs, x='timestamp', y='count', color='level',
-                     title='Log Distribution by Hour')
-        st.plotly_chart(fig1, use_container_width=True)
-    
-    with col2:
-        # Response time by service
-        service_response = log_data.groupby('service')['response_time'].mean()
-        fig2 = px.bar(x=service_response.index, y=service_response.values,
-                     title='Average Response Time by Service')
-        st.plotly_chart(fig2, use_container_width=True)
-    
-    # Recent logs table
-    st.markdown("### 📝 Recent Log Entries")
-    recent_logs = log_data.tail(10)[['timestamp', 'level', 'service', 'response_time', 'status_code']]
-    recent_logs['timestamp'] = recent_logs['timestamp'].dt.strftime('%H:%M:%S')
-    st.dataframe(recent_logs, use_container_width=True)
+        if is_demo and st.button("🔄 Rotate demo log"):
+            rotate_demo_log(LIVE_LOG_PATH)
+    
+    run_every = refresh_seconds(refresh)
+    
+    @live_region(run_every)
+    def live_metrics():
+        feed.touch()
+        # Everything below reads the aggregates: O(buckets), not O(rows seen)
+        with feed.lock:
+            stats = feed.stats
+            total = stats.total
+            new_lines = feed.delta.total
+            summary = stats.summary(log_levels, services)
+            new = feed.delta.summary(log_levels, services)
+            per_minute = stats.level_counts(log_levels, services)
+            service_response = stats.service_response(log_levels, services)
+            latency_by_bucket = stats.percentiles_by_bucket(services)
+            latency_by_service = stats.percentiles_by_service(services)
+            relative_accuracy = stats.sketch.relative_accuracy
+            recent = feed.recent
+            templates = feed.templates.summary()
+            template_counts = feed.templates.counts_over_time()
+            offset, rotations = feed.tailer.offset, feed.tailer.rotations
+        
+        if feed.error is not None:
+            st.error(f"Could not follow {log_path}: {feed.error}")
+            if isinstance(feed.error, LogFormatError):
+                return
+        
+        st.caption(f"Following {log_path}: offset {offset:,} bytes, {rotations} rotations seen, "
+                   f"+{new_lines:,} lines in the last poll, {total:,} in total "
+                   f"(last {LIVE_LOG_BUCKETS} minutes charted)")
+        
+        if not total:
+            st.info("Waiting for log lines...")
+        
+        # Metrics
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            st.metric("Errors", f"{summary['errors']:,}", f"+{new['errors']:,}")
+        
+        with col2:
+            avg_response = summary['avg_response']
+            new_response = new['avg_response']
+            st.metric("Avg Response", f"{avg_response:.0f}ms" if pd.notna(avg_response) else "n/a",
+                      f"{new_response - avg_response:+.0f}ms" if pd.notna(new_response) and pd.notna(avg_response) else None)
+        
+        with col3:
+            success_rate = summary['success_rate']
+            st.metric("Success Rate", f"{success_rate:.1%}" if pd.notna(success_rate) else "n/a")
+        
+        with col4:
+            st.metric("Total Requests", f"{summary['lines']:,}", f"+{new['lines']:,}")
+        
+        # Visualizations
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            # Log levels over time
+            fig1 = px.bar(per_minute, x='timestamp', y='count', color='level',
+                         title='Log Distribution by Minute')
+            st.plotly_chart(fig1, use_container_width=True)
+        
+        with col2:
+            # Response time by service
+            if len(service_response):
+                fig2 = px.bar(x=service_response.index.astype(str), y=service_response.values,
+                             title='Average Response Time by Service')
+                st.plotly_chart(fig2, use_container_width=True)
+            else:
+                st.info("This log has no response times")
+        
+        # Tail latency from the per-bucket, per-service sketches
+        if len(latency_by_bucket):
+            st.markdown("### ⏱️ Response Time Percentiles")
+            col1, col2 = st.columns([2, 1])
+            
+            with col1:
+                fig3 = px.line(latency_by_bucket, x='timestamp', y=['p50', 'p95', 'p99'],
+                               title='p50 / p95 / p99 Response Time by Minute (ms)')
+                st.plotly_chart(fig3, use_container_width=True)
+            
+            with col2:
+                st.dataframe(latency_by_service.round(1), use_container_width=True)
+                st.caption(f"DDSketch, within {relative_accuracy:.0%} of the true value; all levels")
+        
+        show_log_templates(templates, template_counts)
+        
+        # Recent logs table
+        st.markdown("### 📝 Recent Log Entries")
+        recent_logs = recent[recent['level'].isin(log_levels) & recent['service'].isin(services)].tail(10).copy()
+        recent_logs['timestamp'] = recent_logs['timestamp'].dt.strftime('%H:%M:%S')
+        st.dataframe(recent_logs, use_container_width=True)
+    
+    live_metrics()
+    refresh_fallback(run_every)
 
 def show_documentation_page():
     """Documentation and resources"""
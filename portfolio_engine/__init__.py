@@ -0,0 +1,7 @@
+"""
+Data processing engines behind the portfolio demos.
+
+The Streamlit pages in portfolio_app2.py and portfolio_site/app.py only
+handle layout; ingestion, ETL, log parsing and query execution live here so
+they can be reused across pages and pickled into worker processes.
+"""
@@ -0,0 +1,1020 @@
+"""
+Parallel CSV ETL engine.
+
+Every source file goes through the same stages:
+
+    validate -> clean -> dedupe -> transform -> load
+
+Files are processed concurrently, one per worker process, and chunk by
+chunk. Workers stage each finished chunk as a pickle and the parent streams
+staged chunks into the sink as soon as their file completes, so the batch
+is never concatenated into one DataFrame. Cross-file duplicates are removed
+in the parent, which is the only place that sees every file.
+
+With a LoadManifest, runs are incremental: unchanged files are skipped from
+their fingerprint alone, and rows of changed files that were already loaded
+are filtered out by row hash and/or a timestamp watermark.
+
+Files are read in line-aligned raw blocks that are parsed independently,
+so a corrupt block is quarantined without failing its file, and with a
+RunCheckpoint an interrupted run resumes from the last chunk it loaded.
+"""
+
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from portfolio_engine.ingest import parse_date_columns
+from portfolio_engine.query_cache import bump_table_version
+from portfolio_engine.validation import RuleSet, build_rules, merge_reports
+
+STAGES = ['extract', 'validate', 'clean', 'dedupe', 'transform', 'load']
+DEFAULT_CHUNK_ROWS = 50_000
+PREVIEW_ROWS = 10
+
+
+class ETLError(Exception):
+    """Raised when a source cannot be processed at all"""
+
+
+def source_name(source):
+    """Display name of a path or (name, bytes) upload source"""
+    if isinstance(source, tuple):
+        return source[0]
+    return Path(source).name
+
+
+def snake_case(name):
+    name = re.sub(r'[^0-9a-zA-Z]+', '_', str(name).strip())
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name)
+    return name.strip('_').lower() or 'column'
+
+
+def _in_sorted(sorted_values, values):
+    """Boolean mask of which values occur in the sorted array sorted_values"""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[pos] == values
+
+
+def _merge_sorted(sorted_values, values):
+    """sorted_values with the values it lacks inserted, still sorted and unique
+
+    Only the new values are sorted; np.union1d would re-sort all of
+    sorted_values, for every chunk merged in.
+    """
+    new = np.unique(values)
+    if not len(sorted_values):
+        return new
+    pos = np.searchsorted(sorted_values, new)
+    fresh = sorted_values[np.minimum(pos, len(sorted_values) - 1)] != new
+    return np.insert(sorted_values, pos[fresh], new[fresh])
+
+
+def row_hashes(df):
+    """64-bit hash per row, stable across chunks and files"""
+    normalized = df.copy(deep=False)
+    for col in df.select_dtypes(include=[np.number]).columns:
+        normalized[col] = df[col].astype('float64')
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+
+# Stages
+def validate_chunk(chunk, required_columns=(), rule_set=None):
+    """Check the schema, then drop rows missing a required value or rejected by a rule"""
+    missing = [col for col in required_columns if col not in chunk.columns]
+    if missing:
+        raise ETLError(f"missing required columns: {', '.join(missing)}")
+    invalid = 0
+    if required_columns:
+        valid = chunk[list(required_columns)].notna().all(axis=1)
+        chunk, invalid = chunk[valid], int((~valid).sum())
+    if rule_set is not None:
+        chunk, rejected = rule_set.evaluate(chunk)
+        invalid += rejected
+    return chunk, invalid
+
+
+def clean_chunk(chunk):
+    """Trim text, turn blank strings into missing values and drop empty rows"""
+    cleaned = chunk.copy()
+    for col in cleaned.select_dtypes(include=['object', 'string']).columns:
+        # .str yields NaN for non-string cells of mixed columns; keep those as they were
+        stripped = cleaned[col].str.strip()
+        cleaned[col] = stripped.where(stripped.notna(), cleaned[col]).replace('', np.nan)
+    before = len(cleaned)
+    cleaned = cleaned.dropna(how='all')
+    return cleaned, before - len(cleaned)
+
+
+def dedupe_chunk(chunk, seen_hashes):
+    """Drop rows whose hash is already in seen_hashes (a sorted uint64 array)
+
+    Returns the deduplicated chunk, the hashes of its rows and the updated
+    seen_hashes array.
+    """
+    hashes = row_hashes(chunk)
+    # First occurrence within the chunk wins
+    _, first = np.unique(hashes, return_index=True)
+    keep = np.zeros(len(hashes), dtype=bool)
+    keep[first] = True
+    keep &= ~_in_sorted(seen_hashes, hashes)
+    kept_hashes = hashes[keep]
+    return chunk[keep], kept_hashes, _merge_sorted(seen_hashes, kept_hashes)
+
+
+def transform_chunk(chunk, name):
+    """Normalize column names, parse dates and tag rows with their source file"""
+    transformed = parse_date_columns(chunk)
+    transformed.columns = [snake_case(col) for col in transformed.columns]
+    transformed['source_file'] = name
+    return transformed
+
+
+def iter_raw_chunks(source, chunksize=DEFAULT_CHUNK_ROWS, start_offset=0):
+    """Yield (header, block, end_offset) for line-aligned blocks of a CSV source
+
+    Blocks hold at most chunksize lines, extended when a quoted field spans
+    a line break. Each block is parsed on its own, so a malformed block can
+    be set aside without losing the rest of the file, and a resumed run can
+    seek straight to the first block it has not loaded yet.
+    """
+    with contextlib.ExitStack() as stack:
+        if isinstance(source, tuple):
+            f = io.BytesIO(source[1])
+        else:
+            f = stack.enter_context(open(source, 'rb'))
+        header = f.readline()
+        if start_offset:
+            f.seek(start_offset)
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if not lines:
+                return
+            quotes = sum(line.count(b'"') for line in lines)
+            while quotes % 2:
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
+                quotes += line.count(b'"')
+            yield header, b''.join(lines), f.tell()
+
+
+def parse_raw_chunk(header, block, first_row=0):
+    """Parse one raw block, numbering rows by their position in the file"""
+    chunk = pd.read_csv(io.BytesIO(header + block))
+    chunk.index = pd.RangeIndex(first_row, first_row + len(chunk))
+    return chunk
+
+
+def process_source(source, staging_dir, chunksize=DEFAULT_CHUNK_ROWS, required_columns=(), watermark=None,
+                   rules=None, start=None, quarantine_dir=None):
+    """Run extract to transform for one file, staging every processed chunk
+
+    rules is a validation spec or list of rules (see validation.py),
+    evaluated on every raw chunk; the per-rule report is returned under
+    'validation'. watermark is an optional (column, value) pair; rows whose
+    column is not newer than value were loaded by an earlier run and are
+    dropped. start is an optional (chunk_index, byte_offset, rows) position
+    to resume from, as recorded by a RunCheckpoint.
+
+    A chunk that fails to parse or process is quarantined: its raw lines are
+    written to quarantine_dir (when given) and the file carries on with the
+    next chunk. Only schema errors and unreadable files fail the whole file.
+
+    This is the unit of work sent to a worker process, so it only takes
+    picklable arguments and returns a plain dict. 'chunks' lists one entry
+    per chunk, in file order, with the staged pickle or the error.
+    """
+    name = source_name(source)
+    index, offset, first_row = start or (0, 0, 0)
+    result = {
+        'name': name,
+        'rows_read': 0,
+        'rows_invalid': 0,
+        'rows_empty': 0,
+        'duplicates': 0,
+        'rows_unchanged': 0,
+        'rows_out': 0,
+        'rows_quarantined': 0,
+        'chunks_resumed': index,
+        'chunks': [],
+        'timings': dict.fromkeys(STAGES, 0.0),
+        'validation': [],
+        'error': None,
+        'worker_pid': os.getpid(),
+    }
+    timings = result['timings']
+    rule_set = RuleSet(rules) if rules else None
+    seen_hashes = np.empty(0, dtype=np.uint64)
+    stage_prefix = Path(staging_dir) / f"{snake_case(name)}_{uuid.uuid4().hex[:8]}"
+
+    try:
+        blocks = iter_raw_chunks(source, chunksize, offset)
+        while True:
+            start_time = time.perf_counter()
+            raw = next(blocks, None)
+            if raw is None:
+                timings['extract'] += time.perf_counter() - start_time
+                break
+            header, block, end = raw
+            entry = {'index': index, 'end': end, 'first_row': first_row, 'next_row': first_row,
+                     'rows': 0, 'path': None, 'error': None}
+            try:
+                chunk = parse_raw_chunk(header, block, first_row)
+                timings['extract'] += time.perf_counter() - start_time
+                first_row += len(chunk)
+                rows_read = len(chunk)
+
+                start_time = time.perf_counter()
+                chunk, invalid = validate_chunk(chunk, required_columns, rule_set)
+                timings['validate'] += time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                chunk, empty = clean_chunk(chunk)
+                timings['clean'] += time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                before = len(chunk)
+                chunk, hashes, chunk_seen = dedupe_chunk(chunk, seen_hashes)
+                timings['dedupe'] += time.perf_counter() - start_time
+                duplicates = before - len(chunk)
+
+                start_time = time.perf_counter()
+                chunk = transform_chunk(chunk, name)
+                unchanged = 0
+                if watermark is not None:
+                    column, value = watermark
+                    newer = (chunk[column] > value).to_numpy()
+                    unchanged = int((~newer).sum())
+                    chunk, hashes = chunk[newer], hashes[newer]
+                timings['transform'] += time.perf_counter() - start_time
+            except ETLError:
+                raise
+            except Exception as e:
+                # Set the raw lines aside and carry on with the next chunk
+                entry['error'] = f"{type(e).__name__}: {str(e).strip()}"
+                lines = block.count(b'\n')
+                first_row = entry['next_row'] = entry['first_row'] + lines
+                result['rows_read'] += lines
+                result['rows_quarantined'] += lines
+                if quarantine_dir is not None:
+                    quarantined = Path(quarantine_dir) / f"{snake_case(name)}_chunk{index:05d}.csv"
+                    quarantined.parent.mkdir(parents=True, exist_ok=True)
+                    quarantined.write_bytes(header + block)
+                    entry['path'] = str(quarantined)
+                result['chunks'].append(entry)
+                index += 1
+                continue
+
+            seen_hashes = chunk_seen
+            result['rows_read'] += rows_read
+            result['rows_invalid'] += invalid
+            result['rows_empty'] += empty
+            result['duplicates'] += duplicates
+            result['rows_unchanged'] += unchanged
+
+            staged = Path(f"{stage_prefix}_{index:05d}.pkl")
+            pd.to_pickle((chunk, hashes), staged)
+            entry['path'] = str(staged)
+            entry['rows'] = len(chunk)
+            entry['next_row'] = first_row
+            result['chunks'].append(entry)
+            result['rows_out'] += len(chunk)
+            index += 1
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    if rule_set is not None:
+        result['validation'] = rule_set.report()
+    return result
+
+
+# Sinks
+class SummarySink:
+    """Sink that keeps counts and a preview instead of the loaded rows"""
+
+    def __init__(self, preview_rows=PREVIEW_ROWS):
+        self.preview_rows = preview_rows
+        self.rows = 0
+        self.preview = pd.DataFrame()
+
+    def write(self, chunk):
+        if len(self.preview) < self.preview_rows:
+            head = chunk.head(self.preview_rows - len(self.preview))
+            self.preview = head if self.preview.empty else pd.concat([self.preview, head], ignore_index=True)
+        self.rows += len(chunk)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteSink:
+    """Sink that bulk-loads chunks into a table of an embedded SQLite database
+
+    Rows are inserted with executemany in explicit transactions of up to
+    batch_rows rows, never one statement and commit per row. The table is
+    created from the first chunk's dtypes, and columns that show up in later
+    chunks are added on the fly. Every batch stamps the table's version (see
+    portfolio_engine.query_cache), so cached query results over it go stale.
+
+    Each of rollups (portfolio_engine.rollups.Rollup) is kept up to date in
+    the same transaction as the batches it summarizes, and backfilled from
+    the table if it is new.
+    """
+
+    SQL_TYPES = {'i': 'INTEGER', 'u': 'INTEGER', 'b': 'INTEGER', 'f': 'REAL'}
+
+    def __init__(self, path, table, batch_rows=50_000, rollups=()):
+        self.path = Path(path)
+        self.table = table
+        self.batch_rows = batch_rows
+        self.rollups = list(rollups)
+        self.rows = 0
+        self.seconds = 0.0
+        self.columns = []
+        self._pending = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info("{table}")')]
+        self._ensure_rollups()
+
+    def _ensure_rollups(self):
+        if not self.rollups:
+            return
+        self.conn.execute('BEGIN IMMEDIATE')
+        for rollup in self.rollups:
+            if rollup.create(self.conn) and self.columns:
+                rollup.backfill(self.conn, self.table)
+        self.conn.execute('COMMIT')
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def _sql_type(self, dtype):
+        return self.SQL_TYPES.get(getattr(dtype, 'kind', 'O'), 'TEXT')
+
+    def _ensure_columns(self, chunk):
+        if not self.columns:
+            columns = ', '.join(f'"{col}" {self._sql_type(dtype)}' for col, dtype in chunk.dtypes.items())
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" ({columns})')
+            self.columns = list(chunk.columns)
+            return
+        for col, dtype in chunk.dtypes.items():
+            if col not in self.columns:
+                self.conn.execute(f'ALTER TABLE "{self.table}" ADD COLUMN "{col}" {self._sql_type(dtype)}')
+                self.columns.append(col)
+
+    @staticmethod
+    def _to_rows(chunk):
+        """Plain Python tuples, with NaN/NaT as NULL and datetimes as ISO text"""
+        converted = chunk.copy(deep=False)
+        for col in chunk.select_dtypes(include=['datetime', 'datetimetz']).columns:
+            converted[col] = chunk[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+        # astype(object) turns numpy scalars into the Python types sqlite3 binds
+        converted = converted.astype(object).where(converted.notna(), None)
+        return list(converted.itertuples(index=False, name=None))
+
+    def write(self, chunk):
+        if chunk.empty:
+            return
+        start = time.perf_counter()
+        self._ensure_columns(chunk)
+        columns = ', '.join(f'"{col}"' for col in chunk.columns)
+        placeholders = ', '.join('?' * len(chunk.columns))
+        insert = f'INSERT INTO "{self.table}" ({columns}) VALUES ({placeholders})'
+
+        for offset in range(0, len(chunk), self.batch_rows):
+            batch = chunk.iloc[offset:offset + self.batch_rows]
+            if not self.conn.in_transaction:
+                self.conn.execute('BEGIN')
+            self.conn.executemany(insert, self._to_rows(batch))
+            for rollup in self.rollups:
+                rollup.apply(self.conn, batch)
+            bump_table_version(self.conn, self.table)
+            self._pending += len(batch)
+            if self._pending >= self.batch_rows:
+                self.conn.execute('COMMIT')
+                self._pending = 0
+        self.rows += len(chunk)
+        self.seconds += time.perf_counter() - start
+
+    def flush(self):
+        """Commit everything written so far"""
+        start = time.perf_counter()
+        if self.conn.in_transaction:
+            self.conn.execute('COMMIT')
+        self._pending = 0
+        self.seconds += time.perf_counter() - start
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def reset(self):
+        """Drop the target table and empty its rollups so the next load starts from scratch"""
+        self.conn.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+        bump_table_version(self.conn, self.table)
+        self.columns = []
+        for rollup in self.rollups:
+            rollup.drop(self.conn)
+            bump_table_version(self.conn, rollup.name)
+        self._ensure_rollups()
+
+
+# Incremental loads
+def source_key(source):
+    """Stable identity of a source across runs: resolved path or upload name"""
+    return source[0] if isinstance(source, tuple) else str(Path(source).resolve())
+
+
+def file_fingerprint(source):
+    """Cheap identity of a source: size and mtime for paths, None for uploads"""
+    if isinstance(source, tuple):
+        return None
+    stat = os.stat(source)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def file_digest(source):
+    """Content hash of a path or (name, bytes) source"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(source, tuple):
+        digest.update(source[1])
+        return digest.hexdigest()
+    with open(source, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _hashes_file(directory, key, suffix=''):
+    # Source keys are paths or upload names; name the file after a hash of the key
+    name = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    return Path(directory) / f'{name}{suffix}.npy'
+
+
+class LoadManifest:
+    """Persistent record of what earlier runs loaded
+
+    The manifest keeps a fingerprint and content digest per source file, an
+    optional high watermark, and per file the sorted 64-bit hashes of the
+    rows its loaded version holds. It lives in a JSON file with a directory
+    of per-file .npy hash arrays beside it. When a file changes, rows it
+    loaded before are recognised from its own array, which the new
+    version's hashes then replace: a run reads and writes only the arrays
+    of the files it loads. A row that moves to another file is caught by the
+    cross-file dedupe within a run, or by a watermark, not across runs.
+    Row hashes cost 8 bytes per loaded row; use a watermark alone when the
+    data is append-only and that is too much.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.hashes_dir = self.path.with_suffix('.hashes')
+        # Single array of every loaded row, written by earlier versions
+        self.legacy_hashes_path = self.path.with_suffix('.hashes.npy')
+        self.files = {}
+        self.watermark = None
+        self._digests = {}
+        self._new_hashes = {}
+        if self.path.exists():
+            state = json.loads(self.path.read_text())
+            self.files = state.get('files', {})
+            self.watermark = state.get('watermark')
+
+    def is_unchanged(self, source):
+        """True if the source was loaded before and its content is the same
+
+        Paths whose size and mtime match are trusted without reading them;
+        otherwise the content digest decides, so a file that was only
+        touched or re-copied is still skipped.
+        """
+        entry = self.files.get(source_key(source))
+        if entry is None:
+            return False
+        fingerprint = file_fingerprint(source)
+        if fingerprint is not None and fingerprint == entry['fingerprint']:
+            return True
+        if self._digest(source) != entry['digest']:
+            return False
+        entry['fingerprint'] = fingerprint
+        return True
+
+    def _digest(self, source):
+        key = source_key(source)
+        if key not in self._digests:
+            self._digests[key] = file_digest(source)
+        return self._digests[key]
+
+    def watermark_value(self, column):
+        """Current watermark for column, or None"""
+        if not self.watermark or self.watermark['column'] != column:
+            return None
+        if self.watermark['kind'] == 'datetime':
+            return pd.Timestamp(self.watermark['value'])
+        return self.watermark['value']
+
+    def advance_watermark(self, column, series):
+        """Move the watermark up to the newest value in series"""
+        if series.dropna().empty:
+            return
+        newest = series.max()
+        current = self.watermark_value(column)
+        if current is not None and newest <= current:
+            return
+        if isinstance(newest, pd.Timestamp):
+            self.watermark = {'column': column, 'kind': 'datetime', 'value': newest.isoformat()}
+        else:
+            self.watermark = {'column': column, 'kind': 'number', 'value': float(newest)}
+
+    def loaded_hashes(self, source):
+        """Sorted hashes of the rows loaded from the last version of source"""
+        key = source_key(source)
+        if key in self._new_hashes:
+            return self._new_hashes[key]
+        path = _hashes_file(self.hashes_dir, key)
+        if key in self.files and path.exists():
+            return np.load(path)
+        if key in self.files and self.legacy_hashes_path.exists():
+            return np.load(self.legacy_hashes_path)
+        return np.empty(0, dtype=np.uint64)
+
+    def record_file(self, source, rows, hashes=None):
+        """Record a loaded file; hashes (sorted, unique) replace its previous ones"""
+        key = source_key(source)
+        self.files[key] = {
+            'fingerprint': file_fingerprint(source),
+            'digest': self._digests.pop(key, None) or file_digest(source),
+            'rows': rows,
+            'loaded_at': pd.Timestamp.now().isoformat(),
+        }
+        if hashes is not None:
+            self._new_hashes[key] = hashes
+
+    def save(self):
+        """Write the manifest atomically, with the hash arrays of the files recorded since the last save"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hashes_dir.mkdir(exist_ok=True)
+        for key, hashes in self._new_hashes.items():
+            path = _hashes_file(self.hashes_dir, key)
+            with open(path.with_suffix('.tmp'), 'wb') as f:
+                np.save(f, hashes)
+            os.replace(path.with_suffix('.tmp'), path)
+        self._new_hashes = {}
+        tmp_path = self.path.with_suffix('.json.tmp')
+        tmp_path.write_text(json.dumps({'files': self.files, 'watermark': self.watermark}, indent=2))
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        self.files = {}
+        self.watermark = None
+        self._new_hashes = {}
+        self.path.unlink(missing_ok=True)
+        self.legacy_hashes_path.unlink(missing_ok=True)
+        shutil.rmtree(self.hashes_dir, ignore_errors=True)
+
+
+class RunCheckpoint:
+    """Progress of the current run, saved after every chunk the sink commits
+
+    For each source it records how many chunks are done, the byte offset and
+    row number to resume from, and whether the file is complete, along with
+    the watermark and the row hashes of every chunk loaded, one small .npy
+    per chunk so a save writes only the chunk just committed. A run that
+    was interrupted (a crash, a killed worker, a closed browser tab) then
+    resumes where it stopped instead of starting over. The checkpoint is
+    cleared once a run completes.
+
+    Quarantined chunks are written to the quarantine directory beside the
+    state file. Loading is at-least-once for the chunk in flight: a crash
+    between the sink committing a chunk and the checkpoint being saved
+    loads that chunk again.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.hashes_dir = self.path.with_suffix('.hashes')
+        self.quarantine_dir = self.path.parent / 'quarantine'
+        self.files = {}
+        self.meta = {}
+        self.watermark = None
+        self._new_hashes = {}
+        if self.path.exists():
+            state = json.loads(self.path.read_text())
+            self.files = state.get('files', {})
+            self.meta = state.get('meta', {})
+            self.watermark = state.get('watermark')
+
+    @property
+    def pending(self):
+        """True if an interrupted run left work to resume"""
+        return bool(self.files)
+
+    @staticmethod
+    def _identity(source):
+        # Paths are identified by size and mtime; uploads by their content
+        fingerprint = file_fingerprint(source)
+        return fingerprint if fingerprint is not None else file_digest(source)
+
+    def position(self, source):
+        """Checkpointed progress of source, or None if it has to start over"""
+        entry = self.files.get(source_key(source))
+        if entry is None or entry['identity'] != self._identity(source):
+            return None
+        return entry
+
+    def _chunk_hashes(self, key):
+        entry = self.files.get(key)
+        chunks = entry['chunks'] if entry else 0
+        arrays = []
+        for index in range(chunks):
+            path = _hashes_file(self.hashes_dir, key, f'_{index:06d}')
+            if (key, index) in self._new_hashes:
+                arrays.append(self._new_hashes[(key, index)])
+            elif path.exists():
+                arrays.append(np.load(path))
+        return arrays
+
+    def loaded_hashes(self, source):
+        """Sorted hashes of the rows loaded so far from source"""
+        arrays = self._chunk_hashes(source_key(source))
+        return np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.uint64)
+
+    @property
+    def seen_hashes(self):
+        """Sorted hashes of the rows loaded so far from all sources"""
+        arrays = [array for key in self.files for array in self._chunk_hashes(key)]
+        return np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.uint64)
+
+    def advance(self, source, chunk_entry, hashes=None):
+        """Record that a chunk of source was loaded (with the hashes of its rows) or quarantined"""
+        key = source_key(source)
+        entry = self.files.get(key)
+        if entry is None or chunk_entry['index'] == 0:
+            # Starting the file (again): earlier chunks' hashes belong to another version
+            for index in range(entry['chunks'] if entry else 0):
+                _hashes_file(self.hashes_dir, key, f'_{index:06d}').unlink(missing_ok=True)
+            entry = self.files[key] = {
+                'identity': self._identity(source), 'chunks': 0, 'offset': 0, 'rows': 0,
+                'rows_out': 0, 'complete': False,
+            }
+        entry['chunks'] = chunk_entry['index'] + 1
+        entry['offset'] = chunk_entry['end']
+        entry['rows'] = chunk_entry['next_row']
+        entry['rows_out'] += chunk_entry['rows']
+        if hashes is not None:
+            self._new_hashes[(key, chunk_entry['index'])] = hashes
+
+    def complete(self, source, rows_out):
+        key = source_key(source)
+        entry = self.files.setdefault(key, {'identity': self._identity(source), 'chunks': 0, 'offset': 0,
+                                            'rows': 0, 'rows_out': 0})
+        entry['rows_out'] = rows_out
+        entry['complete'] = True
+
+    def save(self):
+        """Write the checkpoint atomically, with the hashes of the chunks advanced since the last save"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hashes_dir.mkdir(exist_ok=True)
+        for (key, index), hashes in self._new_hashes.items():
+            path = _hashes_file(self.hashes_dir, key, f'_{index:06d}')
+            with open(path.with_suffix('.tmp'), 'wb') as f:
+                np.save(f, hashes)
+            os.replace(path.with_suffix('.tmp'), path)
+        self._new_hashes = {}
+        tmp_path = self.path.with_suffix('.json.tmp')
+        state = {'files': self.files, 'meta': self.meta, 'watermark': self.watermark}
+        tmp_path.write_text(json.dumps(state, indent=2))
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Forget the run; quarantined chunks are kept for inspection"""
+        self.files = {}
+        self.meta = {}
+        self.watermark = None
+        self._new_hashes = {}
+        self.path.unlink(missing_ok=True)
+        # Written by earlier versions
+        self.path.with_suffix('.hashes.npy').unlink(missing_ok=True)
+        shutil.rmtree(self.hashes_dir, ignore_errors=True)
+
+
+class PipelineResult:
+    """Outcome of a pipeline run: per-file results and real stage timings"""
+
+    def __init__(self, files, load_seconds, cross_file_duplicates, dedupe_seconds, wall_seconds,
+                 skipped_files=(), resumed_files=()):
+        self.files = files
+        self.skipped_files = list(skipped_files)
+        self.resumed_files = list(resumed_files)
+        self.cross_file_duplicates = cross_file_duplicates
+        self.wall_seconds = wall_seconds
+        self.workers = len({f['worker_pid'] for f in files})
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        for file_result in files:
+            for stage, seconds in file_result['timings'].items():
+                self.stage_seconds[stage] += seconds
+        self.stage_seconds['dedupe'] += dedupe_seconds
+        self.stage_seconds['load'] += load_seconds
+
+    @property
+    def rows_read(self):
+        return sum(f['rows_read'] for f in self.files)
+
+    @property
+    def rows_loaded(self):
+        return sum(f['rows_out'] for f in self.files if not f['error']) - self.cross_file_duplicates
+
+    @property
+    def rows_unchanged(self):
+        """Rows skipped because an earlier run already loaded them"""
+        return sum(f['rows_unchanged'] for f in self.files)
+
+    @property
+    def failed_files(self):
+        return [f for f in self.files if f['error']]
+
+    @property
+    def quarantined_chunks(self):
+        """Chunks that failed and were set aside, with their error"""
+        return [
+            {'name': f['name'], 'chunk': entry['index'], 'first_row': entry['first_row'],
+             'error': entry['error'], 'path': entry['path']}
+            for f in self.files for entry in f['chunks'] if entry['error']
+        ]
+
+    @property
+    def quality_score(self):
+        """Share of extracted rows that passed validation and cleaning"""
+        rejected = sum(f['rows_invalid'] + f['rows_empty'] + f['rows_quarantined'] for f in self.files)
+        return 1 - rejected / self.rows_read if self.rows_read else 1.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.wall_seconds if self.wall_seconds else 0.0
+
+    def validation_report(self):
+        """Per-rule violation counts and sample rows, merged across files"""
+        return merge_reports(f['validation'] for f in self.files)
+
+    def stage_timings(self):
+        """Seconds per stage, summed across workers"""
+        return pd.DataFrame({
+            'stage': list(self.stage_seconds),
+            'seconds': list(self.stage_seconds.values()),
+        })
+
+    def file_summary(self):
+        columns = ['name', 'rows_read', 'rows_invalid', 'rows_empty', 'duplicates',
+                   'rows_unchanged', 'rows_quarantined', 'chunks_resumed', 'rows_out', 'error']
+        return pd.DataFrame(self.files, columns=columns)
+
+
+def run_pipeline(sources, sink=None, executor=None, max_workers=None,
+                 chunksize=DEFAULT_CHUNK_ROWS, required_columns=(), on_file_done=None,
+                 manifest=None, watermark_column=None, rules=None, checkpoint=None):
+    """Process CSV sources concurrently and stream the results into sink
+
+    sources are file paths or (name, bytes) pairs. Pass a long-lived
+    ProcessPoolExecutor as executor to avoid paying worker start-up on every
+    run; otherwise one is created for the run, or the files are processed
+    inline when there is only one of them. on_file_done(done, total,
+    file_result) is called as each file is loaded.
+
+    With a manifest the run is incremental: unchanged files are skipped,
+    already loaded rows are filtered out, and the manifest is saved once the
+    sink has been closed successfully. watermark_column (a transformed,
+    snake_case column name) additionally skips rows that are not newer
+    than the highest value loaded so far.
+
+    rules is a validation spec evaluated on every chunk of every file; see
+    PipelineResult.validation_report() for the outcome.
+
+    With a RunCheckpoint, the sink is flushed and progress saved after every
+    chunk, and a run interrupted earlier resumes from the checkpoint: files
+    it completed are skipped and the others restart at their first chunk
+    not yet loaded. Chunks that fail are quarantined either way.
+    """
+    if isinstance(rules, dict):
+        # Fail fast on a bad spec rather than once per file in the workers
+        build_rules(rules)
+    sources = list(sources)
+    sink = sink if sink is not None else SummarySink()
+    skipped_files = []
+    resumed_files = []
+    starts = {}
+    seen_hashes = np.empty(0, dtype=np.uint64)
+    quarantine_dir = None
+    if checkpoint is not None:
+        quarantine_dir = str(checkpoint.quarantine_dir)
+        positions = [checkpoint.position(source) for source in sources]
+        for source, position in zip(sources, positions):
+            if position is None:
+                continue
+            resumed_files.append(source_name(source))
+            if not position['complete']:
+                starts[source_key(source)] = (position['chunks'], position['offset'], position['rows'])
+            elif manifest is not None:
+                manifest.record_file(source, position['rows_out'], checkpoint.loaded_hashes(source))
+        sources = [
+            source for source, position in zip(sources, positions)
+            if position is None or not position['complete']
+        ]
+        if checkpoint.pending:
+            seen_hashes = checkpoint.seen_hashes
+            if manifest is not None and checkpoint.watermark:
+                manifest.watermark = checkpoint.watermark
+    watermark = None
+    if manifest is not None:
+        unchanged = [manifest.is_unchanged(source) for source in sources]
+        skipped_files = [source_name(source) for source, same in zip(sources, unchanged) if same]
+        sources = [source for source, same in zip(sources, unchanged) if not same]
+        if watermark_column:
+            value = manifest.watermark_value(watermark_column)
+            watermark = (watermark_column, value) if value is not None else None
+    staging_dir = tempfile.mkdtemp(prefix='etl_staging_')
+    started = time.perf_counter()
+    files = []
+    cross_file_duplicates = 0
+    dedupe_seconds = 0.0
+    load_seconds = 0.0
+
+    max_workers = max_workers or max(min(len(sources), os.cpu_count() or 1), 1)
+    own_executor = executor is None and max_workers > 1 and len(sources) > 1
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def arguments(source):
+        return (source, staging_dir, chunksize, required_columns, watermark, rules,
+                starts.get(source_key(source)), quarantine_dir)
+
+    def results():
+        # Each result stays paired with its own source: names collide across directories
+        if executor is None:
+            for source in sources:
+                yield source, process_source(*arguments(source))
+            return
+        futures = {executor.submit(process_source, *arguments(source)): source for source in sources}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    try:
+        for source, file_result in results():
+            # Rows the file's last loaded version held, and the hashes of this version's rows
+            previous_hashes = np.empty(0, dtype=np.uint64)
+            if manifest is not None:
+                previous_hashes = manifest.loaded_hashes(source)
+            file_hashes = [checkpoint.loaded_hashes(source)] if source_key(source) in starts else []
+            # A file that fails outright loads nothing; quarantined chunks are kept
+            if file_result['error']:
+                for entry in file_result['chunks']:
+                    if not entry['error']:
+                        os.remove(entry['path'])
+                file_result['chunks'] = [entry for entry in file_result['chunks'] if entry['error']]
+
+            for entry in file_result['chunks']:
+                if not entry['error']:
+                    chunk, hashes = pd.read_pickle(entry['path'])
+                    os.remove(entry['path'])
+
+                    start = time.perf_counter()
+                    unchanged = _in_sorted(previous_hashes, hashes)
+                    duplicate = ~unchanged & _in_sorted(seen_hashes, hashes)
+                    fresh = ~unchanged & ~duplicate
+                    # Unchanged rows count as seen too: another file may hold them as well
+                    seen_hashes = _merge_sorted(seen_hashes, hashes[~duplicate])
+                    file_hashes.append(hashes)
+                    file_result['rows_unchanged'] += int(unchanged.sum())
+                    file_result['rows_out'] -= int(unchanged.sum())
+                    cross_file_duplicates += int(duplicate.sum())
+                    dedupe_seconds += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    sink.write(chunk[fresh])
+                    load_seconds += time.perf_counter() - start
+                    if watermark_column and manifest is not None and fresh.any():
+                        manifest.advance_watermark(watermark_column, chunk.loc[fresh, watermark_column])
+
+                if checkpoint is not None and not file_result['error']:
+                    start = time.perf_counter()
+                    sink.flush()
+                    checkpoint.watermark = manifest.watermark if manifest is not None else None
+                    checkpoint.advance(source, entry, None if entry['error'] else np.unique(hashes))
+                    checkpoint.save()
+                    load_seconds += time.perf_counter() - start
+
+            if not file_result['error']:
+                if manifest is not None:
+                    loaded = np.unique(np.concatenate(file_hashes)) if file_hashes else np.empty(0, dtype=np.uint64)
+                    manifest.record_file(source, file_result['rows_out'], loaded)
+                if checkpoint is not None:
+                    checkpoint.complete(source, file_result['rows_out'])
+                    checkpoint.save()
+            files.append(file_result)
+            if on_file_done:
+                on_file_done(len(files), len(sources), file_result)
+        start = time.perf_counter()
+        sink.close()
+        load_seconds += time.perf_counter() - start
+        if manifest is not None:
+            manifest.save()
+        if checkpoint is not None:
+            checkpoint.clear()
+    finally:
+        if own_executor:
+            executor.shutdown()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return PipelineResult(
+        files, load_seconds, cross_file_duplicates, dedupe_seconds, time.perf_counter() - started,
+        skipped_files, resumed_files,
+    )
+
+
+def write_sample_batch(directory, files=4, rows_per_file=50_000, seed=42):
+    """Write a batch of messy sales CSVs for demonstrating the pipeline
+
+    The files contain the usual problems: padded strings, blank cells,
+    empty rows, negative quantities, and duplicates both within and across
+    files.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(files):
+        dates = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, rows_per_file), unit='D')
+        df = pd.DataFrame({
+            'Order Date': dates.strftime('%Y-%m-%d'),
+            'Product': rng.choice(['Product A', 'Product B', 'Product C', ' Product A '], rows_per_file),
+            'Region': rng.choice(['North', 'South', 'East', 'West', 'north '], rows_per_file),
+            'Sales Amount': rng.normal(1000, 300, rows_per_file).clip(min=100).round(2),
+            'Quantity Sold': rng.poisson(20, rows_per_file),
+            'Customer ID': rng.integers(1, 10_001, rows_per_file),
+        })
+        df.loc[rng.choice(rows_per_file, rows_per_file // 100, replace=False), 'Sales Amount'] = np.nan
+        df.loc[rng.choice(rows_per_file, rows_per_file // 500, replace=False), 'Quantity Sold'] *= -1
+        df.loc[rng.choice(rows_per_file, rows_per_file // 200, replace=False), :] = np.nan
+        dupes = df.sample(rows_per_file // 50, random_state=i)
+        df = pd.concat([df, dupes], ignore_index=True)
+
+        path = directory / f"sales_2024_part{i + 1}.csv"
+        df.to_csv(path, index=False)
+        paths.append(path)
+
+    # One file re-delivered verbatim, as happens with retried exports
+    if files > 1:
+        resent = directory / "sales_2024_part1_resent.csv"
+        shutil.copyfile(paths[0], resent)
+        paths.append(resent)
+    return paths
+
+
+def append_sample_delivery(path, rows=1_000, seed=None, corrupt=False):
+    """Append freshly dated rows to a sample file, as a late delivery would
+
+    With corrupt=True one line in the middle of the delivery is mangled, so
+    the chunk holding it fails to parse.
+    """
+    rng = np.random.default_rng(seed)
+    existing = pd.read_csv(path, nrows=1)
+    last_date = pd.to_datetime(pd.read_csv(path, usecols=['Order Date'])['Order Date']).max()
+    dates = last_date + pd.to_timedelta(rng.integers(1, 8, rows), unit='D')
+    delivery = pd.DataFrame({
+        'Order Date': dates.strftime('%Y-%m-%d'),
+        'Product': rng.choice(['Product A', 'Product B', 'Product C'], rows),
+        'Region': rng.choice(['North', 'South', 'East', 'West'], rows),
+        'Sales Amount': rng.normal(1000, 300, rows).clip(min=100).round(2),
+        'Quantity Sold': rng.poisson(20, rows),
+        'Customer ID': rng.integers(1, 10_001, rows),
+    })[list(existing.columns)]
+    text = delivery.to_csv(header=False, index=False)
+    if corrupt:
+        lines = text.splitlines(keepends=True)
+        lines[len(lines) // 2] = lines[len(lines) // 2].rstrip('\n') + ',???,???\n'
+        text = ''.join(lines)
+    with open(path, 'a', newline='') as f:
+        f.write(text)
+    return rows
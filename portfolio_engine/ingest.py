@@ -0,0 +1,371 @@
+"""
+Streaming CSV ingestion.
+
+Uploads are read in bounded chunks and folded into a running profile, so
+row counts, missing values, duplicates, memory usage and describe() are
+available without ever materializing the whole file as one DataFrame.
+
+Everything loaded here also goes through optimize_dtypes(), which shrinks
+the default int64/float64/object dtypes pandas infers for CSVs.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_ROWS = 100_000
+DEFAULT_SAMPLE_ROWS = 20_000
+# Distinct row hashes kept for duplicate counting (8 bytes each); exact up to this many
+DUPLICATE_SKETCH_SIZE = 1 << 20
+PREVIEW_ROWS = 10
+
+# Object columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_RATIO = 0.5
+DATE_SAMPLE_ROWS = 100
+ISO_DATE_PATTERN = re.compile(r'^\d{4}-\d{1,2}-\d{1,2}([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?$')
+SLASH_DATE_PATTERN = re.compile(r'^\d{1,2}/\d{1,2}/\d{2,4}$')
+
+
+def _is_text(series):
+    return series.dtype == object or isinstance(series.dtype, pd.StringDtype)
+
+
+def parse_date_series(series):
+    """Parse a text column of ISO or slash-formatted dates, or return None
+
+    The format is detected from the first non-null values and the column is
+    only converted when every non-null value parses.
+    """
+    if not _is_text(series):
+        return None
+    non_null = series.dropna()
+    if non_null.empty:
+        return None
+
+    head = non_null.head(DATE_SAMPLE_ROWS).astype(str)
+    date_format = None
+    if head.str.match(ISO_DATE_PATTERN).all():
+        date_format = 'ISO8601'
+    elif not head.str.match(SLASH_DATE_PATTERN).all():
+        return None
+
+    parsed = pd.to_datetime(series, errors='coerce', format=date_format)
+    if parsed.isna().sum() != series.isna().sum():
+        return None
+    return parsed
+
+
+def parse_date_columns(df):
+    """Return df with every date-like text column parsed to datetime64"""
+    parsed_df = df.copy(deep=False)
+    for col in df.columns:
+        parsed = parse_date_series(df[col])
+        if parsed is not None:
+            parsed_df[col] = parsed
+    return parsed_df
+
+
+def _optimize_series(series, category_max_ratio, parse_dates):
+    """Return a smaller-typed equivalent of series, or series itself"""
+    if pd.api.types.is_bool_dtype(series):
+        return series
+
+    if pd.api.types.is_integer_dtype(series):
+        kind = 'unsigned' if len(series) and series.min() >= 0 else 'integer'
+        return pd.to_numeric(series, downcast=kind)
+
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype='float64', na_value=np.nan)
+        if not np.isnan(values).any() and np.array_equal(values, np.round(values)):
+            kind = 'unsigned' if len(values) and values.min() >= 0 else 'integer'
+            return pd.to_numeric(series, downcast=kind)
+        # Only narrow to float32 when no value changes on the round trip
+        narrowed = values.astype('float32')
+        if series.dtype != 'float32' and np.array_equal(narrowed.astype('float64'), values, equal_nan=True):
+            return pd.Series(narrowed, index=series.index, name=series.name)
+        return series
+
+    if not _is_text(series):
+        return series
+
+    non_null = series.dropna()
+    if non_null.empty:
+        return series
+
+    if parse_dates:
+        parsed = parse_date_series(series)
+        if parsed is not None:
+            return parsed
+
+    if non_null.nunique() <= category_max_ratio * len(series):
+        return series.astype('category')
+    return series
+
+
+def optimize_dtypes(df, category_max_ratio=CATEGORY_MAX_RATIO, parse_dates=True):
+    """Downcast numerics, categorize repetitive strings and parse dates
+
+    Numeric downcasts are lossless: floats only become integers or float32
+    when every value survives the conversion unchanged. Returns the
+    optimized frame and a report with the before/after footprint and the
+    dtype change of every converted column.
+    """
+    before = int(df.memory_usage(deep=True).sum())
+    optimized = df.copy(deep=False)
+    changes = {}
+    for col in df.columns:
+        series = df[col]
+        converted = _optimize_series(series, category_max_ratio, parse_dates)
+        if converted.dtype != series.dtype:
+            optimized[col] = converted
+            changes[col] = (str(series.dtype), str(converted.dtype))
+
+    after = int(optimized.memory_usage(deep=True).sum())
+    report = {
+        'before_bytes': before,
+        'after_bytes': after,
+        'reduction': 1 - after / before if before else 0.0,
+        'changes': changes,
+    }
+    return optimized, report
+
+
+class CsvProfile:
+    """Running profile of a CSV that is fed one chunk at a time"""
+
+    def __init__(self, sample_rows=DEFAULT_SAMPLE_ROWS, optimize=True, seed=42):
+        self.sample_rows = sample_rows
+        self.optimize = optimize
+        self.rows = 0
+        self.chunks = 0
+        self.memory_bytes = 0
+        self.raw_memory_bytes = 0
+        self.bytes_read = 0
+        self.total_bytes = None
+        self.columns = []
+        self.missing = pd.Series(dtype='int64')
+        self.head = pd.DataFrame()
+        self.sample = pd.DataFrame()
+        self._sample_keys = np.empty(0)
+        # The smallest distinct row hashes seen, at most DUPLICATE_SKETCH_SIZE of them
+        self._seen_hashes = np.empty(0, dtype=np.uint64)
+        self._stats = {}
+        self._non_numeric = set()
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def missing_total(self):
+        return int(self.missing.sum())
+
+    @property
+    def numeric_columns(self):
+        return [c for c in self.columns if c in self._stats and c not in self._non_numeric]
+
+    @property
+    def is_sampled(self):
+        """True once the sample no longer holds every row"""
+        return self.rows > len(self.sample)
+
+    @property
+    def memory_reduction(self):
+        """Share of the raw pandas footprint saved by dtype optimization"""
+        if not self.raw_memory_bytes:
+            return 0.0
+        return 1 - self.memory_bytes / self.raw_memory_bytes
+
+    @property
+    def duplicates_exact(self):
+        """False once there were too many distinct rows to count duplicates exactly"""
+        return len(self._seen_hashes) < DUPLICATE_SKETCH_SIZE
+
+    @property
+    def duplicates(self):
+        """Rows that repeat an earlier row; an estimate unless duplicates_exact
+
+        The estimate is rows minus the k-minimum-values distinct count of
+        the row hashes, within about 1/sqrt(DUPLICATE_SKETCH_SIZE) (0.1%)
+        of the distinct rows.
+        """
+        if self.duplicates_exact:
+            return self.rows - len(self._seen_hashes)
+        kth = float(self._seen_hashes[-1]) + 1
+        distinct = (DUPLICATE_SKETCH_SIZE - 1) * 2.0 ** 64 / kth
+        return max(int(round(self.rows - distinct)), 0)
+
+    @property
+    def nbytes(self):
+        """Memory held by the profile itself; bounded by the sample and sketch sizes, not the source"""
+        frames = self.sample.memory_usage(deep=True).sum() + self.head.memory_usage(deep=True).sum()
+        return int(frames + self._seen_hashes.nbytes + self._sample_keys.nbytes)
+
+    @property
+    def progress(self):
+        """Fraction of the source consumed, when its size is known"""
+        if not self.total_bytes:
+            return None
+        return min(self.bytes_read / self.total_bytes, 1.0)
+
+    def update(self, chunk):
+        """Fold one chunk into the profile"""
+        if self.optimize:
+            chunk, report = optimize_dtypes(chunk)
+            self.raw_memory_bytes += report['before_bytes']
+            self.memory_bytes += report['after_bytes']
+        else:
+            chunk_bytes = int(chunk.memory_usage(deep=True).sum())
+            self.raw_memory_bytes += chunk_bytes
+            self.memory_bytes += chunk_bytes
+
+        if not self.columns:
+            self.columns = list(chunk.columns)
+        if self.head.empty:
+            self.head = chunk.head(PREVIEW_ROWS)
+        elif len(self.head) < PREVIEW_ROWS:
+            self.head = pd.concat([self.head, chunk.head(PREVIEW_ROWS - len(self.head))])
+
+        self.rows += len(chunk)
+        self.chunks += 1
+        self.missing = self.missing.add(chunk.isna().sum(), fill_value=0).astype('int64')
+
+        self._update_duplicates(chunk)
+        self._update_numeric_stats(chunk)
+        self._update_sample(chunk)
+        return self
+
+    def _update_duplicates(self, chunk):
+        # Integer columns turn into floats in chunks that contain NaN, so hash
+        # numerics as float64 to keep the same row hashing identically.
+        normalized = chunk.copy(deep=False)
+        for col in chunk.select_dtypes(include=[np.number]).columns:
+            normalized[col] = chunk[col].astype('float64')
+        hashes = pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+        if not self.duplicates_exact:
+            # Hashes above the largest one kept cannot enter the sketch
+            hashes = hashes[hashes < self._seen_hashes[-1]]
+        new_hashes = np.unique(hashes)
+        seen = self._seen_hashes
+        if len(seen):
+            # Merge into the sorted sketch; np.union1d would re-sort all of it
+            pos = np.searchsorted(seen, new_hashes)
+            fresh = seen[np.minimum(pos, len(seen) - 1)] != new_hashes
+            seen = np.insert(seen, pos[fresh], new_hashes[fresh])
+        else:
+            seen = new_hashes
+        self._seen_hashes = seen[:DUPLICATE_SKETCH_SIZE]
+
+    def _update_numeric_stats(self, chunk):
+        numeric = set(chunk.select_dtypes(include=[np.number]).columns)
+        for col in chunk.columns:
+            if col in self._non_numeric:
+                continue
+            if col not in numeric:
+                # A column is only numeric if every chunk parsed as numeric;
+                # all-empty chunks come through as object and are skipped.
+                if chunk[col].notna().any():
+                    self._non_numeric.add(col)
+                    self._stats.pop(col, None)
+                continue
+
+            values = chunk[col].to_numpy(dtype='float64', na_value=np.nan)
+            values = values[~np.isnan(values)]
+            if not len(values):
+                continue
+
+            n_b = len(values)
+            mean_b = values.mean()
+            m2_b = ((values - mean_b) ** 2).sum()
+            if col not in self._stats:
+                self._stats[col] = [n_b, mean_b, m2_b, values.min(), values.max()]
+                continue
+
+            # Chan et al. parallel variance merge
+            n_a, mean_a, m2_a, min_a, max_a = self._stats[col]
+            n = n_a + n_b
+            delta = mean_b - mean_a
+            self._stats[col] = [
+                n,
+                mean_a + delta * n_b / n,
+                m2_a + m2_b + delta ** 2 * n_a * n_b / n,
+                min(min_a, values.min()),
+                max(max_a, values.max()),
+            ]
+
+    def _update_sample(self, chunk):
+        # Bottom-k sampling: every row draws a random key and the rows with
+        # the smallest keys form a uniform sample of everything seen so far.
+        keys = self._rng.random(len(chunk))
+        if len(self.sample) >= self.sample_rows:
+            # Only rows that beat the current worst key can enter the sample
+            entering = keys < self._sample_keys.max()
+            chunk, keys = chunk[entering], keys[entering]
+
+        if self.sample.empty:
+            combined = chunk.reset_index(drop=True)
+        else:
+            combined = pd.concat([self.sample, chunk], ignore_index=True)
+        combined_keys = np.concatenate([self._sample_keys, keys])
+
+        if len(combined) > self.sample_rows:
+            keep = np.sort(np.argpartition(combined_keys, self.sample_rows - 1)[:self.sample_rows])
+            combined = combined.iloc[keep].reset_index(drop=True)
+            combined_keys = combined_keys[keep]
+        self.sample = combined
+        self._sample_keys = combined_keys
+
+    def describe(self):
+        """Equivalent of DataFrame.describe() for the numeric columns
+
+        count, mean, std, min and max are exact; the quartiles come from the
+        row sample and are therefore approximate once ``is_sampled`` is True.
+        """
+        summary = {}
+        for col in self.numeric_columns:
+            n, mean, m2, lo, hi = self._stats[col]
+            quartiles = pd.to_numeric(self.sample[col], errors='coerce').quantile([0.25, 0.5, 0.75])
+            summary[col] = {
+                'count': float(n),
+                'mean': mean,
+                'std': np.sqrt(m2 / (n - 1)) if n > 1 else np.nan,
+                'min': lo,
+                '25%': quartiles.loc[0.25],
+                '50%': quartiles.loc[0.5],
+                '75%': quartiles.loc[0.75],
+                'max': hi,
+            }
+        return pd.DataFrame(summary)
+
+
+def iter_csv_chunks(source, chunksize=DEFAULT_CHUNK_ROWS, **read_csv_kwargs):
+    """Yield DataFrames of at most ``chunksize`` rows from a CSV path or file object"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    with pd.read_csv(source, chunksize=chunksize, **read_csv_kwargs) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def stream_csv_profile(source, chunksize=DEFAULT_CHUNK_ROWS, sample_rows=DEFAULT_SAMPLE_ROWS, optimize=True):
+    """Profile a CSV chunk by chunk, yielding the running profile after each chunk"""
+    profile = CsvProfile(sample_rows=sample_rows, optimize=optimize)
+    profile.total_bytes = getattr(source, 'size', None)
+    for chunk in iter_csv_chunks(source, chunksize):
+        profile.update(chunk)
+        if hasattr(source, 'tell'):
+            profile.bytes_read = source.tell()
+        yield profile
+
+
+def profile_csv(source, chunksize=DEFAULT_CHUNK_ROWS, sample_rows=DEFAULT_SAMPLE_ROWS, optimize=True):
+    """Profile a whole CSV in bounded memory and return the final profile"""
+    profile = None
+    for profile in stream_csv_profile(source, chunksize, sample_rows, optimize):
+        pass
+    return profile
+
+
+def profile_dataframe(df, sample_rows=DEFAULT_SAMPLE_ROWS, optimize=True):
+    """Profile an in-memory DataFrame the same way an upload is profiled"""
+    profile = CsvProfile(sample_rows=sample_rows, optimize=optimize)
+    return profile.update(df)
@@ -0,0 +1,290 @@
+"""
+Background producers for the live demo pages.
+
+A page that generates or parses its own data on every refresh makes each
+viewer pay for it, and a page that sleeps before rerunning itself holds a
+script thread for nothing. A feed instead runs a daemon thread that does
+the work once per interval for every viewer and keeps the result in
+shared state; pages only read a snapshot under the feed's lock.
+
+Feeds stop themselves once nobody has read them for idle_seconds, and
+start again on the next read, so a server left alone does no work.
+"""
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from portfolio_engine.log_stats import LogAggregates
+from portfolio_engine.logs import LogTailer, standard_fields
+from portfolio_engine.templates import TemplateMiner
+from portfolio_engine.timeseries import MetricStore
+
+RECENT_ROWS = 100
+# Tiers and raw blocks a load test of a minute or so fills: the write path
+# is the dashboard's, without preallocating weeks of rollups per series
+LOAD_TEST_TIERS = ((60, 60), (300, 12), (3600, 2))
+LOAD_TEST_RAW_SECONDS = 300
+LOAD_TEST_BLOCK_POINTS = 128
+
+
+class BackgroundFeed:
+    """Calls tick() every interval seconds on a daemon thread while someone is reading"""
+
+    def __init__(self, interval=1.0, idle_seconds=300):
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.ticks = 0
+        self.error = None
+        self.last_read = time.monotonic()
+        self._thread = None
+
+    def tick(self):
+        raise NotImplementedError
+
+    def _run(self):
+        while time.monotonic() - self.last_read < self.idle_seconds:
+            started = time.monotonic()
+            try:
+                self.tick()
+                self.error = None
+            except Exception as e:  # noqa: BLE001 - keep producing; the page shows the error
+                self.error = e
+            self.ticks += 1
+            time.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def touch(self):
+        """Record a reader and make sure the producer is running"""
+        self.last_read = time.monotonic()
+        with self.lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+                self._thread.start()
+        return self
+
+
+class LogFeed(BackgroundFeed):
+    """Follows a log file and keeps LogAggregates of everything it delivered
+
+    write, if given, is called with the path before every poll, e.g. to
+    append synthetic traffic to a demo file. delta holds the aggregates of
+    the latest poll only, and recent its last RECENT_ROWS rows. templates
+    mines the message templates of every line as it arrives.
+    """
+
+    def __init__(self, path, write=None, interval=1.0, bucket_seconds=60, buckets=180, **kwargs):
+        super().__init__(interval, **kwargs)
+        self.path = str(path)
+        self.write = write
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.tailer = LogTailer(path)
+        self.stats = LogAggregates(bucket_seconds, buckets)
+        self.delta = LogAggregates(bucket_seconds, buckets)
+        self.templates = TemplateMiner(bucket_seconds=bucket_seconds, buckets=buckets)
+        self.recent = standard_fields(pd.DataFrame())
+
+    def tick(self):
+        if self.write is not None:
+            self.write(self.path)
+        # Parse outside the lock; readers only wait for the fold
+        result = self.tailer.poll()
+        delta = LogAggregates(self.bucket_seconds, self.buckets)
+        rows = standard_fields(result.frame) if result is not None else None
+        if rows is not None:
+            delta.add(rows)
+        with self.lock:
+            if rows is not None:
+                self.stats.add(rows)
+                self.templates.add_frame(result.frame)
+                recent = pd.concat([self.recent, rows.tail(RECENT_ROWS)], ignore_index=True)
+                self.recent = recent.tail(RECENT_ROWS).reset_index(drop=True)
+            self.delta = delta
+
+
+class HostSimulator:
+    """Synthetic CPU, memory, disk I/O, traffic and latency of a fleet of hosts
+
+    Each host gets its own baseline; CPU, memory and disk I/O are
+    mean-reverting random walks (AR(1), stepped exactly for any dt),
+    traffic follows a daily cycle, and response time rises with CPU.
+    """
+
+    METRICS = ('cpu_usage', 'memory_usage', 'disk_io', 'requests_per_min', 'response_time')
+
+    def __init__(self, hosts=50, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.hosts = [f"host-{i:03d}" for i in range(hosts)]
+        self.cpu_base = self.rng.uniform(20, 60, hosts)
+        self.memory_base = self.rng.uniform(40, 75, hosts)
+        self.disk_base = self.rng.uniform(5, 50, hosts)
+        self.cpu = self.cpu_base.copy()
+        self.memory = self.memory_base.copy()
+        self.disk = np.zeros(hosts)
+
+    def _revert(self, level, base, sigma, tau, dt):
+        phi = np.exp(-dt / tau)
+        return base + phi * (level - base) + self.rng.normal(0, sigma * np.sqrt(1 - phi ** 2), len(level))
+
+    def step(self, timestamp, dt=1.0):
+        """Every host's sample at timestamp, dt seconds after the previous one, by metric"""
+        hour = pd.Timestamp(timestamp).value / 3.6e12 % 24
+        daily = 1 + 0.3 * np.sin((hour - 9) / 24 * 2 * np.pi)
+        self.cpu = np.clip(self._revert(self.cpu, self.cpu_base * daily, 8, 30, dt), 0, 100)
+        self.memory = np.clip(self._revert(self.memory, self.memory_base, 3, 600, dt), 0, 100)
+        # Log-scale walk: disk I/O comes in bursts
+        self.disk = self._revert(self.disk, 0, 0.6, 20, dt)
+        requests = self.rng.poisson(100 * daily, len(self.hosts))
+        return {
+            'cpu_usage': self.cpu,
+            'memory_usage': self.memory,
+            'disk_io': self.disk_base * np.exp(self.disk),
+            'requests_per_min': requests.astype(np.float64),
+            'response_time': 20 + 0.02 * self.cpu ** 2 + self.rng.exponential(15, len(self.hosts)),
+        }
+
+    def history(self, start, end, step_seconds=60, batch_steps=1440):
+        """Samples every step_seconds from start to end, as (timestamps, {metric: (steps, hosts)}) batches"""
+        stamps = pd.date_range(start, end, freq=pd.Timedelta(seconds=step_seconds))
+        for offset in range(0, len(stamps), batch_steps):
+            batch = stamps[offset:offset + batch_steps]
+            samples = [self.step(stamp, step_seconds) for stamp in batch]
+            yield batch, {metric: np.stack([sample[metric] for sample in samples]) for metric in self.METRICS}
+
+
+class MetricsFeed(BackgroundFeed):
+    """Synthetic metrics of a fleet of hosts, one sample per host per interval, kept in a MetricStore
+
+    The first tick backfills backfill_seconds of history at one sample a
+    backfill_step, so the dashboard has weeks to query from the start.
+    """
+
+    def __init__(self, interval=1.0, hosts=50, backfill_seconds=14 * 86400, backfill_step=60, seed=None,
+                 store=None, **kwargs):
+        super().__init__(interval, **kwargs)
+        self.simulator = HostSimulator(hosts, seed)
+        self.store = store if store is not None else MetricStore()
+        self.backfill_seconds = backfill_seconds
+        self.backfill_step = backfill_step
+        self.last_tick = None
+
+    def backfill(self, now):
+        start = now - pd.Timedelta(seconds=self.backfill_seconds)
+        for stamps, columns in self.simulator.history(start, now - pd.Timedelta(seconds=self.interval),
+                                                      self.backfill_step):
+            self.store.append_wide(stamps, self.simulator.hosts, columns)
+
+    def tick(self):
+        now = pd.Timestamp.now()
+        if self.store.newest is None and self.backfill_seconds:
+            self.backfill(now)
+        dt = self.interval if self.last_tick is None else (now - self.last_tick).total_seconds()
+        self.store.append_wide(now, self.simulator.hosts, self.simulator.step(now, dt))
+        self.last_tick = now
+
+
+def generate_metrics_load(store=None, hosts=50, rate=None, seconds=10.0, batch_seconds=0.1, seed=None,
+                          progress=None):
+    """Write synthetic metrics of hosts into a MetricStore at rate points/sec and measure ingestion
+
+    Batches of samples go through store.append_wide, the path MetricsFeed
+    writes by, timestamped in real time, every batch_seconds for seconds.
+    rate is the target in points per second over all hosts and metrics:
+    a batch holds about rate * batch_seconds points, several samples of
+    every host, or a group of the hosts when that is fewer points than one
+    sample of each (the groups then take turns). With rate None, batches
+    of one sample per host (a MetricsFeed tick) are written back to back.
+    store defaults to a new MetricStore with LOAD_TEST_TIERS and small
+    raw blocks. progress, if given, is called
+    with the fraction of seconds elapsed after every batch.
+
+    Batches are due on a fixed schedule (open loop), and latency is
+    measured from when a batch was due until its write returned, so time
+    spent queued behind a slow write counts too.
+
+    Returns a dict with the points written, the sustained rate (points per
+    second and minute, generation and pacing included), the rate of the
+    writes alone, batch latency percentiles in ms and memory per series,
+    both used (holding points) and allocated.
+    """
+    if store is None:
+        store = MetricStore(LOAD_TEST_TIERS, raw_seconds=LOAD_TEST_RAW_SECONDS, block_points=LOAD_TEST_BLOCK_POINTS)
+    simulator = HostSimulator(hosts, seed)
+    metrics = HostSimulator.METRICS
+    per_step = hosts * len(metrics)
+    steps, group = 1, hosts
+    if rate:
+        batch_points = rate * batch_seconds
+        if batch_points >= per_step:
+            steps = max(1, round(batch_points / per_step))
+        else:
+            group = max(1, round(batch_points / len(metrics)))
+        batch_seconds = steps * group * len(metrics) / rate
+    groups = [slice(first, first + group) for first in range(0, hosts, group)]
+    # Seconds between two samples of one host
+    dt = batch_seconds / steps if len(groups) == 1 else batch_seconds * len(groups)
+    # Register the series up front; the catalog is not what is being measured
+    for metric in metrics:
+        store.series_ids(simulator.hosts, metric)
+    latencies = []
+    write_seconds = 0.0
+    points = 0
+    batch = 0
+    sample = None
+    started = time.perf_counter()
+    deadline = started + seconds
+    due = started
+    clock = pd.Timestamp.now().value
+    while time.perf_counter() < deadline:
+        if len(groups) == 1:
+            stamps = clock + (np.arange(steps) * dt * 1e9).astype(np.int64)
+            samples = [simulator.step(pd.Timestamp(stamp), dt) for stamp in stamps]
+            columns = {metric: np.stack([step[metric] for step in samples]) for metric in metrics}
+            names = simulator.hosts
+        else:
+            position = batch % len(groups)
+            if position == 0:
+                # One sample of every host per round of groups
+                sample = simulator.step(pd.Timestamp(clock), dt)
+            stamps = np.array([clock], dtype=np.int64)
+            columns = {metric: sample[metric][groups[position]][None, :] for metric in metrics}
+            names = simulator.hosts[groups[position]]
+        write_start = time.perf_counter()
+        if not rate:
+            due = write_start
+        points += store.append_wide(stamps, names, columns)
+        done = time.perf_counter()
+        write_seconds += done - write_start
+        latencies.append(done - due)
+        clock += int(batch_seconds * 1e9)
+        batch += 1
+        if rate:
+            # Open loop: a slow write is not made up for by skipping the wait it caused
+            due += batch_seconds
+            time.sleep(max(min(due, deadline) - time.perf_counter(), 0))
+        if progress is not None:
+            progress(min((time.perf_counter() - started) / seconds, 1.0))
+    elapsed = time.perf_counter() - started
+    latencies_ms = np.array(latencies) * 1000
+    stats = store.stats()
+    return {
+        'hosts': hosts,
+        'series': stats['series'],
+        'target_rate': rate,
+        'points': points,
+        'batches': len(latencies),
+        'seconds': elapsed,
+        'points_per_second': points / elapsed,
+        'points_per_minute': points / elapsed * 60,
+        'write_points_per_second': points / write_seconds if write_seconds else 0.0,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'max_ms': float(latencies_ms.max()),
+        'bytes_per_series': stats['bytes_per_series'],
+        'used_bytes_per_series': stats['used_bytes_per_series'],
+        'raw_bytes_per_series': stats['raw_bytes'] / stats['series'],
+        'latencies_ms': latencies_ms,
+    }
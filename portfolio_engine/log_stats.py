@@ -0,0 +1,343 @@
+"""
+Incremental aggregates over a live log.
+
+A log visualizer that regroups every row it has seen on each refresh gets
+slower the longer it runs. LogAggregates instead folds each batch of new
+rows (in the standard_fields layout from portfolio_engine.logs) into
+fixed-size ring buffers indexed by time bucket, level and service:
+
+    counts[bucket, level, service]          lines
+    response_sum / response_count[...]      for mean response times
+    answered / succeeded[...]               for success rates
+
+    latency[bucket, service, bin]           DDSketch bins of response times
+
+Adding a batch costs O(rows in the batch + buckets); every chart and metric
+reads the buffers in O(buckets * levels * services), however many rows
+have gone by. Buckets older than the window are recycled as time moves on.
+
+Latency percentiles come from DDSketch: response times are counted in
+logarithmically spaced bins, so any quantile is known to within a fixed
+relative error from a fixed number of counters, and two sketches (or two
+workers' aggregates) merge by adding their counts.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL', 'OTHER')
+ERROR_LEVELS = ('ERROR', 'CRITICAL')
+OTHER_SERVICE = '(other)'
+BUFFERS = ('counts', 'response_sum', 'response_count', 'answered', 'succeeded')
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class DDSketch:
+    """Mergeable quantile sketch with relative accuracy, in a fixed number of bins
+
+    Quantiles of values between min_value and max_value are returned
+    within relative_accuracy of an actual value; smaller and larger values
+    are clamped into the edge bins. Memory is one int64 per bin, about 400
+    bins for 2% accuracy over 0.1 to 1,000,000 (milliseconds, say).
+    Sketches with the same parameters merge by adding counts.
+    """
+
+    def __init__(self, relative_accuracy=0.02, min_value=0.1, max_value=1e6):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.offset = math.ceil(math.log(min_value) / self.log_gamma)
+        self.bins = math.ceil(math.log(max_value) / self.log_gamma) - self.offset + 1
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+
+    def index(self, values):
+        """Bin of each value"""
+        values = np.clip(np.asarray(values, dtype='float64'), self.min_value, self.max_value)
+        return (np.ceil(np.log(values) / self.log_gamma) - self.offset).astype(np.int64).clip(0, self.bins - 1)
+
+    def value(self, index):
+        """Representative value of bins, within relative_accuracy of everything in them"""
+        return 2 * self.gamma ** (np.asarray(index) + self.offset) / (self.gamma + 1)
+
+    def add(self, values):
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        self.counts += np.bincount(self.index(values), minlength=self.bins)
+        return self
+
+    def merge(self, other):
+        if (other.relative_accuracy, other.min_value, other.max_value) != \
+                (self.relative_accuracy, self.min_value, self.max_value):
+            raise ValueError("only sketches with the same parameters can be merged")
+        self.counts += other.counts
+        return self
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantile(self, q):
+        """Estimated q-quantile(s), NaN for an empty sketch"""
+        return sketch_quantiles(self, self.counts, q)
+
+    def __repr__(self):
+        return f"DDSketch({self.relative_accuracy:.0%} accuracy, {self.count:,} values)"
+
+
+def sketch_quantiles(sketch, counts, quantiles):
+    """Quantiles from bin counts along the last axis, for any number of leading axes
+
+    counts is laid out as sketch's bins, e.g. the latency buffer of
+    LogAggregates summed over some axes. Returns NaN where there are no
+    values.
+    """
+    counts = np.asarray(counts)
+    scalar = np.ndim(quantiles) == 0
+    quantiles = np.atleast_1d(np.asarray(quantiles, dtype='float64'))
+    cumulative = np.cumsum(counts, axis=-1)
+    total = cumulative[..., -1:]
+    # Rank of the quantile among the values, as in DDSketch: q * (n - 1)
+    ranks = quantiles * (total - 1)
+    index = (cumulative[..., None, :] > ranks[..., None]).argmax(axis=-1)
+    result = np.where(total > 0, sketch.value(index), np.nan)
+    return result[..., 0] if scalar else result
+
+
+def _scatter_add(target, cells, weights=None):
+    """target.flat[cells] += 1 (or weights), touching only those cells
+
+    A bincount with minlength=target.size would allocate the whole buffer
+    on every update, however few lines it carries.
+    """
+    touched, inverse = np.unique(cells, return_inverse=True)
+    totals = np.bincount(inverse, weights=weights, minlength=len(touched))
+    target.reshape(-1)[touched] += totals.astype(target.dtype, copy=False)
+
+
+class LogAggregates:
+    """Per time bucket, level and service counts in fixed-size ring buffers
+
+    bucket_seconds wide buckets, the latest buckets of them kept. At most
+    max_services services are tracked separately; the rest share one
+    '(other)' slot. Latency sketches take buckets * max_services *
+    sketch bins * 4 bytes at most, under 10 MB with the defaults.
+    """
+
+    def __init__(self, bucket_seconds=60, buckets=180, max_services=32, relative_accuracy=0.02):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_ns = int(bucket_seconds * 1e9)
+        self.buckets = buckets
+        self.max_services = max_services
+        self.services = []
+        self._service_index = {}
+        self.bucket_ids = np.full(buckets, -1, dtype=np.int64)
+        self.head = None
+        self.total = 0
+        self.late = 0
+        for name in BUFFERS:
+            setattr(self, name, np.zeros((buckets, len(LEVELS), 0)))
+        # Bin layout of the latency sketches; its own counts stay unused
+        self.sketch = DDSketch(relative_accuracy)
+        self.latency = np.zeros((buckets, 0, self.sketch.bins), dtype=np.uint32)
+
+    # Updates
+    def _level_codes(self, levels):
+        levels = pd.Categorical(levels)
+        names = pd.Index(levels.categories.astype(str)).str.upper()
+        mapping = np.array([LEVELS.index(name) if name in LEVELS else LEVELS.index('OTHER') for name in names]
+                           + [LEVELS.index('OTHER')], dtype=np.int64)
+        return mapping[levels.codes]
+
+    def _service_slot(self, name):
+        slot = self._service_index.get(name)
+        if slot is None:
+            if len(self.services) >= self.max_services - 1 and name != OTHER_SERVICE:
+                return self._service_slot(OTHER_SERVICE)
+            slot = self._service_index[name] = len(self.services)
+            self.services.append(name)
+        return slot
+
+    def _service_codes(self, services):
+        services = pd.Categorical(services)
+        missing = self._service_slot('unknown') if (services.codes < 0).any() else 0
+        codes = np.array([self._service_slot(name) for name in map(str, services.categories)] + [missing],
+                         dtype=np.int64)
+        self._grow()
+        return codes[services.codes]
+
+    def _grow(self):
+        """Widen the buffers for services seen since the last call"""
+        grow = len(self.services) - self.counts.shape[2]
+        if grow > 0:
+            for name in BUFFERS:
+                setattr(self, name, np.pad(getattr(self, name), ((0, 0), (0, 0), (0, grow))))
+            self.latency = np.pad(self.latency, ((0, 0), (0, grow), (0, 0)))
+
+    def _advance(self, newest):
+        """Move the head to bucket newest, recycling the slots that fall out of the window"""
+        if self.head is not None and newest <= self.head:
+            return
+        first = newest - self.buckets + 1 if self.head is None else max(self.head + 1, newest - self.buckets + 1)
+        ids = np.arange(first, newest + 1)
+        slots = ids % self.buckets
+        self.bucket_ids[slots] = ids
+        for name in BUFFERS:
+            getattr(self, name)[slots] = 0
+        self.latency[slots] = 0
+        self.head = newest
+
+    def add(self, rows):
+        """Fold a batch of standard_fields rows into the buffers"""
+        count = len(rows)
+        if not count:
+            return
+        self.total += count
+        stamps = rows['timestamp'].to_numpy(dtype='datetime64[ns]')
+        valid = ~np.isnat(stamps)
+        bucket = stamps.astype(np.int64) // self.bucket_ns
+        if valid.any():
+            self._advance(int(bucket[valid].max()))
+        elif self.head is None:
+            self._advance(pd.Timestamp.now().value // self.bucket_ns)
+        # Lines without a timestamp count towards the latest bucket
+        bucket = np.where(valid, bucket, self.head)
+        keep = bucket > self.head - self.buckets
+        self.late += int((~keep).sum())
+
+        levels = self._level_codes(rows['level'])[keep]
+        services = self._service_codes(rows['service'])[keep]
+        shape = self.counts.shape
+        flat = ((bucket[keep] % self.buckets) * shape[1] + levels) * shape[2] + services
+        _scatter_add(self.counts, flat)
+        response = rows['response_time'].to_numpy(dtype='float64')[keep]
+        timed = ~np.isnan(response)
+        _scatter_add(self.response_sum, flat[timed], response[timed])
+        _scatter_add(self.response_count, flat[timed])
+        latency_shape = self.latency.shape
+        cells = ((bucket[keep][timed] % self.buckets) * latency_shape[1] + services[timed]) * latency_shape[2] \
+            + self.sketch.index(response[timed])
+        _scatter_add(self.latency, cells)
+        status = rows['status'].to_numpy(dtype='float64')[keep]
+        answered = ~np.isnan(status)
+        _scatter_add(self.answered, flat[answered])
+        _scatter_add(self.succeeded, flat[answered & (status < 400)])
+
+    # Queries, all O(buckets)
+    def _select(self, name, levels=None, services=None):
+        """Buffer restricted to the given levels and services, buckets oldest first"""
+        order = np.argsort(self.bucket_ids)
+        order = order[self.bucket_ids[order] >= 0]
+        values = getattr(self, name)[order]
+        if levels is not None:
+            values = values[:, np.isin(LEVELS, list(levels)), :]
+        if services is not None:
+            values = values[:, :, np.isin(self.services, list(services))]
+        return self.bucket_ids[order], values
+
+    def _timestamps(self, ids):
+        return pd.to_datetime(ids * self.bucket_ns)
+
+    def level_counts(self, levels=None, services=None):
+        """Non-empty (timestamp, level, count) rows, oldest bucket first"""
+        ids, counts = self._select('counts', levels, services)
+        names = [level for level in LEVELS if levels is None or level in levels]
+        per_level = counts.sum(axis=2)
+        bucket, level = np.nonzero(per_level)
+        return pd.DataFrame({
+            'timestamp': self._timestamps(ids[bucket]),
+            'level': pd.Categorical(np.asarray(names, dtype=object)[level], categories=names),
+            'count': per_level[bucket, level].astype(np.int64),
+        })
+
+    def service_response(self, levels=None, services=None):
+        """Mean response time per service over the window, for services that report one"""
+        _, sums = self._select('response_sum', levels, services)
+        _, counts = self._select('response_count', levels, services)
+        names = [name for name in self.services if services is None or name in services]
+        totals = counts.sum(axis=(0, 1))
+        means = pd.Series(sums.sum(axis=(0, 1)) / np.where(totals > 0, totals, 1), index=names)
+        return means[totals > 0]
+
+    def summary(self, levels=None, services=None):
+        """Lines, errors, mean response time and success rate over the window"""
+        def total(name, only_levels=None):
+            chosen = levels if only_levels is None else [lvl for lvl in only_levels if levels is None or lvl in levels]
+            return float(self._select(name, chosen, services)[1].sum())
+
+        timed = total('response_count')
+        answered = total('answered')
+        return {
+            'lines': int(total('counts')),
+            'errors': int(total('counts', ERROR_LEVELS)),
+            'avg_response': total('response_sum') / timed if timed else np.nan,
+            'success_rate': total('succeeded') / answered if answered else np.nan,
+        }
+
+    def _latency(self, services=None):
+        order = np.argsort(self.bucket_ids)
+        order = order[self.bucket_ids[order] >= 0]
+        values = self.latency[order]
+        if services is not None:
+            values = values[:, np.isin(self.services, list(services)), :]
+        return self.bucket_ids[order], values
+
+    def percentiles_by_bucket(self, services=None, quantiles=PERCENTILES):
+        """Response time percentiles per time bucket, for buckets with response times
+
+        The sketches carry no level, so only the service filter applies.
+        """
+        ids, latency = self._latency(services)
+        merged = latency.sum(axis=1, dtype=np.int64)
+        present = merged.sum(axis=1) > 0
+        values = sketch_quantiles(self.sketch, merged[present], quantiles)
+        frame = pd.DataFrame(values, columns=[f"p{round(q * 100)}" for q in quantiles])
+        frame.insert(0, 'timestamp', self._timestamps(ids[present]))
+        return frame
+
+    def percentiles_by_service(self, services=None, quantiles=PERCENTILES):
+        """Response time percentiles per service over the window"""
+        _, latency = self._latency(services)
+        names = [name for name in self.services if services is None or name in services]
+        merged = latency.sum(axis=0, dtype=np.int64)
+        present = merged.sum(axis=1) > 0
+        values = sketch_quantiles(self.sketch, merged[present], quantiles)
+        return pd.DataFrame(values, columns=[f"p{round(q * 100)}" for q in quantiles],
+                            index=pd.Index(np.asarray(names, dtype=object)[present], name='service'))
+
+    def merge(self, other):
+        """Add another aggregate's counts (e.g. from a worker) into this one
+
+        Both must use the same bucket width, window and sketch accuracy.
+        Buckets of other that are older than this window are dropped.
+        """
+        if (other.bucket_ns, other.buckets, other.sketch.bins) != (self.bucket_ns, self.buckets, self.sketch.bins):
+            raise ValueError("only aggregates with the same buckets and sketch accuracy can be merged")
+        self.total += other.total
+        self.late += other.late
+        if other.head is None:
+            return self
+        self._advance(other.head)
+        codes = np.array([self._service_slot(name) for name in other.services], dtype=np.int64)
+        self._grow()
+        for slot in np.flatnonzero(other.bucket_ids > self.head - self.buckets):
+            bucket = other.bucket_ids[slot]
+            target = bucket % self.buckets
+            for name in BUFFERS:
+                np.add.at(getattr(self, name)[target], (slice(None), codes), getattr(other, name)[slot])
+            np.add.at(self.latency[target], codes, other.latency[slot])
+        return self
+
+    @property
+    def window(self):
+        """(start, end) timestamps covered by the buffers, or None before any rows"""
+        if self.head is None:
+            return None
+        return self._timestamps(np.array([self.head - self.buckets + 1, self.head + 1]))
+
+    def __repr__(self):
+        return (f"LogAggregates({self.buckets} x {self.bucket_seconds}s buckets, "
+                f"{len(self.services)} services, {self.total:,} lines)")
@@ -0,0 +1,277 @@
+"""
+Query-result cache that invalidates itself when the tables it read change.
+
+Writers stamp every table they change in a small table_versions table of
+the same database (bump_table_version), inside the transaction that makes
+the change, so a new stamp becomes visible exactly when the new data does.
+SQLiteSink, the ETL loader, stamps its target table on every batch it
+commits.
+
+QueryCache keys a result on the normalized SQL text plus the current
+stamps of the tables it reads and the schema versions of their databases,
+so building or dropping an index makes cached results (and their plans)
+stale too. Which tables those are is reported by SQLite itself: an
+authorizer callback sees every column read while the statement is
+prepared, CTEs and views resolved, and the prepared program's OpenRead
+instructions name the tables (by root page) a statement scans without
+reading a column, as COUNT(*) does. After any stamped write
+the stamps no longer match, so the next lookup recomputes; nothing has to
+call the cache to invalidate it. Statements that write, and ones calling
+volatile functions such as random(), are not cached.
+"""
+
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from portfolio_engine.storage import estimate_nbytes
+
+VERSIONS_TABLE = 'table_versions'
+VOLATILE_FUNCTIONS = {'random', 'randomblob', 'changes', 'total_changes', 'last_insert_rowid'}
+WRITE_ACTIONS = {
+    sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE, sqlite3.SQLITE_CREATE_TABLE,
+    sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_ALTER_TABLE, sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_DROP_INDEX,
+    sqlite3.SQLITE_CREATE_VIEW, sqlite3.SQLITE_DROP_VIEW, sqlite3.SQLITE_PRAGMA, sqlite3.SQLITE_ATTACH,
+    sqlite3.SQLITE_DETACH,
+}
+# String literals and quoted identifiers are kept verbatim; comments go
+SQL_TOKEN_PATTERN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|(--[^\n]*|/\*.*?\*/)|(\s+)""", re.DOTALL)
+
+
+def normalize_sql(sql):
+    """SQL text with comments dropped, whitespace collapsed and keywords lower-cased"""
+    parts = []
+    position = 0
+    for match in SQL_TOKEN_PATTERN.finditer(sql):
+        if match.start() > position:
+            parts.append(sql[position:match.start()].lower())
+        literal = match.group(1)
+        if literal:
+            parts.append(literal)
+        elif parts and parts[-1] != ' ':
+            # Comments and runs of whitespace become one space
+            parts.append(' ')
+        position = match.end()
+    parts.append(sql[position:].lower())
+    return ''.join(parts).strip(' ;')
+
+
+# Version stamps
+def bump_table_version(conn, table, schema='main'):
+    """Stamp table as changed; call inside the transaction that changes it"""
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{schema}".{VERSIONS_TABLE} '
+                 f'(name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+    conn.execute(f'INSERT INTO "{schema}".{VERSIONS_TABLE} (name, version) VALUES (?, 1) '
+                 f'ON CONFLICT (name) DO UPDATE SET version = version + 1', (table,))
+
+
+def table_versions(conn, tables):
+    """Current stamp of each (schema, table), 0 for tables never stamped"""
+    versions = dict.fromkeys(tables, 0)
+    for schema in {schema for schema, _ in versions}:
+        names = [name for table_schema, name in versions if table_schema == schema]
+        placeholders = ', '.join('?' * len(names))
+        try:
+            rows = conn.execute(f'SELECT name, version FROM "{schema}".{VERSIONS_TABLE} '
+                                f'WHERE name IN ({placeholders})', names).fetchall()
+        except sqlite3.OperationalError:
+            # Nothing in this database was ever stamped
+            continue
+        for name, version in rows:
+            versions[(schema, name)] = version
+    return tuple(sorted(versions.items()))
+
+
+class TableTracker:
+    """SQLite authorizer callback recording the tables statements read and write
+
+    Install it with conn.set_authorizer(tracker) while statements are
+    prepared; reads and writes are (schema, table) sets of user tables,
+    and cacheable turns false on any write or volatile function.
+    """
+
+    def __init__(self):
+        self._reads = set()
+        self._writes = set()
+        self.cacheable = True
+
+    def __call__(self, action, arg1, arg2, schema, trigger):
+        if action == sqlite3.SQLITE_READ and schema:
+            self._reads.add((schema, arg1))
+        elif action in WRITE_ACTIONS:
+            self.cacheable = False
+            if action in (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE) and schema:
+                self._writes.add((schema, arg1))
+        elif action == sqlite3.SQLITE_FUNCTION and arg2 and arg2.lower() in VOLATILE_FUNCTIONS:
+            self.cacheable = False
+        return sqlite3.SQLITE_OK
+
+    @staticmethod
+    def _user_tables(tables):
+        return {(schema, name) for schema, name in tables
+                if not name.startswith('sqlite_') and name != VERSIONS_TABLE}
+
+    @property
+    def reads(self):
+        return self._user_tables(self._reads)
+
+    @property
+    def writes(self):
+        return self._user_tables(self._writes)
+
+
+def opened_tables(conn, programs):
+    """(schema, table) of every b-tree the EXPLAIN programs open for reading, or None if one is unknown
+
+    The authorizer reports no column reads for statements such as
+    SELECT COUNT(*) FROM t, but their programs still open t (or one of its
+    indexes, mapped to t here) by root page.
+    """
+    # EXPLAIN rows are (addr, opcode, p1, p2, p3, ...): p2 is the root page, p3 the database
+    opened = {(row[4], row[3]) for program in programs for row in program if row[1] in ('OpenRead', 'ReopenIdx')}
+    if not opened:
+        return set()
+    schemas = {seq: name for seq, name, _ in conn.execute('PRAGMA database_list')}
+    tables = set()
+    for database, root in opened:
+        schema = schemas.get(database)
+        if schema is None:
+            return None
+        if root == 1:
+            tables.add((schema, 'sqlite_master'))
+            continue
+        master = 'sqlite_temp_master' if schema == 'temp' else f'"{schema}".sqlite_master'
+        row = conn.execute(f'SELECT tbl_name FROM {master} WHERE rootpage = ?', (root,)).fetchone()
+        if row is None:
+            return None
+        tables.add((schema, row[0]))
+    return tables
+
+
+def statement_tables(conn, statements):
+    """Tables the statements read and write, as (schema, table) sets, and whether they can be cached
+
+    The statements are only prepared (under EXPLAIN), never run. A
+    statement that cannot be prepared yet, e.g. one reading a table an
+    earlier statement of the script creates, makes the script uncacheable,
+    and so does a program opening a b-tree that cannot be traced to a table.
+    """
+    tracker = TableTracker()
+    programs = []
+    conn.set_authorizer(tracker)
+    try:
+        for sql in statements:
+            try:
+                programs.append(conn.execute(f'EXPLAIN {sql}').fetchall())
+            except sqlite3.OperationalError:
+                tracker.cacheable = False
+                break
+    finally:
+        conn.set_authorizer(None)
+    if tracker.cacheable:
+        opened = opened_tables(conn, programs)
+        if opened is None:
+            tracker.cacheable = False
+        else:
+            tracker._reads |= opened
+    # 'now' makes date functions volatile too
+    if any("'now'" in sql.lower() for sql in statements):
+        tracker.cacheable = False
+    return tracker.reads, tracker.writes, tracker.cacheable
+
+
+def schema_versions(conn, schemas):
+    """Each schema's schema_version, which changes with every CREATE/DROP (indexes included)"""
+    return tuple(sorted((schema, conn.execute(f'PRAGMA "{schema}".schema_version').fetchone()[0])
+                        for schema in schemas))
+
+
+class QueryCache:
+    """Thread-safe LRU cache of query results, bounded by size in bytes
+
+    get_or_run() is the whole interface: it returns the cached result of a
+    script while the tables it reads carry the same stamps, and runs it
+    otherwise. hits, misses, invalidations (stale entries found and
+    dropped) and bypasses (uncacheable scripts) are counted.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_run(self, conn, statements, run, nbytes=estimate_nbytes):
+        """Result of run() for statements on conn, from the cache while still valid
+
+        Hold whatever lock guards conn while calling. nbytes sizes a result
+        for the byte budget. Returns (result, hit).
+        """
+        key = normalize_sql(';'.join(statements))
+        reads, _, cacheable = statement_tables(conn, statements)
+        if not cacheable:
+            with self._lock:
+                self.bypasses += 1
+            return run(), False
+        # A new or dropped index changes plans and timings, not data: the schema version covers it
+        versions = (table_versions(conn, reads), schema_versions(conn, {schema for schema, _ in reads}))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == versions:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return entry[1], True
+                self.invalidations += 1
+                self._discard(key)
+            self.misses += 1
+        result = run()
+        self._put(key, versions, result, nbytes(result))
+        return result, False
+
+    def _discard(self, key):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def _put(self, key, versions, result, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted
+                self.evictions += 1
+            self._entries[key] = (versions, result, size)
+            self.current_bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'bypasses': self.bypasses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,181 @@
+"""
+Materialized rollups of a fact table, maintained as batches are loaded.
+
+A monthly report that groups the whole sales table rescans it on every
+run. A Rollup keeps the groups instead, in a table of its own with one row
+per group key (month and/or dimensions):
+
+    month, region, rows, sales_amount, ..., customers
+
+SQLiteSink folds every batch it inserts into its rollups inside the same
+transaction, so the rollups always agree with the loaded data: additive
+measures are upserted as `value = value + batch value`, and a distinct
+count is kept exact by a members table of the (group, customer) pairs
+already counted, so only first sightings add to it. Loading a batch costs
+O(batch); reading a rollup costs O(groups), however large the fact table
+grows.
+
+A rollup added to a table that already holds data is backfilled once from
+that table with plain SQL.
+"""
+
+import sqlite3
+
+import pandas as pd
+
+from portfolio_engine.query_cache import bump_table_version
+
+ALL = 'all'
+MISSING = '(none)'
+
+
+class Rollup:
+    """Row count, sums and a distinct count of a fact table per group
+
+    month_column, if given, groups by calendar month of that date column
+    (as 'YYYY-MM-01' text); dimensions are further grouping columns, with
+    missing values grouped as '(none)'. With neither, the rollup is a
+    single row of totals. Rows without a valid month are left out.
+    """
+
+    def __init__(self, name, month_column=None, dimensions=(), sums=(), distinct=None):
+        self.name = name
+        self.month_column = month_column
+        self.dimensions = list(dimensions)
+        self.sums = list(sums)
+        self.distinct = distinct
+        self.members = f"{name}_members"
+
+    @property
+    def keys(self):
+        keys = (['month'] if self.month_column else []) + self.dimensions
+        # A rollup of totals still needs a key to upsert on
+        return keys or ['scope']
+
+    @property
+    def columns(self):
+        return self.keys + ['rows'] + self.sums + ([self.distinct] if self.distinct else [])
+
+    def _quoted(self, columns):
+        return ', '.join(f'"{column}"' for column in columns)
+
+    # Schema
+    def create(self, conn):
+        """Create the rollup tables if missing; returns whether they were created"""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (self.name,)).fetchone()
+        if exists:
+            return False
+        measures = ', '.join(['"rows" INTEGER NOT NULL DEFAULT 0']
+                             + [f'"{column}" REAL NOT NULL DEFAULT 0' for column in self.sums]
+                             + ([f'"{self.distinct}" INTEGER NOT NULL DEFAULT 0'] if self.distinct else []))
+        keys = self._quoted(self.keys)
+        key_columns = ', '.join(f'"{key}" TEXT NOT NULL' for key in self.keys)
+        conn.execute(f'CREATE TABLE "{self.name}" ({key_columns}, {measures}, PRIMARY KEY ({keys}))')
+        if self.distinct:
+            conn.execute(f'CREATE TABLE "{self.members}" ({keys}, "{self.distinct}", '
+                         f'PRIMARY KEY ({keys}, "{self.distinct}")) WITHOUT ROWID')
+        return True
+
+    def drop(self, conn):
+        conn.execute(f'DROP TABLE IF EXISTS "{self.name}"')
+        conn.execute(f'DROP TABLE IF EXISTS "{self.members}"')
+
+    def backfill(self, conn, source):
+        """Rebuild the rollup from everything already in source, in SQL"""
+        source_columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{source}")')}
+        if not source_columns:
+            return
+        conn.execute(f'DELETE FROM "{self.name}"')
+        if self.distinct:
+            conn.execute(f'DELETE FROM "{self.members}"')
+        keys = []
+        if self.month_column:
+            keys.append(f'''substr("{self.month_column}", 1, 7) || '-01\'''')
+        keys += [f'''COALESCE(CAST("{column}" AS TEXT), '{MISSING}')''' if column in source_columns
+                 else f"'{MISSING}'" for column in self.dimensions]
+        keys = keys or [f"'{ALL}'"]
+        where = f'WHERE "{self.month_column}" IS NOT NULL' if self.month_column else ''
+        sums = [f'COALESCE(SUM("{column}"), 0)' if column in source_columns else '0' for column in self.sums]
+        group_by = f'GROUP BY {", ".join(str(i + 1) for i in range(len(keys)))}'
+        conn.execute(f'INSERT INTO "{self.name}" ({self._quoted(self.keys + ["rows"] + self.sums)}) '
+                     f'SELECT {", ".join(keys + ["COUNT(*)"] + sums)} FROM "{source}" {where} {group_by}')
+        if self.distinct and self.distinct in source_columns:
+            conn.execute(f'INSERT INTO "{self.members}" SELECT DISTINCT {", ".join(keys)}, "{self.distinct}" '
+                         f'FROM "{source}" {where} {"AND" if where else "WHERE"} "{self.distinct}" IS NOT NULL')
+            matches = ' AND '.join(f'm."{key}" = r."{key}"' for key in self.keys)
+            conn.execute(f'UPDATE "{self.name}" AS r SET "{self.distinct}" = '
+                         f'(SELECT COUNT(*) FROM "{self.members}" AS m WHERE {matches})')
+        bump_table_version(conn, self.name)
+
+    # Maintenance
+    def group_keys(self, chunk):
+        """The batch's group key columns, None where a row has no valid month"""
+        keys = pd.DataFrame(index=chunk.index)
+        if self.month_column:
+            dates = pd.to_datetime(chunk[self.month_column], errors='coerce') \
+                if self.month_column in chunk.columns else pd.Series(pd.NaT, index=chunk.index)
+            keys['month'] = dates.dt.strftime('%Y-%m-01')
+        for column in self.dimensions:
+            keys[column] = chunk[column].astype(object).where(chunk[column].notna(), MISSING).astype(str) \
+                if column in chunk.columns else MISSING
+        if not len(keys.columns):
+            keys['scope'] = ALL
+        return keys
+
+    def apply(self, conn, chunk):
+        """Fold a batch that is being inserted into the rollup; call inside its transaction"""
+        keys = self.group_keys(chunk)
+        valid = keys.notna().all(axis=1)
+        if not valid.any():
+            return
+        keys = keys[valid]
+        batch = keys.copy()
+        for column in self.sums:
+            batch[column] = pd.to_numeric(chunk.loc[valid, column], errors='coerce') if column in chunk.columns else 0.0
+        groups = batch.groupby(self.keys, sort=False)
+        totals = groups.size().rename('rows').to_frame()
+        if self.sums:
+            totals = totals.join(groups[self.sums].sum(min_count=1).fillna(0.0))
+        totals = totals.reset_index()
+        updates = ', '.join(f'"{column}" = "{column}" + excluded."{column}"' for column in ['rows'] + self.sums)
+        conn.executemany(
+            f'INSERT INTO "{self.name}" ({self._quoted(list(totals.columns))}) '
+            f'VALUES ({", ".join("?" * len(totals.columns))}) '
+            f'ON CONFLICT ({self._quoted(self.keys)}) DO UPDATE SET {updates}',
+            list(totals.astype(object).itertuples(index=False, name=None)))
+        if self.distinct and self.distinct in chunk.columns:
+            self._apply_distinct(conn, keys, chunk.loc[valid, self.distinct])
+        bump_table_version(conn, self.name)
+
+    def _apply_distinct(self, conn, keys, values):
+        pairs = keys.assign(**{self.distinct: values.astype(object)})
+        pairs = pairs[pairs[self.distinct].notna()].drop_duplicates()
+        if not len(pairs):
+            return
+        # Count only pairs the members table has not seen, then remember them
+        conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS "{self.members}_batch" AS '
+                     f'SELECT * FROM "{self.members}" WHERE 0')
+        conn.execute(f'DELETE FROM temp."{self.members}_batch"')
+        conn.executemany(f'INSERT INTO temp."{self.members}_batch" VALUES ({", ".join("?" * len(pairs.columns))})',
+                         list(pairs.itertuples(index=False, name=None)))
+        keys = self._quoted(self.keys)
+        conn.execute(f'INSERT INTO "{self.name}" ({keys}, "{self.distinct}") '
+                     f'SELECT {keys}, COUNT(*) FROM temp."{self.members}_batch" AS b '
+                     f'WHERE NOT EXISTS (SELECT 1 FROM "{self.members}" AS m WHERE '
+                     + ' AND '.join(f'm."{column}" = b."{column}"' for column in self.keys + [self.distinct])
+                     + f') GROUP BY {keys} '
+                     f'ON CONFLICT ({keys}) DO UPDATE SET "{self.distinct}" = "{self.distinct}" + excluded."{self.distinct}"')
+        conn.execute(f'INSERT OR IGNORE INTO "{self.members}" SELECT * FROM temp."{self.members}_batch"')
+
+    # Reading
+    def read(self, conn, schema='main'):
+        """The whole rollup as a DataFrame, ordered by its keys; None if it does not exist yet"""
+        try:
+            return pd.read_sql_query(f'SELECT * FROM "{schema}"."{self.name}" ORDER BY {self._quoted(self.keys)}',
+                                     conn)
+        except (sqlite3.OperationalError, pd.errors.DatabaseError):
+            return None
+
+    def __repr__(self):
+        return f"Rollup({self.name!r}, keys={self.keys})"
@@ -0,0 +1,252 @@
+"""
+Full-text search over parsed log messages.
+
+MessageIndex is an inverted index in two levels. Log messages repeat a
+lot, so terms point at distinct messages, and each distinct message
+points at the rows that carry it:
+
+    term -> distinct message ids -> row ids
+
+Tokenizing only distinct messages keeps building cheap, and a query costs
+a dictionary lookup plus gathering the rows of the matching messages, not
+a scan of every message like str.contains.
+
+Queries are whitespace-separated clauses that must all match:
+
+    timeout           rows whose message contains the word
+    "connection failed"   the words next to each other, in that order
+    conn*             any word starting with conn
+
+Indexes are built batch by batch as logs are parsed (one per worker range,
+merged with a row offset) and saved as a .npz sidecar next to the spilled
+Arrow file of the parsed rows.
+"""
+
+import bisect
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+TOKEN_PATTERN = re.compile(r'\w+')
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+MESSAGE_COLUMNS = ('message', 'msg', 'path')
+# Above this many matching messages a mask over all rows beats gathering slices
+GATHER_LIMIT = 64
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def message_column(frame):
+    """Name of the column to index: the message, or the request path of access logs"""
+    return next((name for name in MESSAGE_COLUMNS if name in frame.columns), None)
+
+
+def _contains_sequence(tokens, sequence):
+    size = len(sequence)
+    return any(tokens[i:i + size] == sequence for i in range(len(tokens) - size + 1))
+
+
+def _pack(strings):
+    """Strings as one utf-8 byte array plus offsets, for np.savez without pickles"""
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack(blob, offsets):
+    data = blob.tobytes()
+    return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class MessageIndex:
+    """Inverted index from message tokens to row ids, built incrementally"""
+
+    def __init__(self):
+        self.messages = []
+        self._message_ids = {}
+        self.postings = {}
+        self._codes = []
+        self.rows = 0
+        self._terms = None
+        self._built = None
+
+    @classmethod
+    def from_messages(cls, messages):
+        index = cls()
+        index.add(messages)
+        return index
+
+    # Building
+    def add(self, messages):
+        """Append rows; messages is a Series, Categorical or list of strings (None allowed)"""
+        values = messages.astype(object) if isinstance(messages, pd.Series) else pd.Series(messages, dtype=object)
+        local_codes, uniques = pd.factorize(values)
+        mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+        mapping[-1] = -1
+        for local, message in enumerate(uniques):
+            mapping[local] = self._message_id(str(message))
+        self._codes.append(mapping[local_codes])
+        self.rows += len(local_codes)
+        self._built = None
+        return self
+
+    def _message_id(self, message):
+        message_id = self._message_ids.get(message)
+        if message_id is None:
+            message_id = self._message_ids[message] = len(self.messages)
+            self.messages.append(message)
+            for term in set(tokenize(message)):
+                self.postings.setdefault(term, []).append(message_id)
+        return message_id
+
+    def extend(self, other):
+        """Append another index's rows after this one's, e.g. the next worker range"""
+        mapping = np.array([self._message_id(message) for message in other.messages] + [-1], dtype=np.int32)
+        codes = other.codes()
+        self._codes.append(mapping[codes])
+        self.rows += len(codes)
+        self._built = None
+        return self
+
+    def codes(self):
+        """Message id of every row, -1 for rows without a message"""
+        if len(self._codes) != 1:
+            self._codes = [np.concatenate(self._codes) if self._codes else np.empty(0, dtype=np.int32)]
+        return self._codes[0]
+
+    def prepare(self):
+        """Build the sorted vocabulary and the message -> rows lists now rather than on the first query"""
+        self._vocabulary()
+        self._rows_by_message()
+        return self
+
+    def _vocabulary(self):
+        if self._terms is None or len(self._terms) != len(self.postings):
+            self._terms = sorted(self.postings)
+        return self._terms
+
+    def _rows_by_message(self):
+        """Row ids grouped by message (CSR order and offsets), rebuilt after additions"""
+        if self._built is None:
+            codes = self.codes()
+            order = np.argsort(codes, kind='stable')
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.messages))
+            offsets = np.zeros(len(self.messages) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            # Rows without a message sort first; skip them
+            self._built = (order[int((codes < 0).sum()):], offsets)
+        return self._built
+
+    # Queries
+    def term(self, term):
+        """Ids of the distinct messages containing term"""
+        return set(self.postings.get(term.lower(), ()))
+
+    def prefix(self, prefix):
+        vocabulary = self._vocabulary()
+        prefix = prefix.lower()
+        start = bisect.bisect_left(vocabulary, prefix)
+        matched = set()
+        for term in vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            matched.update(self.postings[term])
+        return matched
+
+    def phrase(self, words):
+        tokens = tokenize(words)
+        if not tokens:
+            return set()
+        candidates = set.intersection(*(self.term(token) for token in tokens))
+        return {message_id for message_id in candidates
+                if _contains_sequence(tokenize(self.messages[message_id]), tokens)}
+
+    def match_messages(self, query):
+        """Ids of the distinct messages matching every clause of query"""
+        matched = None
+        for quoted, word in QUERY_PATTERN.findall(query):
+            if quoted:
+                found = self.phrase(quoted)
+            else:
+                tokens = tokenize(word.rstrip('*'))
+                if not tokens:
+                    continue
+                if word.endswith('*') and len(tokens) == 1:
+                    found = self.prefix(tokens[0])
+                elif len(tokens) > 1:
+                    # e.g. api/orders: the words in order
+                    found = self.phrase(word)
+                else:
+                    found = self.term(tokens[0])
+            matched = found if matched is None else matched & found
+            if not matched:
+                return set()
+        return matched or set()
+
+    def rows_for(self, message_ids):
+        """Sorted row ids carrying any of the given messages"""
+        message_ids = np.fromiter(message_ids, dtype=np.int64)
+        if not len(message_ids):
+            return np.empty(0, dtype=np.int64)
+        if len(message_ids) > GATHER_LIMIT:
+            # One lookup per row; the extra last slot is for rows without a message
+            hit = np.zeros(len(self.messages) + 1, dtype=bool)
+            hit[message_ids] = True
+            return np.flatnonzero(hit[self.codes()])
+        order, offsets = self._rows_by_message()
+        return np.sort(np.concatenate([order[offsets[m]:offsets[m + 1]] for m in message_ids]))
+
+    def search(self, query):
+        """Sorted row ids matching query; see the module docstring for the syntax"""
+        return self.rows_for(self.match_messages(query))
+
+    # Persistence
+    def save(self, path):
+        """Write the index to path (.npz)"""
+        vocabulary = self._vocabulary()
+        posting_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum([len(self.postings[term]) for term in vocabulary], out=posting_offsets[1:])
+        posting_ids = np.fromiter((m for term in vocabulary for m in self.postings[term]), dtype=np.int32,
+                                  count=int(posting_offsets[-1]))
+        messages, message_offsets = _pack(self.messages)
+        terms, term_offsets = _pack(vocabulary)
+        path = Path(path)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, messages=messages, message_offsets=message_offsets, terms=terms,
+                     term_offsets=term_offsets, posting_offsets=posting_offsets, posting_ids=posting_ids,
+                     codes=self.codes())
+        tmp_path.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            index.messages = _unpack(data['messages'], data['message_offsets'])
+            index._message_ids = {message: i for i, message in enumerate(index.messages)}
+            vocabulary = _unpack(data['terms'], data['term_offsets'])
+            offsets, ids = data['posting_offsets'], data['posting_ids']
+            index.postings = {term: ids[start:end].tolist()
+                              for term, start, end in zip(vocabulary, offsets[:-1], offsets[1:])}
+            index._codes = [data['codes']]
+        index.rows = len(index._codes[0])
+        return index
+
+    def __len__(self):
+        return self.rows
+
+    def __repr__(self):
+        return (f"MessageIndex({self.rows:,} rows, {len(self.messages):,} distinct messages, "
+                f"{len(self.postings):,} terms)")
+
+
+def index_path(dataset_path):
+    """Where the index of a spilled dataset lives: next to its .arrow file"""
+    dataset_path = Path(dataset_path)
+    return dataset_path.with_name(dataset_path.stem + '.index.npz')
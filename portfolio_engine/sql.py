@@ -0,0 +1,552 @@
+"""
+Embedded SQL engine for the SQL optimization demo.
+
+The demo's example queries run for real against a SQLite database of
+generated `customers` and `orders` tables:
+
+    customers(customer_id, name, email, region, signup_date)
+    orders(order_id, customer_id, order_date, amount)
+
+Customers come with the mess the cleaning examples are about: missing
+names, invalid emails, untrimmed or oddly cased names and exact duplicate
+rows. Dates are ISO text, which SQLite compares and indexes in order.
+
+Databases are built once per size in chunks of INSERT_BATCH_ROWS rows,
+under a temporary name that is renamed into place when complete, and
+reused afterwards. SQLite lacks two PostgreSQL functions the examples use,
+so DATE_TRUNC and INITCAP are registered on every connection as
+deterministic functions; rowid plays the part of PostgreSQL's ctid.
+
+DemoDatabase.run() executes a script statement by statement and returns
+each statement's wall time, row count and EXPLAIN QUERY PLAN, and
+benchmark_indexes() times a script with and without candidate indexes
+across data scales (median and p95 latency, plan differences).
+
+On large tables the one-statement cleaning example holds the write lock
+for the whole table at once; clean_chunked() does the same work as
+set-based statements over rowid ranges, one short transaction per range.
+"""
+
+import difflib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from portfolio_engine.query_cache import QueryCache, TableTracker, bump_table_version
+from portfolio_engine.storage import estimate_nbytes
+
+DEFAULT_DB_DIR = Path(os.environ.get('SQL_DEMO_DIR', Path(tempfile.gettempdir()) / 'portfolio_sql'))
+INSERT_BATCH_ROWS = 50_000
+REGIONS = ('North', 'South', 'East', 'West')
+FIRST_NAMES = ('james', 'mary', 'john', 'patricia', 'robert', 'jennifer', 'michael', 'linda', 'david',
+               'elizabeth', 'william', 'barbara', 'richard', 'susan', 'joseph', 'jessica', 'thomas', 'sarah',
+               'wei', 'priya', 'ahmed', 'sofia', 'mateo', 'yuki', 'olga', 'kwame')
+LAST_NAMES = ('smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis', 'rodriguez',
+              'martinez', 'hernandez', 'lopez', 'wilson', 'anderson', 'taylor', 'moore', 'martin', 'lee',
+              'chen', 'patel', 'kim', 'nguyen', "o'brien", 'schmidt', 'rossi', 'silva')
+ORDER_DATES = pd.date_range('2023-01-01', '2024-12-31', freq='D').strftime('%Y-%m-%d').to_numpy(dtype=object)
+SIGNUP_DATES = pd.date_range('2020-01-01', '2024-12-31', freq='D').strftime('%Y-%m-%d').to_numpy(dtype=object)
+
+# Share of generated customer rows with each kind of problem
+DIRTY_RATES = {'duplicate': 0.01, 'null_name': 0.005, 'invalid_email': 0.003, 'messy_name': 0.05}
+
+SCHEMA = (
+    'CREATE TABLE customers (customer_id INTEGER, name TEXT, email TEXT, region TEXT, signup_date TEXT)',
+    'CREATE TABLE orders (order_id INTEGER PRIMARY KEY, customer_id INTEGER, order_date TEXT, amount REAL)',
+)
+
+# Indexes the optimization examples rely on; order_date carries amount so the
+# monthly report reads the index alone. See DemoDatabase.set_indexes
+INDEXES = {
+    'idx_orders_order_date': 'CREATE INDEX idx_orders_order_date ON orders (order_date, amount)',
+    'idx_orders_customer_id': 'CREATE INDEX idx_orders_customer_id ON orders (customer_id)',
+    'idx_customers_email_name': 'CREATE INDEX idx_customers_email_name ON customers (email, name)',
+}
+
+WORD_PATTERN = re.compile(r'[A-Za-z0-9]+')
+
+# The demo's examples, in PostgreSQL style; see connect() for the functions they need
+SQL_EXAMPLES = {
+    "Data Quality Check": """
+-- Comprehensive data quality assessment
+SELECT 
+    'customers' as table_name,
+    COUNT(*) as total_records,
+    SUM(CASE WHEN name IS NULL THEN 1 ELSE 0 END) as null_names,
+    SUM(CASE WHEN email NOT LIKE '%@%' THEN 1 ELSE 0 END) as invalid_emails,
+    COUNT(DISTINCT customer_id) as unique_customers
+FROM customers;
+""",
+    "Performance Optimization": """
+-- Optimized sales report with proper indexing
+WITH monthly_sales AS (
+    SELECT 
+        DATE_TRUNC('month', order_date) as month,
+        SUM(amount) as total_sales,
+        COUNT(*) as order_count
+    FROM orders 
+    WHERE order_date >= '2024-01-01'
+    GROUP BY DATE_TRUNC('month', order_date)
+)
+SELECT 
+    month,
+    total_sales,
+    order_count,
+    LAG(total_sales) OVER (ORDER BY month) as prev_month_sales
+FROM monthly_sales
+ORDER BY month;
+""",
+    "Data Cleaning": """
+-- Remove duplicates and standardize data
+DELETE FROM customers 
+WHERE rowid NOT IN (
+    SELECT MIN(rowid)
+    FROM customers 
+    GROUP BY email, name
+);
+
+UPDATE customers 
+SET name = INITCAP(TRIM(name)),
+    email = LOWER(TRIM(email))
+WHERE name != INITCAP(TRIM(name)) 
+   OR email != LOWER(TRIM(email));
+""",
+}
+
+# Orders per benchmark scale; each has a tenth as many customers
+BENCHMARK_SCALES = (10_000, 100_000, 1_000_000, 10_000_000)
+
+
+# PostgreSQL functions missing from SQLite
+def date_trunc(unit, value):
+    """DATE_TRUNC over ISO date text: 'year', 'month' or 'day'"""
+    if value is None:
+        return None
+    value = str(value)
+    unit = unit.lower()
+    if unit == 'year':
+        return value[:4] + '-01-01'
+    if unit == 'month':
+        return value[:7] + '-01'
+    if unit == 'day':
+        return value[:10]
+    raise ValueError(f"unsupported DATE_TRUNC unit {unit!r}")
+
+
+def initcap(value):
+    """First letter of every word upper case, the rest lower case"""
+    if value is None:
+        return None
+    return WORD_PATTERN.sub(lambda m: m.group().capitalize(), str(value))
+
+
+def connect(path, check_same_thread=True):
+    """Connection in autocommit mode with the demo's functions registered"""
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.create_function('DATE_TRUNC', 2, date_trunc, deterministic=True)
+    conn.create_function('INITCAP', 1, initcap, deterministic=True)
+    return conn
+
+
+# Generated data
+def iter_customers(rows, seed=0, chunk_rows=INSERT_BATCH_ROWS):
+    """Customer rows as lists of tuples, chunk by chunk, duplicates included in rows"""
+    rng = np.random.default_rng(seed)
+    next_id = 1
+    for offset in range(0, rows, chunk_rows):
+        size = min(chunk_rows, rows - offset)
+        duplicates = int(size * DIRTY_RATES['duplicate'])
+        unique = size - duplicates
+        ids = np.arange(next_id, next_id + unique)
+        next_id += unique
+        first = np.asarray(FIRST_NAMES, dtype=object)[rng.integers(len(FIRST_NAMES), size=unique)]
+        last = np.asarray(LAST_NAMES, dtype=object)[rng.integers(len(LAST_NAMES), size=unique)]
+        names = [f"{a} {b}".title() for a, b in zip(first, last)]
+        emails = [f"{a}.{b}{i}@example.com".replace("'", '') for a, b, i in zip(first, last, ids.tolist())]
+        for i in np.flatnonzero(rng.random(unique) < DIRTY_RATES['messy_name']):
+            names[i] = f"  {names[i].upper() if i % 2 else names[i].lower()} "
+        for i in np.flatnonzero(rng.random(unique) < DIRTY_RATES['invalid_email']):
+            emails[i] = emails[i].replace('@', ' at ')
+        for i in np.flatnonzero(rng.random(unique) < DIRTY_RATES['null_name']):
+            names[i] = None
+        regions = np.asarray(REGIONS, dtype=object)[rng.integers(len(REGIONS), size=unique)]
+        signups = SIGNUP_DATES[rng.integers(len(SIGNUP_DATES), size=unique)]
+        chunk = list(zip(ids.tolist(), names, emails, regions, signups))
+        # Exact copies of rows in the same chunk, as a double import would leave
+        chunk.extend(chunk[i] for i in rng.integers(unique, size=duplicates))
+        yield chunk
+
+
+def unique_customers(rows, chunk_rows=INSERT_BATCH_ROWS):
+    """Distinct customer ids among rows generated by iter_customers"""
+    sizes = [min(chunk_rows, rows - offset) for offset in range(0, rows, chunk_rows)]
+    return sum(size - int(size * DIRTY_RATES['duplicate']) for size in sizes)
+
+
+def iter_orders(rows, customers, seed=0, chunk_rows=INSERT_BATCH_ROWS):
+    """Order rows as lists of tuples, chunk by chunk, for customer ids 1..customers"""
+    rng = np.random.default_rng(seed + 1)
+    for offset in range(0, rows, chunk_rows):
+        size = min(chunk_rows, rows - offset)
+        ids = np.arange(offset + 1, offset + size + 1)
+        customer_ids = rng.integers(1, max(customers, 1) + 1, size=size)
+        dates = ORDER_DATES[rng.integers(len(ORDER_DATES), size=size)]
+        amounts = np.round(rng.lognormal(4.5, 0.8, size=size), 2)
+        yield list(zip(ids.tolist(), customer_ids.tolist(), dates, amounts.tolist()))
+
+
+def build_database(path, customers=5_000, orders=50_000, seed=0, progress=None):
+    """Write a database of generated customers and orders to path
+
+    progress, if given, is called with (rows written, rows in total). The
+    database appears at path only once it is complete.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    conn = connect(tmp_path)
+    try:
+        conn.execute('PRAGMA journal_mode=OFF')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        total = customers + orders
+        written = 0
+        tables = (('customers', iter_customers(customers, seed)),
+                  ('orders', iter_orders(orders, unique_customers(customers), seed)))
+        for table, chunks in tables:
+            for chunk in chunks:
+                placeholders = ', '.join('?' * len(chunk[0]))
+                conn.execute('BEGIN')
+                conn.executemany(f'INSERT INTO {table} VALUES ({placeholders})', chunk)
+                conn.execute('COMMIT')
+                written += len(chunk)
+                if progress is not None:
+                    progress(written, total)
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def database_path(customers, orders, seed=0, db_dir=None):
+    return Path(db_dir or DEFAULT_DB_DIR) / f"demo_c{customers}_o{orders}_s{seed}.db"
+
+
+# Running queries
+def split_statements(script):
+    """Complete SQL statements of a script, comments-only pieces dropped"""
+    statements, pending = [], ''
+    for piece in script.split(';'):
+        pending += piece + ';'
+        if sqlite3.complete_statement(pending):
+            if re.sub(r'--[^\n]*|/\*.*?\*/', '', pending, flags=re.DOTALL).strip(' \t\r\n;'):
+                statements.append(pending.strip())
+            pending = ''
+    if re.sub(r'--[^\n]*', '', pending).strip(' \t\r\n;'):
+        statements.append(pending.strip())
+    return statements
+
+
+def format_plan(rows):
+    """EXPLAIN QUERY PLAN rows as an indented tree"""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return '\n'.join(lines)
+
+
+class QueryResult:
+    """Outcome of a script: the last result set plus per-statement timings and plans"""
+
+    def __init__(self, frame, statements, committed):
+        self.frame = frame
+        self.statements = statements
+        self.committed = committed
+
+    @property
+    def seconds(self):
+        return sum(statement['seconds'] for statement in self.statements)
+
+    @property
+    def rows(self):
+        """Rows returned by the last statement that returned any"""
+        return len(self.frame) if self.frame is not None else 0
+
+    @property
+    def changes(self):
+        """Rows inserted, updated or deleted by the script"""
+        return sum(statement['changes'] for statement in self.statements)
+
+
+class DemoDatabase:
+    """A generated customers/orders database and a connection shared under a lock
+
+    attach maps schema names to other database files to attach, e.g. the
+    ETL warehouse, so examples can read them as schema.table. query()
+    answers repeated scripts from a QueryCache.
+    """
+
+    def __init__(self, customers=5_000, orders=50_000, seed=0, path=None, progress=None, attach=None,
+                 cache_bytes=64 * 1024 * 1024):
+        self.customers = customers
+        self.orders = orders
+        self.path = Path(path) if path is not None else database_path(customers, orders, seed)
+        if not self.path.exists():
+            build_database(self.path, customers, orders, seed, progress)
+        self.conn = connect(self.path, check_same_thread=False)
+        for schema, attached in (attach or {}).items():
+            Path(attached).parent.mkdir(parents=True, exist_ok=True)
+            self.conn.execute(f'ATTACH DATABASE ? AS "{schema}"', (str(attached),))
+        self.lock = threading.Lock()
+        self.cache = QueryCache(cache_bytes)
+
+    def table_counts(self):
+        with self.lock:
+            return {table: self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in ('customers', 'orders')}
+
+    def indexes(self):
+        """Names of the INDEXES currently built"""
+        with self.lock:
+            names = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        return [name for name in INDEXES if name in names]
+
+    def set_indexes(self, names=INDEXES):
+        """Build exactly the named INDEXES, dropping the others; returns the seconds it took"""
+        names = set(names)
+        start = time.perf_counter()
+        with self.lock:
+            present = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            for name, statement in INDEXES.items():
+                if name in names and name not in present:
+                    self.conn.execute(statement)
+                elif name not in names and name in present:
+                    self.conn.execute(f'DROP INDEX {name}')
+            # Fresh statistics so the planner knows what the indexes are worth
+            self.conn.execute('ANALYZE')
+        return time.perf_counter() - start
+
+    def run(self, script, commit=False, explain=True):
+        """Execute a script and return a QueryResult
+
+        The script runs in one transaction that is rolled back unless
+        commit is true, so cleaning examples can be run again and again.
+        Each statement's time covers executing it and fetching every row.
+        explain=False skips the query plans.
+        """
+        with self.lock:
+            return self._run(split_statements(script), commit, explain)
+
+    def query(self, script):
+        """run() a script unless the cache holds its result for the current tables; returns (QueryResult, hit)"""
+        statements = split_statements(script)
+        with self.lock:
+            return self.cache.get_or_run(self.conn, statements, lambda: self._run(statements),
+                                         nbytes=lambda result: estimate_nbytes(result.frame))
+
+    def _run(self, sql_statements, commit=False, explain=True):
+        statements = []
+        frame = None
+        # Tables written are recorded as each statement is prepared, so a
+        # statement may use a table an earlier one created
+        tracker = TableTracker()
+        self.conn.execute('BEGIN')
+        try:
+            if commit:
+                self.conn.set_authorizer(tracker)
+            for sql in sql_statements:
+                plan = format_plan(self.conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()) if explain else None
+                before = self.conn.total_changes
+                start = time.perf_counter()
+                cursor = self.conn.execute(sql)
+                rows = cursor.fetchall()
+                seconds = time.perf_counter() - start
+                if cursor.description is not None:
+                    frame = pd.DataFrame(rows, columns=[column[0] for column in cursor.description])
+                statements.append({'sql': sql, 'seconds': seconds, 'rows': len(rows),
+                                   'changes': self.conn.total_changes - before, 'plan': plan})
+            self.conn.set_authorizer(None)
+            # Committed writes invalidate cached results that read these tables
+            for schema, table in tracker.writes:
+                bump_table_version(self.conn, table, schema)
+        except BaseException:
+            self.conn.set_authorizer(None)
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT' if commit else 'ROLLBACK')
+        return QueryResult(frame, statements, commit)
+
+    def close(self):
+        self.conn.close()
+
+    def __repr__(self):
+        return f"DemoDatabase({self.path}, customers={self.customers:,}, orders={self.orders:,})"
+
+
+# Chunked cleaning
+CHUNKED_CLEANING = {
+    # A row is a duplicate if an earlier row has the same email and name,
+    # which keeps MIN(rowid) of every group like the one-statement version
+    'dedupe': """
+DELETE FROM "{table}"
+WHERE rowid IN (
+    SELECT dup.rowid
+    FROM "{table}" AS dup
+    JOIN "{table}" AS keep
+      ON keep.email IS dup.email AND keep.name IS dup.name AND keep.rowid < dup.rowid
+    WHERE dup.rowid >= :low AND dup.rowid < :high
+)""",
+    'standardize': """
+UPDATE "{table}"
+SET name = INITCAP(TRIM(name)),
+    email = LOWER(TRIM(email))
+WHERE rowid >= :low AND rowid < :high
+  AND (name != INITCAP(TRIM(name)) OR email != LOWER(TRIM(email)))""",
+}
+
+
+def clean_chunked(database, table='customers', chunk_rows=50_000, progress=None, pause_seconds=0.0):
+    """The Data Cleaning example, run over rowid ranges in short transactions
+
+    Each phase (dedupe, then standardize, as in the one-statement version)
+    walks the table chunk_rows rowids at a time, each chunk its own
+    transaction holding the database's lock only for that chunk, so other
+    queries and writers get in between chunks; pause_seconds widens the
+    gap. The dedupe join needs an index on (email, name) and builds one if
+    the table has none. progress, if given, is called after every chunk
+    with (phase, rows done, rows in total, rows changed so far).
+
+    Changes are committed. Returns rows deleted and updated, seconds, rows
+    per second and chunk count per phase.
+    """
+    with database.lock:
+        low, high = database.conn.execute(f'SELECT MIN(rowid), MAX(rowid) FROM "{table}"').fetchone()
+        start = time.perf_counter()
+        indexed = any(
+            [column[2] for column in database.conn.execute(f'PRAGMA index_info("{index[1]}")')][:2]
+            == ['email', 'name'] for index in database.conn.execute(f'PRAGMA index_list("{table}")'))
+        if not indexed:
+            database.conn.execute(f'CREATE INDEX "{table}_email_name" ON "{table}" (email, name)')
+        index_seconds = time.perf_counter() - start
+    stats = {'index_seconds': index_seconds}
+    if low is None:
+        return stats
+    total = high - low + 1
+    for phase in ('dedupe', 'standardize'):
+        sql = CHUNKED_CLEANING[phase].format(table=table)
+        changed = chunks = 0
+        start = time.perf_counter()
+        for chunk_low in range(low, high + 1, chunk_rows):
+            with database.lock:
+                database.conn.execute('BEGIN IMMEDIATE')
+                try:
+                    changed += database.conn.execute(sql, {'low': chunk_low, 'high': chunk_low + chunk_rows}).rowcount
+                    bump_table_version(database.conn, table)
+                except BaseException:
+                    database.conn.execute('ROLLBACK')
+                    raise
+                database.conn.execute('COMMIT')
+            chunks += 1
+            if progress is not None:
+                progress(phase, min(chunk_low + chunk_rows - low, total), total, changed)
+            if pause_seconds:
+                time.sleep(pause_seconds)
+        seconds = time.perf_counter() - start
+        stats[phase] = {'changed': changed, 'seconds': seconds, 'chunks': chunks,
+                        'rows_per_second': total / seconds if seconds else 0.0}
+    return stats
+
+
+def copy_table(database, source, target):
+    """Replace target with a plain copy of source, rowids in the same order"""
+    with database.lock:
+        database.conn.execute('BEGIN')
+        database.conn.execute(f'DROP TABLE IF EXISTS "{target}"')
+        database.conn.execute(f'CREATE TABLE "{target}" AS SELECT * FROM "{source}" ORDER BY rowid')
+        bump_table_version(database.conn, target)
+        database.conn.execute('COMMIT')
+
+
+# Index benchmarks
+def plan_text(result):
+    """Query plans of every statement of a QueryResult, one block per statement"""
+    return '\n\n'.join(statement['plan'] for statement in result.statements)
+
+
+def plan_diff(before, after):
+    """Unified diff between two plan_text()s, empty when the plans are the same"""
+    return '\n'.join(difflib.unified_diff(before.splitlines(), after.splitlines(), 'without indexes',
+                                           'with indexes', lineterm=''))
+
+
+def time_script(database, script, repeat=20, budget_seconds=10.0):
+    """Wall times of repeated runs after one warm-up run
+
+    Stops after repeat runs, or once budget_seconds have gone by and at
+    least three runs are in, so the largest scales stay bearable.
+    """
+    warmup = database.run(script)
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat and (len(timings) < 3 or time.perf_counter() - started < budget_seconds):
+        timings.append(database.run(script, explain=False).seconds)
+    return warmup, np.array(timings)
+
+
+def benchmark_indexes(script, scales=BENCHMARK_SCALES, indexes=None, repeat=20, budget_seconds=10.0,
+                      seed=0, open_database=None, progress=None):
+    """Latency of script with and without candidate indexes at each scale
+
+    scales are order counts, with a tenth as many customers; indexes are
+    names from INDEXES (all of them by default). open_database(customers,
+    orders) supplies the databases, e.g. a cached one; by default each is
+    opened here and closed afterwards. progress, if given, is called with
+    a description of each step.
+
+    Returns one row per scale and index setting with the median and p95
+    latency in ms, the runs behind them, the time to build the indexes,
+    the speedup over no indexes and the query plans.
+    """
+    indexes = list(INDEXES) if indexes is None else list(indexes)
+    records = []
+    for orders in scales:
+        customers = max(orders // 10, 1)
+        if progress is not None:
+            progress(f"{orders:,} orders: opening the database")
+        database = open_database(customers, orders) if open_database else DemoDatabase(customers, orders, seed)
+        try:
+            for label, names in (('without', ()), ('with', indexes)):
+                if progress is not None:
+                    progress(f"{orders:,} orders: timing {label} indexes")
+                build_seconds = database.set_indexes(names)
+                warmup, timings = time_script(database, script, repeat, budget_seconds)
+                records.append({
+                    'orders': orders,
+                    'customers': customers,
+                    'indexes': label,
+                    'median_ms': float(np.median(timings) * 1000),
+                    'p95_ms': float(np.percentile(timings, 95) * 1000),
+                    'runs': len(timings),
+                    'index_seconds': build_seconds if names else 0.0,
+                    'plan': plan_text(warmup),
+                })
+        finally:
+            if open_database is None:
+                database.close()
+    frame = pd.DataFrame(records)
+    if len(frame):
+        baseline = frame[frame['indexes'] == 'without'].set_index('orders')['median_ms']
+        frame['speedup'] = frame['orders'].map(baseline) / frame['median_ms']
+    return frame
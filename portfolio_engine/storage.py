@@ -0,0 +1,372 @@
+"""
+Storage for parsed uploads.
+
+Parsing a large CSV is by far the most expensive thing the demo pages do,
+and Streamlit re-executes the whole script on every widget interaction.
+Parsed results are therefore cached by the content hash of the upload, in
+a process-wide LRU bounded by a byte budget, so reruns and other sessions
+that upload the same file reuse the parsed result.
+
+The helpers at the end put the two together for the Streamlit apps: an
+upload is parsed once per server process (and spilled, so other processes
+load it from the map instead of parsing it again).
+
+Datasets can also be spilled to a local directory of Arrow IPC files and
+reloaded through a memory map. Session state then only holds a small
+DatasetHandle, and every session (and every server process) reading the
+same dataset shares the same page-cache pages instead of a private copy.
+"""
+
+import contextlib
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+from portfolio_engine.ingest import optimize_dtypes
+
+HASH_BLOCK_BYTES = 1024 * 1024
+UPLOAD_CACHE_MB = int(os.environ.get('UPLOAD_CACHE_MB', 512))
+DATASET_CACHE_MB = int(os.environ.get('DATASET_CACHE_MB', 2048))
+
+
+def content_hash(data):
+    """Return a hex digest of bytes, a buffer, or a file object's contents"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest.update(data)
+        return digest.hexdigest()
+
+    data.seek(0)
+    for block in iter(lambda: data.read(HASH_BLOCK_BYTES), b''):
+        digest.update(block)
+    data.seek(0)
+    return digest.hexdigest()
+
+
+def estimate_nbytes(value):
+    """Best-effort in-memory size of a cached value"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class ParsedUploadCache:
+    """Thread-safe LRU cache of parsed uploads bounded by total size in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return a cached value and mark it most recently used"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes=None):
+        """Cache a value, evicting least recently used entries to stay in budget
+
+        Values larger than the whole budget are not cached. Returns whether
+        the value was stored.
+        """
+        nbytes = estimate_nbytes(value) if nbytes is None else nbytes
+        if nbytes > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            while self._entries and self.current_bytes + nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+        return True
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader() once on a miss
+
+        Concurrent sessions asking for the same key wait for a single load
+        instead of parsing the same upload in parallel.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+            try:
+                value = loader()
+                self.put(key, value)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    def discard(self, key):
+        """Drop a single entry if present"""
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# Columnar spill
+DEFAULT_SPILL_DIR = Path(os.environ.get('DATASET_CACHE_DIR', Path(tempfile.gettempdir()) / 'portfolio_datasets'))
+
+# Tables stay shared only while something references them, so the spill
+# directory's budget still applies to datasets that were read once
+_mapped_tables = weakref.WeakValueDictionary()
+_mapped_lock = threading.Lock()
+
+
+def frame_digest(df):
+    """Content hash of a DataFrame's values, index, column names and dtypes"""
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    layout = repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode()
+    return content_hash(row_hashes.tobytes() + layout)
+
+
+def dataset_path(key, cache_dir=None):
+    return Path(cache_dir or DEFAULT_SPILL_DIR) / f"{key}.arrow"
+
+
+class DatasetHandle:
+    """Small, picklable reference to a dataset in the columnar spill directory
+
+    When pyarrow is unavailable, or a frame cannot be represented in Arrow,
+    the handle falls back to holding the DataFrame itself so callers never
+    have to care which one they got.
+    """
+
+    def __init__(self, key, path=None, frame=None):
+        self.key = key
+        self.path = Path(path) if path is not None else None
+        self._frame = frame
+
+    @property
+    def is_spilled(self):
+        return self._frame is None
+
+    def table(self):
+        """Memory-mapped Arrow table, shared within the process while anyone holds it"""
+        import pyarrow as pa
+
+        if not self.is_spilled:
+            return pa.Table.from_pandas(self._frame)
+        with _mapped_lock:
+            table = _mapped_tables.get(self.path)
+            if table is None:
+                source = pa.memory_map(str(self.path), 'r')
+                table = pa.ipc.open_file(source).read_all()
+                _mapped_tables[self.path] = table
+        return table
+
+    def to_pandas(self):
+        """Materialize as a DataFrame; numeric columns stay backed by the map"""
+        if not self.is_spilled:
+            return self._frame
+        table = self.table()
+        # Touch the file so prune_spill_dir treats it as recently used
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(self.path)
+        return table.to_pandas(split_blocks=True)
+
+    def __repr__(self):
+        where = self.path if self.is_spilled else 'memory'
+        return f"DatasetHandle({self.key!r}, {where})"
+
+
+def open_dataset(key, cache_dir=None):
+    """Handle to an already spilled dataset, or None if it is not on disk"""
+    path = dataset_path(key, cache_dir)
+    if not path.exists():
+        return None
+    return DatasetHandle(key, path=path)
+
+
+def spill_dataframe(df, key=None, cache_dir=None):
+    """Write a DataFrame to the columnar spill directory and return its handle
+
+    Spills are content addressed, so spilling the same data twice (from two
+    sessions, say) reuses the existing file.
+    """
+    key = key or frame_digest(df)
+    path = dataset_path(key, cache_dir)
+    if path.exists():
+        return DatasetHandle(key, path=path)
+
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df)
+    except (ImportError, TypeError, ValueError):
+        # pyarrow missing or a mixed-type object column Arrow can't encode
+        return DatasetHandle(key, frame=df)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write under a unique name then rename, so readers never see a partial file
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with pa.OSFile(str(tmp_path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return DatasetHandle(key, path=path)
+
+
+def prune_spill_dir(max_bytes, cache_dir=None):
+    """Delete least recently used spill files until the directory fits max_bytes"""
+    spill_dir = Path(cache_dir or DEFAULT_SPILL_DIR)
+    if not spill_dir.exists():
+        return 0
+    files = sorted(spill_dir.glob('*.arrow'), key=lambda f: f.stat().st_mtime)
+    # Sidecars such as {key}.index.npz go with their dataset
+    sidecars = {f: [s for s in spill_dir.glob(f"{f.stem}.*") if s != f and s.suffix != '.tmp']
+                for f in files}
+    total = sum(p.stat().st_size for f in files for p in [f, *sidecars[f]])
+    removed = 0
+    for f in files:
+        if total <= max_bytes:
+            break
+        with _mapped_lock:
+            # Tables still referenced in this process are in use
+            if f in _mapped_tables:
+                continue
+        try:
+            for p in [f, *sidecars[f]]:
+                size = p.stat().st_size
+                p.unlink()
+                total -= size
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Still mapped elsewhere on a platform that refuses to delete it (Windows)
+            continue
+        removed += 1
+    return removed
+
+
+# Shared upload parsing for the apps
+_upload_cache = None
+_upload_cache_lock = threading.Lock()
+
+
+def upload_cache():
+    """Parsed-upload cache shared by every session of this server process"""
+    global _upload_cache
+    with _upload_cache_lock:
+        if _upload_cache is None:
+            _upload_cache = ParsedUploadCache(max_bytes=UPLOAD_CACHE_MB * 1024 * 1024)
+        return _upload_cache
+
+
+def upload_digest(uploaded_file, digests=None):
+    """Content hash of an upload, computed once per uploaded file
+
+    digests, e.g. a dict in the session state, remembers the hash by the
+    upload's file_id so reruns do not hash the same bytes again.
+    """
+    file_id = getattr(uploaded_file, 'file_id', None)
+    if digests is None or file_id is None:
+        return content_hash(uploaded_file.getbuffer())
+    if file_id not in digests:
+        digests[file_id] = content_hash(uploaded_file.getbuffer())
+    return digests[file_id]
+
+
+def spill_dataset(df, key=None):
+    """Spill a dataset to the shared columnar cache, keeping the directory within DATASET_CACHE_MB"""
+    handle = spill_dataframe(df, key=key)
+    prune_spill_dir(DATASET_CACHE_MB * 1024 * 1024)
+    return handle
+
+
+def _private_copy(df):
+    """A copy of a shared frame that the caller is free to modify
+
+    With copy-on-write (always on from pandas 3) a shallow copy already
+    behaves as a separate frame; older pandas needs a deep one.
+    """
+    copy_on_write = int(pd.__version__.split('.')[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+    return df.copy(deep=not copy_on_write)
+
+
+def read_upload_cached(uploaded_file, digests=None):
+    """Parse an uploaded CSV once and share the DataFrame across reruns and sessions
+
+    Returns a copy of the shared frame, so changes to it stay private.
+    """
+    digest = upload_digest(uploaded_file, digests)
+
+    def load():
+        # Evicted or parsed by another server process: reload from the spill
+        handle = open_dataset(digest)
+        if handle is None:
+            uploaded_file.seek(0)
+            df, _ = optimize_dtypes(pd.read_csv(uploaded_file))
+            handle = spill_dataset(df, key=digest)
+        return handle.to_pandas()
+
+    return _private_copy(upload_cache().get_or_load((digest, 'frame'), load))
+
+
+def profile_upload_cached(uploaded_file, load, digests=None):
+    """An upload's profile, from load(uploaded_file) the first time; returns (profile, cached)
+
+    The profile is shared by every session that uploads the same file, so
+    it is for reading only: never update() it.
+    """
+    cache = upload_cache()
+    key = (upload_digest(uploaded_file, digests), 'profile')
+    profile = cache.get(key)
+    if profile is not None:
+        return profile, True
+    profile = load(uploaded_file)
+    cache.put(key, profile)
+    return profile, False
@@ -0,0 +1,259 @@
+"""
+Online log template mining, after Drain (He et al., ICWS 2017).
+
+Most log lines are a fixed message with a few variable fields, e.g.
+
+    Connection to db-3 failed after 3 retries
+    Connection to db-7 failed after 12 retries
+
+TemplateMiner groups lines like these into one template,
+
+    Connection to <*> failed after <*> retries
+
+as they stream in, in a single pass. Obvious variables (numbers, IPs,
+hex ids, UUIDs) are masked first. A line then walks a fixed-depth tree
+keyed on its token count and its first few tokens to a short list of
+candidate templates, joins the most similar one (turning the differing
+tokens into <*>) or starts a new template.
+
+Lines are handled in batches: each distinct message in a batch is matched
+once and remembered, so repeated messages cost a dictionary lookup and the
+tree walk is only paid for messages never seen before. Per-template counts
+are kept in time-bucket ring buffers like LogAggregates, and templates
+first seen after the warm-up are flagged as anomalies.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from portfolio_engine.search import message_column
+
+WILDCARD = '<*>'
+MASK_PATTERN = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'  # UUID
+    r'|\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'                          # IPv4[:port]
+    r'|\b0x[0-9a-f]+\b'                                                # hex
+    r'|(?<![a-z_])[-+]?\d+(?:[.,:]\d+)*(?:ms|s|kb|mb|gb|%)?(?![a-z_])',  # numbers, durations, sizes
+    re.IGNORECASE,
+)
+
+
+def mask(message):
+    """Message with its obvious variables replaced by the wildcard"""
+    return MASK_PATTERN.sub(WILDCARD, message)
+
+
+class LogTemplate:
+    """One cluster of log lines"""
+
+    def __init__(self, template_id, tokens, first_seen, anomaly):
+        self.id = template_id
+        self.tokens = tokens
+        self.count = 0
+        self.first_seen = first_seen
+        self.anomaly = anomaly
+
+    @property
+    def text(self):
+        return ' '.join(self.tokens)
+
+    def similarity(self, tokens):
+        """Share of positions where the template has the same token, and its wildcard count"""
+        same = wildcards = 0
+        for mine, theirs in zip(self.tokens, tokens):
+            if mine == WILDCARD:
+                wildcards += 1
+            elif mine == theirs:
+                same += 1
+        return same / len(tokens), wildcards
+
+    def absorb(self, tokens):
+        """Generalize the template to cover tokens"""
+        self.tokens = [mine if mine == theirs else WILDCARD for mine, theirs in zip(self.tokens, tokens)]
+
+    def __repr__(self):
+        return f"LogTemplate({self.id}, {self.text!r}, count={self.count})"
+
+
+class TemplateMiner:
+    """Drain-style online clustering of log messages into templates
+
+    depth is the tree depth as in the paper (root and leaves included), so
+    the first depth - 2 tokens route a line; similarity is the share of matching
+    tokens needed to join a template; a node with max_children children
+    sends further new tokens to a shared wildcard child. Lines seen before
+    the first warmup lines set the baseline and are never flagged.
+    Counts over time use bucket_seconds wide buckets, the latest buckets of
+    them kept. At most cache_size distinct messages are remembered.
+    """
+
+    def __init__(self, depth=4, similarity=0.5, max_children=100, warmup=1000,
+                 bucket_seconds=60, buckets=180, cache_size=100_000):
+        self.depth = depth
+        self.similarity = similarity
+        self.max_children = max_children
+        self.warmup = warmup
+        self.bucket_ns = int(bucket_seconds * 1e9)
+        self.buckets = buckets
+        self.cache_size = cache_size
+        self.templates = []
+        self.lines = 0
+        self._tree = {}
+        self._known = {}
+        self.bucket_ids = np.full(buckets, -1, dtype=np.int64)
+        self.head = None
+        self.counts = np.zeros((buckets, 0), dtype=np.int64)
+
+    # Matching
+    def _leaf(self, tokens):
+        """Candidate list for tokens, created on the way down if missing"""
+        node = self._tree.setdefault(len(tokens), {})
+        for token in tokens[:self.depth - 2]:
+            if WILDCARD in token:
+                token = WILDCARD
+            if token not in node and len(node) >= self.max_children:
+                token = WILDCARD
+            node = node.setdefault(token, {})
+        return node.setdefault(None, [])
+
+    def match(self, message, timestamp=None, line=None):
+        """Template of one message, creating or generalizing one as needed
+
+        line is the message's position in the stream, for the warm-up;
+        by default the number of lines added so far.
+        """
+        tokens = mask(message).split()
+        leaf = self._leaf(tokens)
+        best, best_score = None, None
+        for template in leaf:
+            score = template.similarity(tokens) if tokens else (1.0, 0)
+            if best_score is None or score > best_score:
+                best, best_score = template, score
+        if best is not None and best_score[0] >= self.similarity:
+            best.absorb(tokens)
+            return best
+        line = self.lines if line is None else line
+        template = LogTemplate(len(self.templates), tokens, timestamp, line >= self.warmup)
+        self.templates.append(template)
+        leaf.append(template)
+        return template
+
+    def _template_id(self, message, timestamp, line):
+        template_id = self._known.get(message)
+        if template_id is None:
+            template_id = self.match(message, timestamp, line).id
+            if len(self._known) >= self.cache_size:
+                self._known.clear()
+            self._known[message] = template_id
+        return template_id
+
+    # Updates
+    def _advance(self, newest):
+        """Move the head to bucket newest, recycling the slots that fall out of the window"""
+        if self.head is not None and newest <= self.head:
+            return
+        first = newest - self.buckets + 1 if self.head is None else max(self.head + 1, newest - self.buckets + 1)
+        ids = np.arange(first, newest + 1)
+        slots = ids % self.buckets
+        self.bucket_ids[slots] = ids
+        self.counts[slots] = 0
+        self.head = newest
+
+    def add(self, messages, timestamps=None):
+        """Fold a batch of messages (and their timestamps) in; returns each row's template id
+
+        Rows without a message get -1.
+        """
+        values = messages.astype(object) if isinstance(messages, pd.Series) else pd.Series(messages, dtype=object)
+        codes, uniques = pd.factorize(values)
+        if not len(codes):
+            return np.empty(0, dtype=np.int32)
+        if timestamps is None:
+            stamps = np.full(len(codes), pd.Timestamp.now().value, dtype=np.int64).astype('datetime64[ns]')
+        else:
+            stamps = pd.Series(timestamps).to_numpy(dtype='datetime64[ns]')
+        # Each distinct message's first row, for first_seen and the warm-up
+        first_rows = np.full(len(uniques), len(codes), dtype=np.int64)
+        np.minimum.at(first_rows, codes[codes >= 0], np.flatnonzero(codes >= 0))
+        mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+        mapping[-1] = -1
+        for local, message in enumerate(uniques):
+            stamp = stamps[first_rows[local]]
+            mapping[local] = self._template_id(str(message), None if np.isnat(stamp) else pd.Timestamp(stamp),
+                                               self.lines + int(first_rows[local]))
+        template_ids = mapping[codes]
+        self.lines += len(codes)
+        self._count(template_ids, stamps)
+        return template_ids
+
+    def _count(self, template_ids, stamps):
+        grow = len(self.templates) - self.counts.shape[1]
+        if grow > 0:
+            self.counts = np.pad(self.counts, ((0, 0), (0, grow)))
+        totals = np.bincount(template_ids[template_ids >= 0], minlength=len(self.templates))
+        for template_id in np.flatnonzero(totals):
+            self.templates[template_id].count += int(totals[template_id])
+        valid = ~np.isnat(stamps)
+        bucket = stamps.astype(np.int64) // self.bucket_ns
+        if valid.any():
+            self._advance(int(bucket[valid].max()))
+        elif self.head is None:
+            self._advance(pd.Timestamp.now().value // self.bucket_ns)
+        # Lines without a timestamp count towards the latest bucket
+        bucket = np.where(valid, bucket, self.head)
+        keep = (bucket > self.head - self.buckets) & (template_ids >= 0)
+        cells = (bucket[keep] % self.buckets) * self.counts.shape[1] + template_ids[keep]
+        # Only the cells this batch touches; a full-size bincount would allocate every bucket
+        touched, hits = np.unique(cells, return_counts=True)
+        self.counts.reshape(-1)[touched] += hits
+
+    def add_frame(self, frame):
+        """Mine a parsed log frame's message column (request path for access logs)"""
+        column = message_column(frame)
+        if column is None:
+            return np.full(len(frame), -1, dtype=np.int32)
+        timestamps = frame['timestamp'] if 'timestamp' in frame.columns else None
+        return self.add(frame[column], timestamps)
+
+    # Queries
+    def summary(self):
+        """One row per template, most frequent first"""
+        order = np.argsort(self.bucket_ids)
+        recent = self.counts[order[self.bucket_ids[order] >= 0]].sum(axis=0)
+        frame = pd.DataFrame({
+            'template': [template.text for template in self.templates],
+            'count': np.array([template.count for template in self.templates], dtype=np.int64),
+            'in_window': recent.astype(np.int64),
+            'first_seen': pd.to_datetime([template.first_seen for template in self.templates]),
+            'anomaly': np.array([template.anomaly for template in self.templates], dtype=bool),
+        }, index=pd.RangeIndex(len(self.templates), name='id'))
+        return frame.sort_values('count', ascending=False, kind='stable')
+
+    def counts_over_time(self, templates=None):
+        """Non-empty (timestamp, template id, count) rows, oldest bucket first"""
+        order = np.argsort(self.bucket_ids)
+        order = order[self.bucket_ids[order] >= 0]
+        counts = self.counts[order]
+        ids = np.arange(counts.shape[1])
+        if templates is not None:
+            ids = ids[np.isin(ids, list(templates))]
+            counts = counts[:, ids]
+        bucket, column = np.nonzero(counts)
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(self.bucket_ids[order][bucket] * self.bucket_ns),
+            'template': ids[column],
+            'count': counts[bucket, column],
+        })
+
+    def anomalies(self):
+        """Templates first seen after the warm-up, newest first"""
+        frame = self.summary()
+        return frame[frame['anomaly']].sort_values('first_seen', ascending=False)
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __repr__(self):
+        return f"TemplateMiner({len(self.templates):,} templates from {self.lines:,} lines)"
@@ -0,0 +1,453 @@
+"""
+In-memory time-series store for host metrics.
+
+A series is one metric of one host, e.g. ('web-07', 'cpu_usage'). Every
+point written goes two ways:
+
+- raw: appended to its series' open block; full blocks are sealed into
+  compact columnar blocks (millisecond offsets from the block start and
+  float32 values, 8 bytes a point), and blocks older than raw_seconds are
+  dropped.
+- rollups: folded into 1m, 5m and 1h tiers of count/sum/min/max. A tier
+  is a ring of time buckets by series, like LogAggregates, so it holds a
+  fixed window (a day of minutes, two weeks of 5 minutes, 90 days of
+  hours) in fixed memory. A batch is sorted by series and time once, and
+  each tier then takes one reduced update per (series, bucket).
+
+Queries never touch raw points: a range is answered from the finest tier
+that still covers it in at most max_points buckets, so a chart over two
+weeks of 50 hosts reads a few thousand cells per host whatever the write
+rate was.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+BLOCK_POINTS = 1024
+# (bucket seconds, buckets kept)
+DEFAULT_TIERS = ((60, 1440), (300, 14 * 288), (3600, 90 * 24))
+AGGREGATES = ('mean', 'min', 'max', 'count')
+
+
+class Block:
+    """Sealed raw points of one series: start time and columnar offsets/values"""
+
+    __slots__ = ('start', 'end', 'offsets', 'values')
+
+    def __init__(self, stamps, values):
+        self.start = int(stamps.min())
+        self.end = int(stamps.max())
+        offsets = (stamps - self.start) // 1_000_000
+        # Millisecond offsets fit 32 bits for blocks spanning less than 24 days
+        self.offsets = offsets.astype(np.int32 if offsets.max() < 2 ** 31 else np.int64)
+        self.values = values.astype(np.float32)
+
+    @property
+    def stamps(self):
+        return self.start + self.offsets.astype(np.int64) * 1_000_000
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.values.nbytes
+
+
+class RawBlocks:
+    """Raw points of every series: sealed blocks per series plus one open block each
+
+    The open blocks share one (series, block_points) array, so the points
+    of a batch that fit their series' block land in one scatter; only
+    series whose block fills up are handled one by one.
+    """
+
+    def __init__(self, block_points=BLOCK_POINTS):
+        self.block_points = block_points
+        self.sealed = []
+        self.stamps = np.empty((0, block_points), dtype=np.int64)
+        self.values = np.empty((0, block_points), dtype=np.float32)
+        self.size = np.zeros(0, dtype=np.int64)
+
+    def grow(self, width):
+        """Make room for series ids below width"""
+        grow = width - len(self.size)
+        if grow <= 0:
+            return
+        self.stamps = np.vstack([self.stamps, np.empty((grow, self.block_points), dtype=np.int64)])
+        self.values = np.vstack([self.values, np.empty((grow, self.block_points), dtype=np.float32)])
+        self.size = np.pad(self.size, (0, grow))
+        self.sealed.extend([] for _ in range(grow))
+
+    def _seal(self, series_id):
+        self.sealed[series_id].append(Block(self.stamps[series_id], self.values[series_id]))
+        self.size[series_id] = 0
+
+    def append(self, series, stamps, values):
+        """Add points sorted by series, then time; returns whether any block was sealed"""
+        ids, first, counts = np.unique(series, return_index=True, return_counts=True)
+        before = self.size[ids]
+        position = self.size[series] + np.arange(len(series)) - np.repeat(first, counts)
+        fits = position < self.block_points
+        self.stamps[series[fits], position[fits]] = stamps[fits]
+        self.values[series[fits], position[fits]] = values[fits]
+        self.size[ids] = np.minimum(before + counts, self.block_points)
+        full = np.flatnonzero(before + counts >= self.block_points)
+        for i in full:
+            series_id = ids[i]
+            self._seal(series_id)
+            rest = slice(first[i] + self.block_points - before[i], first[i] + counts[i])
+            rest_stamps, rest_values = stamps[rest], values[rest]
+            while len(rest_stamps):
+                take = min(self.block_points, len(rest_stamps))
+                self.stamps[series_id, :take] = rest_stamps[:take]
+                self.values[series_id, :take] = rest_values[:take]
+                self.size[series_id] = take
+                if take == self.block_points:
+                    self._seal(series_id)
+                rest_stamps, rest_values = rest_stamps[take:], rest_values[take:]
+        return len(full) > 0
+
+    def drop_before(self, stamp):
+        """Forget sealed blocks that end before stamp"""
+        for series_id, blocks in enumerate(self.sealed):
+            if blocks and blocks[0].end < stamp:
+                self.sealed[series_id] = [block for block in blocks if block.end >= stamp]
+
+    def read(self, series_id, start, end):
+        """(stamps, values) of one series in [start, end], time ordered"""
+        size = self.size[series_id]
+        parts = [(block.stamps, block.values) for block in self.sealed[series_id]
+                 if block.end >= start and block.start <= end]
+        parts.append((self.stamps[series_id, :size], self.values[series_id, :size]))
+        stamps = np.concatenate([part[0] for part in parts])
+        values = np.concatenate([part[1] for part in parts])
+        keep = (stamps >= start) & (stamps <= end)
+        order = np.argsort(stamps[keep], kind='stable')
+        return stamps[keep][order], values[keep][order]
+
+    @property
+    def nbytes(self):
+        sealed = sum(block.nbytes for blocks in self.sealed for block in blocks)
+        return sealed + self.stamps.nbytes + self.values.nbytes
+
+    @property
+    def used_nbytes(self):
+        """Bytes holding points: sealed blocks plus the filled part of the open ones"""
+        sealed = sum(block.nbytes for blocks in self.sealed for block in blocks)
+        return sealed + int(self.size.sum()) * (self.stamps.itemsize + self.values.itemsize)
+
+
+class RollupTier:
+    """count/sum/min/max per (time bucket, series), the latest buckets of them kept"""
+
+    def __init__(self, bucket_seconds, buckets):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_ns = int(bucket_seconds * 1e9)
+        self.buckets = buckets
+        self.bucket_ids = np.full(buckets, -1, dtype=np.int64)
+        self.head = None
+        self.count = np.zeros((buckets, 0), dtype=np.int32)
+        self.sum = np.zeros((buckets, 0), dtype=np.float64)
+        self.min = np.zeros((buckets, 0), dtype=np.float32)
+        self.max = np.zeros((buckets, 0), dtype=np.float32)
+
+    @property
+    def width(self):
+        return self.count.shape[1]
+
+    def grow(self, width):
+        """Make room for series ids below width"""
+        grow = width - self.width
+        if grow <= 0:
+            return
+        pad = ((0, 0), (0, grow))
+        self.count = np.pad(self.count, pad)
+        self.sum = np.pad(self.sum, pad)
+        self.min = np.pad(self.min, pad, constant_values=np.inf)
+        self.max = np.pad(self.max, pad, constant_values=-np.inf)
+
+    def _advance(self, newest):
+        """Move the head to bucket newest, recycling the slots that fall out of the window"""
+        if self.head is not None and newest <= self.head:
+            return
+        first = newest - self.buckets + 1 if self.head is None else max(self.head + 1, newest - self.buckets + 1)
+        ids = np.arange(first, newest + 1)
+        slots = ids % self.buckets
+        self.bucket_ids[slots] = ids
+        self.head = newest
+        if len(ids) == self.buckets and not self.count.any():
+            # Nothing written yet; the slots are still empty
+            return
+        self.count[slots] = 0
+        self.sum[slots] = 0
+        self.min[slots] = np.inf
+        self.max[slots] = -np.inf
+
+    def add(self, series, stamps, values):
+        """Fold in points sorted by series, then time"""
+        bucket = stamps // self.bucket_ns
+        self._advance(int(bucket.max()))
+        keep = bucket > self.head - self.buckets
+        series, bucket, values = series[keep], bucket[keep], values[keep]
+        if not len(series):
+            return
+        # Sorted input makes each (series, bucket) one run: reduce runs, then update distinct cells
+        starts = np.flatnonzero(np.r_[True, (np.diff(series) != 0) | (np.diff(bucket) != 0)])
+        cells = (bucket[starts] % self.buckets) * self.width + series[starts]
+        count, total = self.count.reshape(-1), self.sum.reshape(-1)
+        low, high = self.min.reshape(-1), self.max.reshape(-1)
+        count[cells] += np.diff(np.r_[starts, len(series)]).astype(np.int32)
+        total[cells] += np.add.reduceat(values, starts)
+        low[cells] = np.minimum(low[cells], np.minimum.reduceat(values, starts))
+        high[cells] = np.maximum(high[cells], np.maximum.reduceat(values, starts))
+
+    @property
+    def oldest(self):
+        """Start of the oldest bucket still kept, in ns"""
+        return None if self.head is None else (self.head - self.buckets + 1) * self.bucket_ns
+
+    def window(self, start, end, columns):
+        """Bucket start times in [start, end] and their count/sum/min/max for columns"""
+        if self.head is None:
+            empty = np.zeros((0, len(columns)))
+            return np.empty(0, dtype=np.int64), empty, empty, empty, empty
+        first = max(start // self.bucket_ns, self.head - self.buckets + 1)
+        ids = np.arange(first, min(end // self.bucket_ns, self.head) + 1)
+        ids = ids[self.bucket_ids[ids % self.buckets] == ids]
+        rows = np.ix_(ids % self.buckets, columns)
+        return ids * self.bucket_ns, self.count[rows], self.sum[rows], self.min[rows], self.max[rows]
+
+    @property
+    def nbytes(self):
+        return self.count.nbytes + self.sum.nbytes + self.min.nbytes + self.max.nbytes
+
+    @property
+    def used_nbytes(self):
+        """Bytes of the (bucket, series) cells that hold at least one point"""
+        cell = self.count.itemsize + self.sum.itemsize + self.min.itemsize + self.max.itemsize
+        return int(np.count_nonzero(self.count)) * cell
+
+
+class MetricStore:
+    """Thread-safe store of (host, metric) series with raw blocks and rollup tiers
+
+    Timestamps are anything pandas reads as datetimes (or int64 ns). Points
+    may arrive out of order; ones older than a tier's window are left out
+    of that tier.
+    """
+
+    def __init__(self, tiers=DEFAULT_TIERS, raw_seconds=3600, block_points=BLOCK_POINTS):
+        self.tiers = [RollupTier(seconds, buckets) for seconds, buckets in tiers]
+        self.raw_ns = int(raw_seconds * 1e9)
+        self.block_points = block_points
+        self.series = []
+        self.raw = RawBlocks(block_points)
+        self.points = 0
+        self.newest = None
+        self.last_stamps = np.zeros(0, dtype=np.int64)
+        self.last_values = np.zeros(0, dtype=np.float64)
+        self._ids = {}
+        self._lock = threading.RLock()
+
+    # Series catalog
+    def series_ids(self, hosts, metric):
+        """Ids of metric's series for hosts, registering new ones"""
+        with self._lock:
+            ids = []
+            for host in hosts:
+                key = (str(host), metric)
+                series_id = self._ids.get(key)
+                if series_id is None:
+                    series_id = self._ids[key] = len(self.series)
+                    self.series.append(key)
+                ids.append(series_id)
+            if len(self.series) > len(self.last_stamps):
+                grow = len(self.series) - len(self.last_stamps)
+                self.last_stamps = np.pad(self.last_stamps, (0, grow), constant_values=-1)
+                self.last_values = np.pad(self.last_values, (0, grow), constant_values=np.nan)
+                self.raw.grow(len(self.series))
+                for tier in self.tiers:
+                    tier.grow(len(self.series))
+            return np.array(ids, dtype=np.int64)
+
+    def hosts(self, metric=None):
+        return sorted({host for host, name in self.series if metric is None or name == metric})
+
+    def metrics(self):
+        return sorted({name for _, name in self.series})
+
+    def _columns(self, metric, hosts):
+        with self._lock:
+            if hosts is None:
+                hosts = self.hosts(metric)
+            pairs = [(host, self._ids[(str(host), metric)]) for host in hosts if (str(host), metric) in self._ids]
+        return [host for host, _ in pairs], np.array([series_id for _, series_id in pairs], dtype=np.int64)
+
+    # Writes
+    def append(self, series, timestamps, values):
+        """Write points given as aligned arrays of series ids, timestamps and values"""
+        series = np.asarray(series, dtype=np.int64)
+        stamps = _to_ns(timestamps)
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        series, stamps, values = series[valid], stamps[valid], values[valid]
+        if not len(series):
+            return 0
+        order = np.lexsort((stamps, series))
+        series, stamps, values = series[order], stamps[order], values[order]
+        with self._lock:
+            for tier in self.tiers:
+                tier.add(series, stamps, values)
+            newest = int(stamps.max())
+            self.newest = newest if self.newest is None else max(self.newest, newest)
+            cutoff = self.newest - self.raw_ns
+            ids, first = np.unique(series, return_index=True)
+            last = np.append(first[1:], len(series)) - 1
+            # Latest point per series
+            newer = stamps[last] >= self.last_stamps[ids]
+            self.last_stamps[ids[newer]] = stamps[last][newer]
+            self.last_values[ids[newer]] = values[last][newer]
+            keep = stamps >= cutoff
+            if keep.any() and self.raw.append(series[keep], stamps[keep], values[keep]):
+                self.raw.drop_before(cutoff)
+            self.points += len(series)
+        return len(series)
+
+    def append_wide(self, timestamps, hosts, columns):
+        """Write samples of many hosts: columns maps metric to values shaped (timestamps, hosts)
+
+        A single timestamp with one value per host works too.
+        """
+        stamps = np.atleast_1d(_to_ns(timestamps))
+        ids = np.concatenate([self.series_ids(hosts, metric) for metric in columns])
+        values = np.concatenate([np.asarray(values, dtype=np.float64).reshape(len(stamps), len(hosts))
+                                 for values in columns.values()], axis=1)
+        # One append for every metric: rows are timestamps, columns are (metric, host) series
+        return self.append(np.tile(ids, len(stamps)), np.repeat(stamps, len(ids)), values.reshape(-1))
+
+    # Queries
+    def tier_for(self, start, end, max_points=500, step=None):
+        """Rollup tier answering [start, end]: the finest covering it in at most max_points buckets"""
+        if step is not None:
+            return min(self.tiers, key=lambda tier: abs(tier.bucket_seconds - pd.Timedelta(step).total_seconds()))
+        start, end = _to_ns(start), _to_ns(end)
+        for tier in self.tiers:
+            covers = tier.oldest is not None and tier.oldest <= start
+            if covers and (end - start) // tier.bucket_ns <= max_points:
+                return tier
+        return self.tiers[-1]
+
+    def _range(self, start, end):
+        end = self.newest if end is None else int(_to_ns(end))
+        start = end - int(pd.Timedelta('1h').value) if start is None else int(_to_ns(start))
+        return start, end
+
+    def query(self, metric, start=None, end=None, hosts=None, agg='mean', max_points=500, step=None):
+        """One column per host of metric's agg per bucket, indexed by bucket start
+
+        The range defaults to the hour up to the newest point. Buckets with
+        no points are NaN.
+        """
+        with self._lock:
+            if self.newest is None:
+                return pd.DataFrame()
+            start, end = self._range(start, end)
+            hosts, columns = self._columns(metric, hosts)
+            tier = self.tier_for(start, end, max_points, step)
+            stamps, count, total, low, high = tier.window(start, end, columns)
+        values = _aggregate(agg, count, total, low, high)
+        frame = pd.DataFrame(values, index=pd.to_datetime(stamps), columns=hosts)
+        frame.index.name = 'timestamp'
+        frame.attrs['step'] = tier.bucket_seconds
+        return frame
+
+    def fleet(self, metric, start=None, end=None, hosts=None, max_points=500, step=None):
+        """metric over all hosts per bucket: mean, min, max and count columns"""
+        with self._lock:
+            if self.newest is None:
+                return pd.DataFrame(columns=list(AGGREGATES))
+            start, end = self._range(start, end)
+            _, columns = self._columns(metric, hosts)
+            tier = self.tier_for(start, end, max_points, step)
+            stamps, count, total, low, high = tier.window(start, end, columns)
+        count, total = count.sum(axis=1), total.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frame = pd.DataFrame({
+                'mean': np.where(count > 0, total / count, np.nan),
+                'min': np.where(count > 0, low.min(axis=1, initial=np.inf), np.nan),
+                'max': np.where(count > 0, high.max(axis=1, initial=-np.inf), np.nan),
+                'count': count,
+            }, index=pd.to_datetime(stamps))
+        frame.index.name = 'timestamp'
+        frame.attrs['step'] = tier.bucket_seconds
+        return frame
+
+    def raw_points(self, host, metric, start=None, end=None):
+        """Raw points of one series (within raw_seconds of the newest point)"""
+        with self._lock:
+            series_id = self._ids.get((str(host), metric))
+            if series_id is None or self.newest is None:
+                return pd.Series(dtype=np.float32)
+            start, end = self._range(start, end)
+            stamps, values = self.raw.read(series_id, start, end)
+        return pd.Series(values, index=pd.to_datetime(stamps), name=metric)
+
+    def latest(self, metric, hosts=None):
+        """Each host's latest value of metric, and its timestamp"""
+        hosts, columns = self._columns(metric, hosts)
+        with self._lock:
+            return pd.DataFrame({
+                'timestamp': pd.to_datetime(np.where(self.last_stamps[columns] >= 0, self.last_stamps[columns],
+                                                     np.iinfo(np.int64).min)),
+                'value': self.last_values[columns],
+            }, index=pd.Index(hosts, name='host'))
+
+    def stats(self):
+        """Series, points and memory by part
+
+        The *_bytes figures are allocated memory, most of it the rollup
+        rings sized for their whole window up front; used_bytes counts only
+        what holds points so far.
+        """
+        with self._lock:
+            raw_bytes = self.raw.nbytes
+            tier_bytes = sum(tier.nbytes for tier in self.tiers)
+            used_bytes = self.raw.used_nbytes + sum(tier.used_nbytes for tier in self.tiers)
+            series = len(self.series)
+            return {
+                'series': series,
+                'points': self.points,
+                'raw_bytes': raw_bytes,
+                'rollup_bytes': tier_bytes,
+                'used_bytes': used_bytes,
+                'bytes_per_series': (raw_bytes + tier_bytes) / series if series else 0.0,
+                'used_bytes_per_series': used_bytes / series if series else 0.0,
+            }
+
+    def __repr__(self):
+        return f"MetricStore({len(self.series):,} series, {self.points:,} points)"
+
+
+def _to_ns(timestamps):
+    """int64 ns of a timestamp or array of them"""
+    if isinstance(timestamps, (int, np.integer)):
+        return np.int64(timestamps)
+    if np.isscalar(timestamps) or isinstance(timestamps, (pd.Timestamp, np.datetime64)):
+        return np.int64(pd.Timestamp(timestamps).value)
+    array = np.asarray(timestamps)
+    if array.dtype.kind in 'iu':
+        return array.astype(np.int64)
+    return pd.to_datetime(array).as_unit('ns').asi8 if array.ndim else np.int64(pd.Timestamp(array.item()).value)
+
+
+def _aggregate(agg, count, total, low, high):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if agg == 'mean':
+            return np.where(count > 0, total / count, np.nan)
+        if agg == 'min':
+            return np.where(count > 0, low, np.nan)
+        if agg == 'max':
+            return np.where(count > 0, high, np.nan)
+        if agg == 'count':
+            return count
+    raise ValueError(f"Unknown aggregate {agg!r}; expected one of {AGGREGATES}")
@@ -0,0 +1,323 @@
+"""
+Declarative data-quality rules.
+
+A rule set is written as a plain dict keyed by column name, for example
+
+    {
+        'Sales Amount': {'type': 'numeric', 'min': 0},
+        'Region': {'in': ['North', 'South', 'East', 'West'], 'action': 'warn'},
+        'Order ID': {'unique': True},   # within each file
+    }
+
+and compiled into Rule objects. Every rule is a vectorized operation over a
+whole column of a chunk, never a loop over rows. RuleSet counts violations
+per rule across chunks and keeps a small sample of offending rows, so a
+report can be shown without re-reading the data.
+
+Rules with action 'reject' (the default) drop the offending rows; 'warn'
+rules only count them. Missing values are left to required columns and
+never count as a violation of the other rules, and rules on columns a
+file does not have are skipped for that file.
+"""
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+from portfolio_engine.ingest import DATE_SAMPLE_ROWS, ISO_DATE_PATTERN, SLASH_DATE_PATTERN
+
+SAMPLE_ROWS = 5
+ACTIONS = ('reject', 'warn')
+TYPE_CHECKS = ('numeric', 'integer', 'date')
+
+
+class RuleError(ValueError):
+    """Raised for an invalid rule specification"""
+
+
+class Rule:
+    """One check on one column; subclasses implement violations()"""
+
+    check = 'rule'
+
+    def __init__(self, column, action='reject'):
+        if action not in ACTIONS:
+            raise RuleError(f"unknown action {action!r} for {column}")
+        self.column = column
+        self.action = action
+
+    @property
+    def name(self):
+        return f"{self.column}: {self.describe()}"
+
+    def describe(self):
+        return self.check
+
+    def violations(self, series):
+        """Boolean numpy mask of the values of series that break the rule"""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r}, action={self.action!r})"
+
+
+class NotNullRule(Rule):
+    check = 'not_null'
+
+    def violations(self, series):
+        return series.isna().to_numpy()
+
+
+def _not_dates(series):
+    """Boolean numpy mask of the non-null values of series that are not dates
+
+    As in ingest.parse_date_series, one format is inferred from the first
+    non-null values and the column parsed with it in one pass; only the
+    values that fail it are parsed again with format='mixed', which tries
+    every format value by value. Values are parsed as UTC, so mixed
+    offsets don't raise.
+    """
+    text = series.astype('string')
+    present = text.notna().to_numpy()
+    head = text.iloc[np.flatnonzero(present)[:DATE_SAMPLE_ROWS]]
+    if head.str.match(ISO_DATE_PATTERN).all():
+        date_format = 'ISO8601'
+    elif head.str.match(SLASH_DATE_PATTERN).all():
+        date_format = None
+    else:
+        date_format = 'mixed'
+    bad = present & pd.to_datetime(text, errors='coerce', format=date_format, utc=True).isna().to_numpy()
+    if date_format != 'mixed' and bad.any():
+        bad[bad] = pd.to_datetime(text[bad], errors='coerce', format='mixed', utc=True).isna().to_numpy()
+    return bad
+
+
+class TypeRule(Rule):
+    check = 'type'
+
+    def __init__(self, column, kind, action='reject'):
+        if kind not in TYPE_CHECKS:
+            raise RuleError(f"unknown type {kind!r} for {column}; expected one of {', '.join(TYPE_CHECKS)}")
+        super().__init__(column, action)
+        self.kind = kind
+
+    def describe(self):
+        return f"type {self.kind}"
+
+    def violations(self, series):
+        present = series.notna().to_numpy()
+        if self.kind == 'date':
+            if pd.api.types.is_datetime64_any_dtype(series):
+                return np.zeros(len(series), dtype=bool)
+            return _not_dates(series)
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        bad = present & np.isnan(values)
+        if self.kind == 'integer':
+            with np.errstate(invalid='ignore'):
+                bad |= present & ~np.isnan(values) & (values != np.floor(values))
+        return bad
+
+
+class RangeRule(Rule):
+    check = 'range'
+
+    def __init__(self, column, min=None, max=None, action='reject'):
+        if min is None and max is None:
+            raise RuleError(f"range rule for {column} needs min and/or max")
+        super().__init__(column, action)
+        self.min = min
+        self.max = max
+
+    def describe(self):
+        if self.max is None:
+            return f">= {self.min}"
+        if self.min is None:
+            return f"<= {self.max}"
+        return f"between {self.min} and {self.max}"
+
+    def violations(self, series):
+        # Values that are not numbers at all are the type rule's business
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        bad = np.zeros(len(values), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            if self.min is not None:
+                bad |= values < self.min
+            if self.max is not None:
+                bad |= values > self.max
+        return bad
+
+
+class RegexRule(Rule):
+    check = 'regex'
+
+    def __init__(self, column, pattern, action='reject'):
+        super().__init__(column, action)
+        self.pattern = pattern
+
+    def describe(self):
+        return f"matches {self.pattern}"
+
+    def violations(self, series):
+        present = series.notna().to_numpy()
+        matched = series.astype('string').str.fullmatch(self.pattern).fillna(False).to_numpy(bool)
+        return present & ~matched
+
+
+class ReferentialRule(Rule):
+    """Values must occur in a reference set, such as the keys of another table"""
+
+    check = 'referential'
+
+    def __init__(self, column, values, action='reject'):
+        super().__init__(column, action)
+        self.values = pd.Index(pd.unique(pd.Series(list(values))))
+
+    def describe(self):
+        shown = ', '.join(map(str, self.values[:4]))
+        more = ', ...' if len(self.values) > 4 else ''
+        return f"in [{shown}{more}]"
+
+    def violations(self, series):
+        present = series.notna().to_numpy()
+        found = series.isin(self.values).to_numpy()
+        if pd.api.types.is_numeric_dtype(self.values) and not pd.api.types.is_numeric_dtype(series):
+            # Numeric keys read from a text column, e.g. "42"
+            found |= pd.to_numeric(series, errors='coerce').isin(self.values).to_numpy()
+        return present & ~found
+
+
+class UniqueRule(Rule):
+    """Values must not repeat within one file
+
+    Each file is checked on its own, by the worker that reads it: the same
+    value in two files is not a violation (the pipeline's cross-file
+    dedupe only drops whole duplicate rows), and a file resumed from a
+    checkpoint is only checked from the chunk it resumed at.
+    """
+
+    check = 'unique'
+
+    def __init__(self, column, action='reject'):
+        super().__init__(column, action)
+        self.seen = np.empty(0, dtype=np.uint64)
+
+    def describe(self):
+        return 'unique per file'
+
+    def violations(self, series):
+        present = series.notna().to_numpy()
+        values = series.astype('float64') if pd.api.types.is_numeric_dtype(series) else series
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        bad = present & pd.Series(hashes).duplicated().to_numpy()
+        new = np.unique(hashes[present])
+        if len(self.seen):
+            # Merge into the sorted seen hashes; np.union1d would re-sort all of them
+            pos = np.searchsorted(self.seen, new)
+            known = self.seen[np.minimum(pos, len(self.seen) - 1)] == new
+            bad |= present & np.isin(hashes, new[known])
+            new, pos = new[~known], pos[~known]
+            self.seen = np.insert(self.seen, pos, new)
+        else:
+            self.seen = new
+        return bad
+
+
+def build_rules(spec):
+    """Compile a {column: {check: argument}} spec into a list of rules"""
+    rules = []
+    for column, checks in spec.items():
+        checks = dict(checks)
+        action = checks.pop('action', 'reject')
+        if checks.pop('required', False):
+            rules.append(NotNullRule(column, action))
+        if 'type' in checks:
+            rules.append(TypeRule(column, checks.pop('type'), action))
+        if 'min' in checks or 'max' in checks:
+            rules.append(RangeRule(column, checks.pop('min', None), checks.pop('max', None), action))
+        if 'regex' in checks:
+            rules.append(RegexRule(column, checks.pop('regex'), action))
+        if 'in' in checks:
+            rules.append(ReferentialRule(column, checks.pop('in'), action))
+        if checks.pop('unique', False):
+            rules.append(UniqueRule(column, action))
+        if checks:
+            raise RuleError(f"unknown checks for {column}: {', '.join(checks)}")
+    return rules
+
+
+class RuleSet:
+    """Evaluates rules chunk by chunk, counting violations and sampling bad rows"""
+
+    def __init__(self, rules, sample_rows=SAMPLE_ROWS):
+        # Copies, so stateful rules (unique) never leak between rule sets
+        self.rules = build_rules(rules) if isinstance(rules, dict) else [copy.copy(rule) for rule in rules]
+        self.sample_rows = sample_rows
+        self.checked = {rule.name: 0 for rule in self.rules}
+        self.counts = {rule.name: 0 for rule in self.rules}
+        self.samples = {rule.name: [] for rule in self.rules}
+
+    def evaluate(self, chunk):
+        """Return the chunk without rejected rows, and how many were rejected
+
+        The chunk's index is kept in the samples, so for chunks read with
+        pd.read_csv it is the row's position in the file.
+        """
+        rejected = np.zeros(len(chunk), dtype=bool)
+        for rule in self.rules:
+            if rule.column not in chunk.columns:
+                continue
+            self.checked[rule.name] += len(chunk)
+            bad = rule.violations(chunk[rule.column])
+            count = int(bad.sum())
+            if not count:
+                continue
+            self.counts[rule.name] += count
+            sampled = sum(len(sample) for sample in self.samples[rule.name])
+            if sampled < self.sample_rows:
+                self.samples[rule.name].append(chunk[bad].head(self.sample_rows - sampled))
+            if rule.action == 'reject':
+                rejected |= bad
+        if not rejected.any():
+            return chunk, 0
+        return chunk[~rejected], int(rejected.sum())
+
+    def report(self):
+        """Per-rule results as a list of plain dicts, cheap to pickle and merge"""
+        return [
+            {
+                'rule': rule.name,
+                'column': rule.column,
+                'check': rule.check,
+                'action': rule.action,
+                'checked': self.checked[rule.name],
+                'violations': self.counts[rule.name],
+                'sample': pd.concat(self.samples[rule.name]) if self.samples[rule.name] else pd.DataFrame(),
+            }
+            for rule in self.rules
+        ]
+
+
+def merge_reports(reports, sample_rows=SAMPLE_ROWS):
+    """Combine per-file rule reports into one, summing counts and samples"""
+    merged = {}
+    for report in reports:
+        for entry in report:
+            current = merged.get(entry['rule'])
+            if current is None:
+                merged[entry['rule']] = dict(entry, sample=entry['sample'].head(sample_rows))
+                continue
+            current['checked'] += entry['checked']
+            current['violations'] += entry['violations']
+            if len(current['sample']) < sample_rows and not entry['sample'].empty:
+                extra = entry['sample'].head(sample_rows - len(current['sample']))
+                current['sample'] = extra if current['sample'].empty else pd.concat([current['sample'], extra])
+    return list(merged.values())
+
+
+def report_frame(report):
+    """Summary table of a rule report, one row per rule"""
+    columns = ['rule', 'action', 'checked', 'violations']
+    frame = pd.DataFrame([{col: entry[col] for col in columns} for entry in report], columns=columns)
+    frame['violation_rate'] = frame['violations'] / frame['checked'].where(frame['checked'] > 0)
+    return frame
@@ -1201,6 +1201,16 @@ import json
 from datetime import datetime, timedelta
 import base64
 from pathlib import Path
+import os
+import sys
+
+# Shared engines live in portfolio_engine/ at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from portfolio_engine.ingest import stream_csv_profile, profile_dataframe
+from portfolio_engine.log_stats import LogAggregates
+from portfolio_engine.storage import (
+    profile_upload_cached, read_upload_cached, spill_dataset
+)
 
 # Page configuration
 st.set_page_config(
@@ -1412,6 +1422,35 @@ def create_project_timeline():
     fig.update_layout(height=300, template="plotly_white")
     return fig
 
+def show_profile_metrics(profile, slots):
+    """Render the overview metrics of a (possibly still loading) CSV profile"""
+    slots[0].metric("Rows", f"{profile.rows:,}")
+    slots[1].metric("Columns", len(profile.columns))
+    slots[2].metric("Missing Values", f"{profile.missing_total:,}")
+    # Footprint after dtype optimization, compared with plain pd.read_csv
+    saved = None
+    if profile.memory_reduction > 0:
+        saved = f"-{profile.memory_reduction:.0%} vs {profile.raw_memory_bytes / 1024:.1f} KB raw"
+    slots[3].metric("Memory Usage", f"{profile.memory_bytes / 1024:.1f} KB", saved, delta_color="inverse")
+
+def stream_upload_profile(uploaded_file, slots):
+    """Profile an upload chunk by chunk, refreshing the metrics as each chunk lands"""
+    progress_bar = st.progress(0.0)
+    profile = None
+    for profile in stream_csv_profile(uploaded_file):
+        show_profile_metrics(profile, slots)
+        progress_bar.progress(profile.progress or 0.0)
+    progress_bar.empty()
+    return profile
+
+def show_upload_profile(uploaded_file, slots):
+    """Stream-profile an upload once; later reruns and sessions reuse the (read-only) profile"""
+    profile, cached = profile_upload_cached(uploaded_file, lambda upload: stream_upload_profile(upload, slots),
+                                            st.session_state.setdefault('upload_digests', {}))
+    if cached:
+        show_profile_metrics(profile, slots)
+    return profile
+
 # Main application
 def main():
     """Main portfolio application"""
@@ -1728,23 +1767,16 @@ def show_projects_page():
             **Technical Architecture:**
             ```python
             # Sample ETL Pipeline Code
-            import pandas as pd
-            from sqlalchemy import create_engine
-            
-            def process_csv_files(file_paths):
-                consolidated_data = []
-                
-                for file_path in file_paths:
-                    # Read and validate data
-                    df = pd.read_csv(file_path)
-                    df_clean = validate_and_clean(df)
-                    consolidated_data.append(df_clean)
+            from portfolio_engine.etl import SQLiteSink, run_pipeline
+            
+            def process_csv_files(file_paths, db_path):
+                # validate -> clean -> dedupe -> transform run per file
+                # in worker processes; chunks are bulk-inserted in
+                # batched transactions without concatenating the batch
+                sink = SQLiteSink(db_path, 'sales_data')
+                result = run_pipeline(file_paths, sink=sink)
                 
-                # Consolidate and load
-                final_df = pd.concat(consolidated_data)
-                load_to_database(final_df)
-                
-                return processing_stats
+                return result.file_summary(), sink.rows_per_second
             ```
             
             **Performance Metrics:**
@@ -1844,7 +1876,7 @@ def show_projects_page():
         uploaded_file = st.file_uploader("Upload a CSV file to analyze", type="csv")
         
         if uploaded_file is not None:
-            df = pd.read_csv(uploaded_file)
+            df = read_upload_cached(uploaded_file, st.session_state.setdefault('upload_digests', {}))
             
             st.markdown("#### 📈 Quick Data Overview")
             col1, col2, col3 = st.columns(3)
@@ -1902,10 +1934,18 @@ def show_projects_page():
             st.plotly_chart(fig, use_container_width=True)
         
         with col2:
-            # Response time trend
-            hourly_avg = log_data.groupby(log_data['timestamp'].dt.hour)['response_time'].mean()
-            fig = px.bar(x=hourly_avg.index, y=hourly_avg.values,
-                        title='Average Response Time by Hour')
+            # Response time percentiles per hour, from mergeable sketches
+            stats = LogAggregates(bucket_seconds=3600, buckets=24)
+            stats.add(pd.DataFrame({
+                'timestamp': log_data['timestamp'],
+                'level': log_data['log_level'],
+                'service': 'app',
+                'response_time': log_data['response_time'],
+                'status': log_data['status_code'],
+            }))
+            hourly = stats.percentiles_by_bucket()
+            fig = px.line(hourly, x='timestamp', y=['p50', 'p95', 'p99'],
+                          title='p50 / p95 / p99 Response Time by Hour')
             st.plotly_chart(fig, use_container_width=True)
     
     with categories[3]:  # Analytics
@@ -2482,11 +2522,10 @@ def show_demos_page():
                               ["📁 Upload your file", "📊 Sample sales data", "📈 Sample web analytics"])
         
         df = None
+        uploaded_file = None
         
         if data_source == "📁 Upload your file":
             uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
-            if uploaded_file is not None:
-                df = pd.read_csv(uploaded_file)
         
         elif data_source == "📊 Sample sales data":
             # Generate sample sales data
@@ -2505,28 +2544,29 @@ def show_demos_page():
             df = generate_sample_analytics_data()
             df.columns = ['date', 'page_views', 'unique_visitors', 'bounce_rate', 'conversion_rate']
         
-        if df is not None:
+        if df is not None or uploaded_file is not None:
             st.markdown("### 📋 Data Overview")
             
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Rows", len(df))
-            with col2:
-                st.metric("Columns", len(df.columns))
-            with col3:
-                st.metric("Missing Values", df.isnull().sum().sum())
-            with col4:
-                st.metric("Memory Usage", f"{df.memory_usage(deep=True).sum() / 1024:.1f} KB")
+            # Uploads stream in chunk by chunk and only keep a bounded sample
+            metric_slots = [col.empty() for col in st.columns(4)]
+            if uploaded_file is not None:
+                profile = show_upload_profile(uploaded_file, metric_slots)
+                df = profile.sample
+            else:
+                profile = profile_dataframe(df)
+                show_profile_metrics(profile, metric_slots)
             
             # Data preview
             st.markdown("### 👀 Data Preview")
-            st.dataframe(df.head(10), use_container_width=True)
+            st.dataframe(profile.head, use_container_width=True)
             
             # Interactive exploration
             st.markdown("### 🔍 Interactive Analysis")
+            if profile.is_sampled:
+                st.caption(f"Charts use a uniform sample of {len(df):,} of {profile.rows:,} rows")
             
             numeric_columns = df.select_dtypes(include=[np.number]).columns.tolist()
-            categorical_columns = df.select_dtypes(include=['object']).columns.tolist()
+            categorical_columns = df.select_dtypes(include=['object', 'category']).columns.tolist()
             
             col1, col2 = st.columns(2)
             
@@ -2554,7 +2594,7 @@ def show_demos_page():
             
             # Statistical summary
             st.markdown("### 📊 Statistical Summary")
-            st.dataframe(df.describe(), use_container_width=True)
+            st.dataframe(profile.describe(), use_container_width=True)
     
     with demo_tabs[2]:  # Dashboard Builder
         st.markdown("## 📊 Interactive Dashboard Builder")